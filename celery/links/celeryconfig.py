@@ -7,3 +7,6 @@ result_expires = timedelta(minutes=5)
 imports = ("extract_links_task",)
 task_ignore_result = True
 worker_prefetch_multiplier = 10  # default is 4
+# Links are sent from the extract to the index tasks as compressed columns (wbdsm.links.links_codec)
+task_serializer = "wbdsm_links"
+accept_content = ["wbdsm_links", "json"]
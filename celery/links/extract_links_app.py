@@ -1,26 +1,21 @@
 import logging
-import time
 from datetime import datetime
 
-import pymongo
-from celeryconfig import broker_url
 from extract_links_worker import app
 from extract_links_task import extract_links_task, index_links_task
-from flower.utils.broker import Broker
+from flow_control import ChunkCredits, InFlightWindow
 from pymongo import MongoClient
 
 from celery import chain
+from wbdsm.links.chunk_ledger import ChunkLedger, get_chunk_id
+from wbdsm.links.chunk_plan import PAGES_INDEX, get_plan
+from wbdsm.links.index_links import create_links_indexes
+from wbdsm.links.title_resolver import TitleResolver
 from wbdsm.wbdsm_arg_parser import WBDSMArgParser
-import asyncio
 
 logger = logging.getLogger(__name__)
 
 
-def get_queue_size(broker, queue_name):
-    queue = asyncio.run(broker.queues([queue_name]))
-    return queue[0]["messages"]
-
-
 if __name__ == "__main__":
     #
 
@@ -34,91 +29,77 @@ if __name__ == "__main__":
 
     client = MongoClient(mongo_uri)
     pages = client[db_name]["pages"]
-    query = {"isRedirect": False}
     CHUNK_SIZE = 500
     #
-    mentions_batch = []
     initial = datetime.now()
     #
-    page_batch = []
     all_jobs = []
     # To check if the app is working
     i = app.control.inspect()
-    # to track the status of the tasks
-    broker = Broker(broker_url)
-    index_queue_size = get_queue_size(broker, "links_to_index")
+    # The pages indexes are read by the extraction (chunks and links targets queries), they can't be deferred
     # Create compound index between pageID and isRedirect
-    pages.create_index([("isRedirect", pymongo.DESCENDING), ("pageID", pymongo.ASCENDING)])
+    pages.create_index(PAGES_INDEX)
     # Create title index - used to find pages by title given in links
     pages.create_index("title")
-    # Do first page
-    if not last_id:
-        last_id = pages.find_one({"isRedirect": False}, sort=[("pageID", 1)])["pageID"]
-        articles = list(pages.find({"isRedirect": False}).sort("pageID", 1).limit(1))
-    else:
-        # Note that last_id must be already encoded - kept in this way to make it easier to recover from a crash (logs are in encoded form)
-        articles = list(pages.find({"pageID": {"$gte": last_id}, "isRedirect": False}).sort("pageID", 1).limit(1))
-
-    all_jobs.append(
-        chain(
-            extract_links_task.s(articles[0]["pageID"], CHUNK_SIZE),
-            index_links_task.s(),
-        ).apply_async()
+    # Snapshot of titles/redirects loaded by the workers to resolve the links without querying mongo
+    if args["title_resolver_path"]:
+        TitleResolver.from_collection(pages, args["title_resolver_path"]).close()
+    # pageID boundaries of all the chunks, computed in a single pass over the (isRedirect, pageID) index
+    # Note that last_id must be already encoded - kept in this way to make it easier to recover from a crash (logs are in encoded form)
+    boundaries = get_plan(
+        pages, CHUNK_SIZE, plan_path=args["plan_path"], last_page_id=last_id
     )
+    # State of each chunk, on restart only the chunks not indexed yet are dispatched
+    ledger = ChunkLedger(client[db_name]["chunk_ledger"])
+    if args["reset_ledger"]:
+        ledger.reset()
+    boundaries = ledger.plan(boundaries, CHUNK_SIZE)
+    # Chunks dispatched and not indexed yet, acked by the workers
+    # The ones not acked in ack_timeout (i.g. dead worker) are marked as failed, to be dispatched again on restart
+    credits = ChunkCredits()
+    credits.reset()
+    window = InFlightWindow(
+        credits,
+        args["max_in_flight"],
+        ack_timeout=args["ack_timeout"] or None,
+        on_expired=lambda chunk_id: ledger.mark_failed(chunk_id, "Not acked in time"),
+    )
+
     n_pages = 0
-    while articles:
-        #        debug = extract_links_task(skip=articles[-1]["pageID"], limit=CHUNK_SIZE)
+    for n_chunk, boundary in enumerate(boundaries):
+        #        debug = extract_links_task(skip=boundary, limit=CHUNK_SIZE)
         #        test = index_links_task(links=debug)
-        articles = list(
-            pages.find({"pageID": {"$gt": articles[0]["pageID"]}, "isRedirect": False})
-            .sort("pageID", 1)
-            .limit(1)
-            .skip(CHUNK_SIZE - 1)
-        )
-        if not articles:
-            break
+        # Avoid memory overflow - a new chunk is only sent when one of the in flight chunks is done
+        window.wait_credit()
+        chunk_id = get_chunk_id(boundary)
+        window.add(chunk_id)
+        ledger.mark_dispatched(chunk_id)
         all_jobs.append(
             chain(
-                extract_links_task.s(articles[0]["pageID"], CHUNK_SIZE),
-                index_links_task.s(),
+                extract_links_task.s(boundary, CHUNK_SIZE, chunk_id=chunk_id),
+                index_links_task.s(chunk_id=chunk_id),
             ).apply_async()
         )
         n_pages = n_pages + CHUNK_SIZE
-        logger.info(f"Processed {n_pages} pages")
-        page_batch = []
-        # Avoid memory overflow
-        if n_pages % 50000 == 0:
-            index_queue_size = get_queue_size(broker, "links_to_index")
-            logger.info(f"Index Queue size: {index_queue_size}")
-            while index_queue_size > 50:
-                index_queue_size = get_queue_size(broker, "links_to_index")
-                logger.info(f"Index Queue size: {index_queue_size}")
-                time.sleep(1)
-
-            extract_queue_size = get_queue_size(broker, "links_to_extract")
-            logger.info(f"Extract Queue size: {extract_queue_size}")
-            # Wait to reduce queue
-            while extract_queue_size > 50:
-                extract_queue_size = get_queue_size(broker, "links_to_extract")
-                logger.info(f"Extract Queue size: {extract_queue_size}")
-                time.sleep(1)
+        logger.info(
+            f"Processed {n_pages} pages (chunk {n_chunk + 1}/{len(boundaries)}, pageID {boundary}, "
+            f"{window.n_done} indexed, {len(window.in_flight)} in flight)"
+        )
 
     # Wait to finish all jobs
     # Could use results backend but given the size of the data, it is not worth it
     # Easily we can overflow redis memory
-    indexing_jobs = get_queue_size(broker, "links_to_index")
-    extract_jobs = get_queue_size(broker, "links_to_extract")
-    jobs = indexing_jobs + extract_jobs
-    while jobs:
-        time.sleep(1)
-        indexing_jobs = get_queue_size(broker, "links_to_index")
-        extract_jobs = get_queue_size(broker, "links_to_extract")
-        jobs = indexing_jobs + extract_jobs
-        logger.info(f"Jobs: {jobs}")
-
-    # 1 minute sleep to be sure - increase if chunk is too big
-    time.sleep(60)
+    window.drain()
+    if window.failed:
+        logger.error(f"{len(window.failed)} chunks failed, pageIDs: {window.failed}")
     app.control.shutdown()
+    logger.info(f"Links indexed in {datetime.now() - initial}")
+    logger.info(f"Chunks by state: {ledger.summary()}")
+
+    # Links indexes, only built here if the workers were started with BULK_LOAD=True
+    index_time = datetime.now()
+    create_links_indexes(client[db_name]["links"])
+    logger.info(f"Links indexes built in {datetime.now() - index_time}")
 
     logger.info(f"Finished in {datetime.now() - initial}")
     logger.info(f"Processed {n_pages} pages")
@@ -8,16 +8,25 @@ Couldn't send arguments to celery worker, therefore we need to change the langua
 """
 
 import logging
+import os
 from typing import List
 
-import pymongo
 from extract_links_worker import app
+from flow_control import CHUNK_FAILED, ChunkCredits
 from pymongo import MongoClient
 
 from celery import Task, bootsteps
 from wbdsm.documents import Page
+from wbdsm.links.chunk_ledger import ChunkLedger
+from wbdsm.links.chunk_plan import get_chunk_pages
 from wbdsm.links.extract_links import extract_links
-from wbdsm.links.index_links import index_links
+from wbdsm.links.index_links import (
+    DEFAULT_BATCH_SIZE,
+    create_links_indexes,
+    index_links,
+)
+from wbdsm.links.links_parquet import write_links_parquet
+from wbdsm.links.title_resolver import CollectionTitleResolver, TitleResolver
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +37,21 @@ class IndexLinks(Task):
 
     mongo_uri = "mongodb://localhost:27017/"
     language = "de"
+    # Snapshot built by extract_links_app.py, if None links are resolved querying the pages collection
+    title_resolver_path = os.environ.get("TITLE_RESOLVER_PATH")
+    # Resolve the links with the resolved_titles collection (scripts/resolve_redirects.py)
+    use_resolved_titles = os.environ.get("USE_RESOLVED_TITLES", "False") == "True"
+    # "insert" for append-only loads into an empty links collection, "upsert" to re-index
+    index_mode = os.environ.get("INDEX_MODE", "upsert")
+    index_batch_size = int(os.environ.get("INDEX_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+    # "mongo" to write the links to the links collection, "parquet" to write them to part files of LINKS_PARQUET_DIR
+    links_sink = os.environ.get("LINKS_SINK", "mongo")
+    links_parquet_dir = os.environ.get("LINKS_PARQUET_DIR")
+    # Ingest with only the _id index, the app builds the links indexes once the queues are drained
+    bulk_load = os.environ.get("BULK_LOAD", "False") == "True"
+    # Maintain the link_counts collection (wbdsm.links.ranking) while indexing
+    count_links = os.environ.get("COUNT_LINKS", "True") == "True"
+    _title_resolver = None
 
     def __init__(self) -> None:
         super().__init__()
@@ -46,11 +70,27 @@ class IndexLinks(Task):
         client = MongoClient(self.mongo_uri)
         self.links_collection = client[db_name]["links"]
         self.pages_collection = client[db_name]["pages"]
-        self.links_collection.create_index([("links_to", pymongo.HASHED)])
-        self.links_collection.create_index([("source_doc", pymongo.HASHED)])
-        self.links_collection.create_index([("text", pymongo.HASHED)])
+        self.resolved_titles_collection = client[db_name]["resolved_titles"]
+        self.chunk_credits = ChunkCredits()
+        self.chunk_ledger = ChunkLedger(client[db_name]["chunk_ledger"])
+        if not self.bulk_load:
+            create_links_indexes(self.links_collection)
         print("loaded")
 
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # A failed chunk is acked, otherwise the app would wait for it forever. It's dispatched again on the next run
+        chunk_id = kwargs.get("chunk_id")
+        if chunk_id is not None:
+            self.chunk_ledger.mark_failed(chunk_id, repr(exc))
+            self.chunk_credits.ack(chunk_id, CHUNK_FAILED)
+
+    @property
+    def title_resolver(self):
+        # Loaded on first use, so each forked process maps the same snapshot file
+        if self.title_resolver_path and self._title_resolver is None:
+            self._title_resolver = TitleResolver(self.title_resolver_path)
+        return self._title_resolver
+
 
 # https://stackoverflow.com/questions/27070485/initializing-a-worker-with-arguments-using-celery
 # Make bootstep to add custom arguments
@@ -75,7 +115,9 @@ class CustomArgs(bootsteps.StartStopStep):
         # our step is started together with all other Worker/Consumer
         # bootsteps.
         print("{0!r} is starting".format(parent))
-        parent.app.tasks["index_links_task"].init_after_bootsteps(self.language, self.mongo_uri)
+        parent.app.tasks["index_links_task"].init_after_bootsteps(
+            self.language, self.mongo_uri
+        )
 
     def stop(self, parent):
         # the Consumer calls stop every time the consumer is
@@ -102,7 +144,14 @@ app.steps["consumer"].add(CustomArgs)
     language=None,
     mongo_uri=None,
 )
-def extract_links_task(self, skip: str, limit: int, min_query_size: int = 50):
+def extract_links_task(
+    self,
+    skip: str,
+    limit: int,
+    min_query_size: int = 50,
+    batch_resolve: bool = True,
+    chunk_id: str = None,
+):
     """
     Celery task to extract links from wikipedia articles.
     The skip and limit parameters are used to paginate the query to the database.
@@ -112,16 +161,35 @@ def extract_links_task(self, skip: str, limit: int, min_query_size: int = 50):
         skip (str): Skip articles with id lower than this
         limit (int): Number of articles to parse
         min_query_size (int, optional): Min size of the query (in chars) to be considered. Defaults to 50. Values lower than this will be ignored.
+        batch_resolve (bool, optional): Resolve the links targets of the chunk with a few "$in" queries instead of one query per link. Defaults to True.
+        chunk_id (str, optional): Id of the chunk on the ledger and on the app's in flight window.
     """
     # First
     logger.info("Getting articles from pages collection")
     # Get pages from pages collection
-    pages = list(
-        self.pages_collection.find({"isRedirect": False, "pageID": {"$gt": skip}}).sort("pageID", 1).limit(limit)
-    )
+    pages = get_chunk_pages(self.pages_collection, skip, limit)
     # Transform in dataclasses to make it easier to work with and encapsulate parsing/cleaning logic
     pages_obj = [Page.from_mongo(page, self.language) for page in pages]
-    links = extract_links(pages_obj, pages_collection=self.pages_collection, min_query_size=min_query_size)
+    title_resolver = self.title_resolver
+    resolved_titles_collection = (
+        self.resolved_titles_collection if self.use_resolved_titles else None
+    )
+    if (
+        title_resolver is None
+        and resolved_titles_collection is not None
+        and not batch_resolve
+    ):
+        title_resolver = CollectionTitleResolver(resolved_titles_collection)
+    links = extract_links(
+        pages_obj,
+        pages_collection=self.pages_collection,
+        min_query_size=min_query_size,
+        title_resolver=title_resolver,
+        batch_resolve=batch_resolve,
+        resolved_titles_collection=resolved_titles_collection,
+    )
+    if chunk_id is not None:
+        self.chunk_ledger.mark_extracted(chunk_id, len(links))
     return links
 
 
@@ -134,8 +202,22 @@ def extract_links_task(self, skip: str, limit: int, min_query_size: int = 50):
     mongo_uri=None,
     name="index_links_task",
 )
-def index_links_task(self, links: List[dict]):
+def index_links_task(self, links: List[dict], chunk_id: str = None):
     """
-    Index links in the database
+    Index links in the database.
+    If chunk_id is given, the chunk is marked as indexed on the ledger and acked to the app's in flight window.
     """
-    index_links(links, self.links_collection)
+    if self.links_sink == "parquet":
+        counts = write_links_parquet(links, self.links_parquet_dir, part=chunk_id)
+    else:
+        counts = index_links(
+            links,
+            self.links_collection,
+            mode=self.index_mode,
+            batch_size=self.index_batch_size,
+            count_links=self.count_links,
+        )
+    logger.info(f"Indexed links: {counts}")
+    if chunk_id is not None:
+        self.chunk_ledger.mark_indexed(chunk_id, counts)
+        self.chunk_credits.ack(chunk_id)
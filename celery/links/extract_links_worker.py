@@ -3,6 +3,10 @@ from datetime import timedelta
 
 from celery import Celery, Task, bootsteps
 from click import Option
+from wbdsm.links.links_codec import register_links_serializer
+
+# Needed before loading the config, it's the tasks serializer
+register_links_serializer()
 
 app = Celery(
     "Extract mentions project",
@@ -0,0 +1,137 @@
+"""
+Credit-based flow control between the extract_links_app and the workers.
+
+The app keeps at most N chunks in flight. Each chunk is acked (RPUSH on a redis list) by the index task when its links are
+indexed, or by the extract task if it fails, and the app waits for the acks (BLPOP) to dispatch the next chunks and to
+know when all of them are done.
+A chunk not acked within ack_timeout seconds (i.g. its worker died) is given up: it's marked as failed, so it's
+dispatched again on the next run of the app (only the chunks not indexed on the ledger are dispatched).
+"""
+import logging
+import time
+from typing import Callable, Optional, Tuple
+
+import redis
+from celeryconfig import broker_url
+
+logger = logging.getLogger(__name__)
+
+ACKS_KEY = "wbdsm:links:chunk_acks"
+CHUNK_DONE = "done"
+CHUNK_FAILED = "failed"
+
+
+class ChunkCredits:
+    def __init__(self, redis_url: str = broker_url, key: str = ACKS_KEY):
+        self.redis = redis.Redis.from_url(redis_url)
+        self.key = key
+
+    def reset(self) -> None:
+        """Drop the acks of previous runs."""
+        self.redis.delete(self.key)
+
+    def ack(self, chunk_id: str, status: str = CHUNK_DONE) -> None:
+        self.redis.rpush(self.key, f"{status}:{chunk_id}")
+
+    def wait(self, timeout: int = 60) -> Optional[Tuple[str, str]]:
+        """
+        Wait for the next ack, returns (status, chunk_id) or None on timeout.
+        """
+        ack = self.redis.blpop([self.key], timeout=timeout)
+        if ack is None:
+            return None
+        status, chunk_id = ack[1].decode().split(":", 1)
+        return status, chunk_id
+
+
+class InFlightWindow:
+    """
+    Bounded window of chunks dispatched and not acked yet.
+
+    Args:
+        timeout (int): Seconds of each wait for an ack, a warning is logged when it expires.
+        ack_timeout (float, optional): Seconds after its dispatch to give up a chunk not acked. None to wait forever.
+        on_expired (Callable, optional): Called with the id of each chunk given up, i.g. to mark it as failed on the ledger.
+    """
+
+    def __init__(
+        self,
+        credits: ChunkCredits,
+        size: int,
+        timeout: int = 60,
+        ack_timeout: Optional[float] = None,
+        on_expired: Optional[Callable[[str], None]] = None,
+    ):
+        self.credits = credits
+        self.size = size
+        self.timeout = timeout
+        self.ack_timeout = ack_timeout
+        self.on_expired = on_expired
+        # chunk id -> dispatch time, in dispatch order
+        self.in_flight = {}
+        self.n_done = 0
+        self.failed = []
+
+    def add(self, chunk_id: str) -> None:
+        self.in_flight[chunk_id] = time.monotonic()
+
+    def expire(self) -> int:
+        """
+        Give up the chunks dispatched more than ack_timeout seconds ago (the oldest ones), they are moved to failed.
+        Returns the number of chunks given up.
+        """
+        if self.ack_timeout is None:
+            return 0
+        deadline = time.monotonic() - self.ack_timeout
+        expired = []
+        # In dispatch order, stops at the first chunk still on time
+        for chunk_id, dispatched_at in self.in_flight.items():
+            if dispatched_at >= deadline:
+                break
+            expired.append(chunk_id)
+        for chunk_id in expired:
+            logger.error(
+                f"Chunk {chunk_id} not acked in {self.ack_timeout}s, giving up"
+            )
+            del self.in_flight[chunk_id]
+            self.failed.append(chunk_id)
+            if self.on_expired is not None:
+                self.on_expired(chunk_id)
+        return len(expired)
+
+    def wait_one(self) -> None:
+        """
+        Wait for an ack, or until the oldest chunks are given up. The chunks past their deadline are given up first, so
+        a dead chunk doesn't keep its slot while the others are acked.
+        """
+        if self.expire():
+            return
+        ack = self.credits.wait(self.timeout)
+        while ack is None:
+            logger.warning(
+                f"No chunk acked in {self.timeout}s, {len(self.in_flight)} in flight"
+            )
+            if self.expire():
+                return
+            ack = self.credits.wait(self.timeout)
+        status, chunk_id = ack
+        if chunk_id not in self.in_flight:
+            # i.g. a chunk retried by celery and acked twice, or acked after being given up
+            logger.warning(f"Ack of unknown chunk {chunk_id} ({status})")
+            return
+        del self.in_flight[chunk_id]
+        if status == CHUNK_FAILED:
+            logger.error(f"Chunk {chunk_id} failed")
+            self.failed.append(chunk_id)
+        else:
+            self.n_done += 1
+
+    def wait_credit(self) -> None:
+        """Block until there is room for a new chunk."""
+        while len(self.in_flight) >= self.size:
+            self.wait_one()
+
+    def drain(self) -> None:
+        """Block until all the chunks are acked."""
+        while self.in_flight:
+            self.wait_one()
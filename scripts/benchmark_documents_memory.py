@@ -0,0 +1,156 @@
+"""
+Memory used by the parsed documents (wbdsm.documents), in bytes per parsed page.
+
+The same pages are parsed with Page.from_mongo of the current wbdsm.documents and of a baseline version of the module
+while tracing the allocations. The baseline is wbdsm/documents.py of the first commit of the repository by default, of
+--baseline_rev or of --baseline_path otherwise. The titles cache (title_codec) is disabled on both runs, so only the
+pages are counted.
+Uses --n_pages pages from mongoDB if --language is given, synthetic pages otherwise.
+
+Example:
+    python scripts/benchmark_documents_memory.py --n_pages 500
+"""
+
+
+import copy
+import importlib.util
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import tracemalloc
+
+from pymongo import MongoClient
+
+from wbdsm.documents import Page
+from wbdsm.preprocessing import title_codec
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+
+logger = logging.getLogger(__name__)
+
+
+def load_documents_module(path: str):
+    """Import a version of wbdsm/documents.py from path, next to the current one."""
+    spec = importlib.util.spec_from_file_location("wbdsm_documents_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def git(*git_args: str) -> bytes:
+    return subprocess.run(
+        ["git", *git_args],
+        check=True,
+        capture_output=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+
+
+def get_first_revision() -> str:
+    """First commit of the repository, the baseline of the changes."""
+    return git("rev-list", "--max-parents=0", "HEAD").decode().split()[-1]
+
+
+def load_documents_revision(revision: str):
+    """Import wbdsm/documents.py of a git revision."""
+    source = git("show", f"{revision}:wbdsm/documents.py")
+    with tempfile.NamedTemporaryFile(suffix=".py", delete=False) as f:
+        f.write(source)
+    try:
+        return load_documents_module(f.name)
+    finally:
+        os.remove(f.name)
+
+
+def parsed_bytes_per_page(page_cls, raw_pages, language: str) -> float:
+    """
+    Bytes allocated (and kept) by the parsed pages, objects and cleaned texts. The titles cache is disabled, it's shared
+    by all the pages of a process and would be counted as memory of the pages.
+    """
+    raw_pages = [copy.deepcopy(page) for page in raw_pages]
+    maxsize = title_codec.maxsize
+    title_codec.configure(0)
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    pages = [page_cls.from_mongo(page, language) for page in raw_pages]
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    title_codec.configure(maxsize)
+    parsed_bytes = sum(
+        stat.size_diff
+        for stat in snapshot_after.compare_to(snapshot_before, "filename")
+    )
+    return parsed_bytes / len(pages)
+
+
+def generate_pages(n_pages: int, seed: int = 42):
+    rng = random.Random(seed)
+    words = ["word", "palavra", "mot", "Wort", "parola", "palabra", "ord", "sana"]
+    pages = []
+    for i in range(n_pages):
+        sections = {}
+        for j in range(rng.randint(1, 15)):
+            links = [
+                {
+                    "text": rng.choice(words),
+                    "type": "internal",
+                    "page": f"Page {rng.randint(0, 10**6)}",
+                }
+                for _ in range(rng.randint(0, 30))
+            ]
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(20, 400)))
+            sections["Abstract" if j == 0 else f"Section {j}"] = {
+                "text": text,
+                "index": j,
+                "links": links,
+            }
+        pages.append({"_id": f"Page {i}", "title": f"Page {i}", "sections": sections})
+    return pages
+
+
+parser = WBDSMArgParser()
+parser.add_argument("--n_pages", default=500, type=int)
+parser.add_argument(
+    "--baseline_rev",
+    default=None,
+    type=str,
+    help="git revision of wbdsm/documents.py to compare with, the first commit of the repository by default",
+)
+parser.add_argument(
+    "--baseline_path",
+    default=None,
+    type=str,
+    help="Path to a version of wbdsm/documents.py to compare with",
+)
+args = parser.parse_known_args()[0].__dict__
+
+if args["language"]:
+    pages_collection = MongoClient(args["mongo_uri"])[args["language"] + "wiki"][
+        "pages"
+    ]
+    raw_pages = list(
+        pages_collection.find({"isRedirect": False}).limit(args["n_pages"])
+    )
+    language = args["language"]
+else:
+    raw_pages = generate_pages(args["n_pages"])
+    language = "en"
+
+pages = [Page.from_mongo(copy.deepcopy(page), language) for page in raw_pages]
+n_links = sum(len(section.links) for page in pages for section in page.sections)
+n_sections = sum(len(page.sections) for page in pages)
+logger.info(f"{len(pages)} pages, {n_sections} sections, {n_links} links")
+del pages
+
+if args["baseline_path"]:
+    baseline = load_documents_module(args["baseline_path"])
+else:
+    baseline_rev = args["baseline_rev"] or get_first_revision()
+    logger.info(f"Baseline: wbdsm/documents.py of {baseline_rev}")
+    baseline = load_documents_revision(baseline_rev)
+current_bytes = parsed_bytes_per_page(Page, raw_pages, language)
+baseline_bytes = parsed_bytes_per_page(baseline.Page, raw_pages, language)
+logger.info(
+    f"Parsed pages (objects + cleaned texts): {baseline_bytes:.0f} bytes/page baseline -> {current_bytes:.0f} bytes/page"
+)
@@ -0,0 +1,85 @@
+"""
+Wall-clock time to load links into an empty collection with the secondary indexes created upfront (default workers) vs
+created after the load (BULK_LOAD=True workers).
+
+Copies --n_links links of the links collection to the links_benchmark collection, dropped before each run. The links
+are indexed without counting, the link counts updates are timed on their own benchmark collections.
+"""
+
+
+import logging
+from datetime import datetime
+
+from pymongo import MongoClient
+
+from wbdsm.links.index_links import (
+    create_links_indexes,
+    index_links,
+    update_link_counts,
+)
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+
+logger = logging.getLogger(__name__)
+
+
+def load(links, collection, bulk_load: bool, mode: str, chunk_size: int):
+    collection.drop()
+    time_now = datetime.now()
+    if not bulk_load:
+        create_links_indexes(collection)
+    # Same writes as the index task, one per chunk of pages
+    for start in range(0, len(links), chunk_size):
+        # Without counting, link_pairs/link_counts of the db are not touched and every run does the same work
+        index_links(
+            links[start : start + chunk_size],
+            collection,
+            mode=mode,
+            count_links=False,
+        )
+    load_time = datetime.now() - time_now
+    if bulk_load:
+        create_links_indexes(collection)
+    total_time = datetime.now() - time_now
+    logger.info(
+        f"bulk_load={bulk_load}, mode={mode}: load {load_time}, total (with indexes) {total_time}"
+    )
+    return total_time
+
+
+def count(links, pairs_collection, counts_collection, chunk_size: int):
+    """Time of the link counts updates of a first load, on collections of their own."""
+    pairs_collection.drop()
+    counts_collection.drop()
+    time_now = datetime.now()
+    for start in range(0, len(links), chunk_size):
+        update_link_counts(
+            links[start : start + chunk_size], pairs_collection, counts_collection
+        )
+    total_time = datetime.now() - time_now
+    logger.info(f"link counts: {total_time}")
+    pairs_collection.drop()
+    counts_collection.drop()
+    return total_time
+
+
+parser = WBDSMArgParser()
+parser.add_argument("--n_links", default=10**6, type=int)
+# Links of a 500 pages chunk
+parser.add_argument("--chunk_size", default=40000, type=int)
+args = parser.parse_known_args()[0].__dict__
+
+db = MongoClient(args["mongo_uri"])[args["language"] + "wiki"]
+links = list(db["links"].find().limit(args["n_links"]))
+logger.info(f"Loaded {len(links)} links")
+benchmark_collection = db["links_benchmark"]
+
+for mode in ["upsert", "insert"]:
+    for bulk_load in [False, True]:
+        load(links, benchmark_collection, bulk_load, mode, args["chunk_size"])
+benchmark_collection.drop()
+count(
+    links,
+    db["link_pairs_benchmark"],
+    db["link_counts_benchmark"],
+    args["chunk_size"],
+)
@@ -0,0 +1,67 @@
+"""
+Broker bytes per chunk of links: JSON (celery's default serializer) vs wbdsm_links (wbdsm.links.links_codec).
+
+Uses the links of --n_docs source docs from the links collection if --language is given, synthetic links otherwise.
+"""
+
+
+import json
+import logging
+import random
+
+from pymongo import MongoClient
+
+from wbdsm.links.links_codec import decode_links, dumps, encode_links
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+
+logger = logging.getLogger(__name__)
+
+
+def generate_links(n_docs: int, seed: int = 42):
+    rng = random.Random(seed)
+    links = []
+    for doc in range(n_docs):
+        source_doc = f"Source document {doc}"
+        sections = ["Abstract", "History", "Early life", "Career", "References"]
+        for _ in range(rng.randint(10, 150)):
+            start = rng.randint(0, 10000)
+            target = f"Target page {int(rng.paretovariate(1.0)) % 50000}"
+            links.append(
+                {
+                    "_id": str(start) + source_doc,
+                    "start": start,
+                    "end": start + len(target),
+                    "text": target.lower() if rng.random() < 0.5 else target,
+                    "links_to": target,
+                    "source_doc": source_doc,
+                    "links_to_section": "Abstract",
+                    "source_doc_section": rng.choice(sections),
+                    "language": "en",
+                    "type": "internal",
+                }
+            )
+    return links
+
+
+parser = WBDSMArgParser()
+parser.add_argument("--n_docs", default=500, type=int)
+args = parser.parse_known_args()[0].__dict__
+
+if args["language"]:
+    links_collection = MongoClient(args["mongo_uri"])[args["language"] + "wiki"][
+        "links"
+    ]
+    source_docs = links_collection.distinct("source_doc")[: args["n_docs"]]
+    links = list(links_collection.find({"source_doc": {"$in": source_docs}}))
+else:
+    links = generate_links(args["n_docs"])
+
+assert decode_links(encode_links(links)) == links
+# Body of the index_links_task message: (args, kwargs, embed)
+body = ((links,), {}, {"callbacks": None, "errbacks": None, "chain": None})
+json_size = len(json.dumps(body))
+wbdsm_size = len(dumps(body))
+logger.info(f"Chunk with {len(links)} links from {args['n_docs']} docs")
+logger.info(
+    f"Broker bytes per chunk: {json_size} (json) -> {wbdsm_size} (wbdsm_links), {json_size / wbdsm_size:.1f}x smaller"
+)
@@ -0,0 +1,64 @@
+"""
+Compare the throughput of wbdsm.preprocessing with the previous (regex per step) implementation on the golden corpus of
+tests/legacy_preprocessing.py. The same output is checked by tests/test_preprocessing.py. If --language is given, the
+sections texts of --sample_size pages from mongoDB are added to the corpus, and checked too.
+
+Run from the repository root:
+    python -m scripts.benchmark_preprocessing --corpus_size 20000
+"""
+
+
+import logging
+import time
+
+from pymongo import MongoClient
+
+from tests.legacy_preprocessing import (
+    generate_corpus,
+    legacy_clean_text,
+    legacy_decode_id,
+    legacy_normalize_punctuation,
+)
+from wbdsm.preprocessing import (
+    clean_text,
+    decode_id,
+    normalize_punctuation,
+)
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark(function, corpus, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        time_now = time.perf_counter()
+        function(corpus)
+        best = min(best, time.perf_counter() - time_now)
+    return len(corpus) / best
+
+
+parser = WBDSMArgParser()
+parser.add_argument("--corpus_size", default=20000, type=int)
+args = parser.parse_known_args()[0].__dict__
+
+corpus = generate_corpus(args["corpus_size"])
+if args["language"]:
+    pages = MongoClient(args["mongo_uri"])[args["language"] + "wiki"]["pages"]
+    for page in pages.find({"isRedirect": False}).limit(int(args["sample_size"])):
+        corpus.extend(section["text"] for section in page["sections"].values())
+logger.info(f"Corpus with {len(corpus)} texts")
+
+checks = [
+    ("decode_id", legacy_decode_id, decode_id),
+    ("clean_text", legacy_clean_text, clean_text),
+    ("normalize_punctuation", legacy_normalize_punctuation, normalize_punctuation),
+]
+for name, legacy, new in checks:
+    for text in corpus:
+        assert legacy(text) == new(text), f"{name} differs for {text!r}"
+    legacy_speed = benchmark(lambda texts: [legacy(text) for text in texts], corpus)
+    new_speed = benchmark(lambda texts: [new(text) for text in texts], corpus)
+    logger.info(
+        f"{name}: same output, {legacy_speed:.0f} -> {new_speed:.0f} texts/s ({new_speed / legacy_speed:.2f}x)"
+    )
@@ -5,15 +5,30 @@ import os
 from pymongo import MongoClient
 
 
+from wbdsm.links.entity_linking.candidate_registry import (
+    CANDIDATES_FILE,
+    CandidateRegistry,
+    get_registry_path,
+    iter_candidates_titles,
+)
 from wbdsm.links.entity_linking.process_mongodb import (
     create_links_dataset_by_agg,
-    get_abstracts,
+    iter_abstracts,
+    write_candidates,
+)
+from wbdsm.links.entity_linking.shards import create_links_dataset_sharded
+from wbdsm.links.entity_linking.split import (
+    hash_split_links_file,
+    split_links_file,
 )
 from wbdsm.wbdsm_arg_parser import WBDSMArgParser
 
 logger = logging.getLogger(__name__)
 parser = WBDSMArgParser()
 args = parser.parse_known_args()[0].__dict__
+if args["n_shards"] > 1 and args["sampling"] != "index":
+    # Each shard would run the $sample over the whole links collection
+    parser.error("--n_shards > 1 needs --sampling index")
 mongo_uri = args["mongo_uri"]
 output_path = args["output_path"]
 language = args["language"]
@@ -34,86 +49,74 @@ links_collection = client[db_name]["links"]
 max_rank = args["max_rank"]
 if max_rank:
     logger.info(f"Getting abstracts from rank 0 to {max_rank}")
-    abstracts = get_abstracts(
+    abstracts = iter_abstracts(
         min_rank=0,
         max_rank=max_rank,
         pages_collection=pages_collection,
         max_chars=args["max_chars"],
     )
 else:
-    abstracts = get_abstracts(
+    abstracts = iter_abstracts(
         min_rank=None,
         max_rank=None,
         pages_collection=pages_collection,
         max_chars=args["max_chars"],
     )
 
-all_ids = [a["candidate"] for a in abstracts]
-n_abstracts = len(all_ids)
-# # Save abstracts
-with open(os.path.join(output_path, "candidates.jsonl"), "w") as f:
-    for abstract in abstracts:
-        json.dump(abstract, f)
-        f.write("\n")
+# # Save abstracts as they come, the titles are streamed back from the file for the links
+candidates_path = os.path.join(output_path, CANDIDATES_FILE)
+n_abstracts = write_candidates(abstracts, candidates_path)
+# Title -> candidate_index/rank, saved next to candidates.jsonl
+registry_path = get_registry_path(output_path)
+CandidateRegistry.from_candidates_file(output_path, rebuild=True).close()
 # # Get the links
-links = create_links_dataset_by_agg(
-    abstract_titles=all_ids,
-    links_collection=links_collection,
-    pages_collection=pages_collection,
-    **args,
-)
-
-# Count the number of successful extracted candidates - if a doc is not found all_ids != total candidates
-count = 0
-with open(os.path.join(output_path, "links.jsonl"), "r") as f:
-    for line in f:
-        count += 1
-train_size = count - args["validation_size"] - args["test_size"]
-
-# Open the links file and create the dataset
-train_indexes = (0, train_size)
-validation_indexes = (train_size + 1, train_size + args["validation_size"] + 1)
-test_indexes = (validation_indexes[1] + 1, n_abstracts)
-full_dataset = {}
-index = 0
-# ! Just one-shot creation for now, sizes are considered by the candidates
-# ! Needs to implement a fully random dataset creation and one for "text-surface one-shot". With these the numbers would be by number of links
-# ! By number of links we need to first unroll the links and then create the dataset - for the "text-surface one-shot" we need to keep one of the text surfaces for dev/test.
-train_file = open(os.path.join(output_path, "train.jsonl"), "w")
-validation_file = open(os.path.join(output_path, "validation.jsonl"), "w")
-test_file = open(os.path.join(output_path, "test.jsonl"), "w")
-#
-with open(os.path.join(output_path, "links.jsonl"), "r") as f:
-    for line in f:
-        candidate_links = json.loads(line)
-        for link in list(candidate_links.values())[0]:
-            # Write to the file
-            if index >= train_indexes[0] and index <= train_indexes[1]:
-                train_file.write(json.dumps(link) + "\n")
-            elif index >= validation_indexes[0] and index <= validation_indexes[1]:
-                validation_file.write(json.dumps(link) + "\n")
-            elif index >= test_indexes[0] and index <= test_indexes[1]:
-                test_file.write(json.dumps(link) + "\n")
-            else:
-                raise ValueError(f"Numbers don't match")
+if args["n_shards"] > 1:
+    # Each shard on its own process, merged on links.jsonl
+    create_links_dataset_sharded(
+        db_name=db_name,
+        registry_path=registry_path,
+        **args,
+    )
+else:
+    candidate_registry = CandidateRegistry(registry_path)
+    links = create_links_dataset_by_agg(
+        abstract_titles=iter_candidates_titles(output_path, candidate_registry),
+        links_collection=links_collection,
+        pages_collection=pages_collection,
+        candidate_registry=candidate_registry,
+        **args,
+    )
+    candidate_registry.close()
 
-        index = index + 1
+# tail: one-shot by candidate, sizes are considered by the candidates
+# hash: one-shot by candidate or by text surface, ratios of the candidates/surfaces - the same split for an entity on every rebuild
+# ! Needs to implement a fully random dataset creation. The numbers would be by number of links
+if args["split_strategy"] == "hash":
+    split_counts = hash_split_links_file(
+        output_path,
+        args["validation_ratio"],
+        args["test_ratio"],
+        seed=args["split_seed"],
+        split_by=args["split_by"],
+    )
+else:
+    split_counts = split_links_file(
+        output_path, args["validation_size"], args["test_size"]
+    )
+logger.info(f"Dataset splits: {split_counts}")
 
 # Complete dataset size if it's not "full candidates list"
 if args["candidates_size"]:
     candidates_to_get = args["candidates_size"] - n_abstracts
     rank_to_get = candidates_to_get + max_rank
-    complete_candidates = get_abstracts(
+    complete_candidates = iter_abstracts(
         min_rank=max_rank,
         max_rank=rank_to_get,
         pages_collection=pages_collection,
         init_index=n_abstracts,
         max_chars=args["max_chars"],
     )
-
-    with open(os.path.join(output_path, "candidates.jsonl"), "a") as f:
-        for abstract in complete_candidates:
-            json.dump(abstract, f)
-            f.write("\n")
+    write_candidates(complete_candidates, candidates_path, mode="a")
+    CandidateRegistry.from_candidates_file(output_path, rebuild=True).close()
 with open(os.path.join(output_path, "dataset_description.json"), "wt") as f:
     json.dump(args, f)
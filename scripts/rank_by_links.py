@@ -1,17 +1,60 @@
 """
-can take a while...
+Rank the pages (reference_rank) by the number of distinct (source_doc, text) of their links.
+
+--rank_source link_counts sorts the link_counts collection maintained by index_links, --rank_source links counts them
+with an aggregation over the whole links collection (can take a while...), for links indexed without counting.
+--rank_source numpy counts them with numpy (wbdsm.links.vectorized_ranking) streaming the links collection, or the
+export on --links_path. --rebuild_link_counts True recomputes link_counts from link_pairs first, after indexing chunks
+failed between the two writes of update_link_counts.
 """
 
 
 import logging
 
-import pymongo
-from pymongo import MongoClient, UpdateOne
+from pymongo import MongoClient
 
-from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+from wbdsm.links.index_links import (
+    LINK_COUNTS_COLLECTION,
+    LINK_PAIRS_COLLECTION,
+    rebuild_link_counts,
+)
+from wbdsm.links.ranking import (
+    RANK_BATCH_SIZE,
+    count_links_by_aggregation,
+    iter_link_counts,
+    write_reference_ranks,
+)
+from wbdsm.links.vectorized_ranking import (
+    CHUNK_SIZE,
+    count_links_vectorized,
+    iter_collection_chunks,
+    iter_links_chunks,
+    rank_links_vectorized,
+)
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser, boolean_string
 
 logger = logging.getLogger(__name__)
 parser = WBDSMArgParser()
+parser.add_argument(
+    "--rank_source",
+    default="links",
+    choices=["links", "link_counts", "numpy"],
+    help="links: aggregation over the links collection. link_counts: sort of the link_counts collection maintained while indexing the links. numpy: vectorized count of the links collection or of --links_path",
+)
+parser.add_argument(
+    "--links_path",
+    default=None,
+    type=str,
+    help="Links export for --rank_source numpy: directory of wbdsm-extract-links-offline JSONL files or links parquet directory. The links collection if not given",
+)
+parser.add_argument(
+    "--rebuild_link_counts",
+    default=False,
+    type=boolean_string,
+    help="Recompute the link_counts collection from link_pairs before ranking with --rank_source link_counts, no links must be indexed meanwhile",
+)
+parser.add_argument("--rank_chunk_size", default=CHUNK_SIZE, type=int)
+parser.add_argument("--rank_batch_size", default=RANK_BATCH_SIZE, type=int)
 args = parser.parse_known_args()[0].__dict__
 mongo_uri = args["mongo_uri"]
 language = args["language"]
@@ -20,61 +63,35 @@ db_name = language + "wiki"
 client = MongoClient(mongo_uri)
 links_collection = client[db_name]["links"]
 pages_collection = client[db_name]["pages"]
+link_counts_collection = client[db_name][LINK_COUNTS_COLLECTION]
+link_pairs_collection = client[db_name][LINK_PAIRS_COLLECTION]
 
 
-def rank_by_links(links_collection):
+def rank_by_links(links_collection, rank_source="links", batch_size=RANK_BATCH_SIZE):
     """
-    Rank pages on mongoDB by using the links collection. Also, return a dictionary with the following structure:
-    {url: links : {mention_0: mention_0_count, mention_i: mention_i_count, ...},
-          sum: sum_count,
-          ranking: ranking_count }
-
+    Rank pages on mongoDB by the count of unique text surfaces per page, ties sorted by title.
+    Returns the number of ranked pages.
     """
 
-    logger.info("Counting unique text surfaces per page")
-    rank = [
-        # // Groyp by links_to, source doc and text to recover 1 mention per doc per text
-        {
-            "$group": {
-                "_id": {
-                    "links_to": "$links_to",
-                    "source_doc": "$source_doc",
-                    "text": "$text",
-                }
-            }
-        },
-        # // Group by links_to and sums the count, also keep the source doc info
-        {
-            "$group": {
-                "_id": "$_id.links_to",
-                "count": {"$sum": 1},
-            },
-        },
-        {"$sort": {"count": -1}},
-    ]
-
-    result = links_collection.aggregate(rank).batch_size(1000)
-    #
-    page_operations = []
-    agg_text_surfaces = []
+    logger.info(f"Counting unique text surfaces per page from {rank_source}")
+    if rank_source == "link_counts":
+        if args["rebuild_link_counts"]:
+            rebuild_link_counts(link_pairs_collection, link_counts_collection)
+        link_counts = iter_link_counts(link_counts_collection)
+    elif rank_source == "numpy":
+        if args["links_path"]:
+            chunks = iter_links_chunks(args["links_path"], args["rank_chunk_size"])
+        else:
+            chunks = iter_collection_chunks(links_collection, args["rank_chunk_size"])
+        link_counts = rank_links_vectorized(*count_links_vectorized(chunks))
+    else:
+        link_counts = count_links_by_aggregation(links_collection)
     logger.info("Updating page collection with the rank of the text surfaces")
-    for rank, row in enumerate(result):
-        # Update mongo db page with rank
-        page_operations.append(
-            UpdateOne(
-                {"title": row["_id"]}, {"$set": {"reference_rank": rank}}, upsert=True
-            )
-        )
-        # Keep counts for the text surfaces
-        row["rank"] = rank
-        agg_text_surfaces.append(row)
-    logger.info("Indexing the page collection ranking")
-    pages_collection.bulk_write(page_operations)
-    pages_collection.create_index([("reference_rank", pymongo.ASCENDING)])
-
-    return agg_text_surfaces
+    return write_reference_ranks(
+        pages_collection, (row["_id"] for row in link_counts), batch_size
+    )
 
 
-agg_text_surfaces = rank_by_links(links_collection)
+n_ranked = rank_by_links(links_collection, args["rank_source"], args["rank_batch_size"])
 
-logging.info("Done")
+logging.info(f"Done, ranked {n_ranked} pages")
@@ -0,0 +1,39 @@
+"""
+Resolve the redirect chains of all the pages and write them to the resolved_titles collection
+(and to a title resolver snapshot if --title_resolver_path is given).
+Run it after indexing the pages and before extracting the links.
+"""
+
+
+import logging
+
+from pymongo import MongoClient
+
+from wbdsm.links.redirects import (
+    iter_resolved_titles,
+    load_redirects,
+    write_resolved_titles,
+)
+from wbdsm.links.title_resolver import TitleResolver
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser
+
+logger = logging.getLogger(__name__)
+parser = WBDSMArgParser()
+args = parser.parse_known_args()[0].__dict__
+mongo_uri = args["mongo_uri"]
+language = args["language"]
+db_name = language + "wiki"
+#
+client = MongoClient(mongo_uri)
+pages_collection = client[db_name]["pages"]
+resolved_titles_collection = client[db_name]["resolved_titles"]
+
+logger.info("Loading the redirects")
+redirects = load_redirects(pages_collection)
+logger.info(f"Loaded {len(redirects)} titles")
+write_resolved_titles(redirects, resolved_titles_collection)
+if args["title_resolver_path"]:
+    TitleResolver.write(args["title_resolver_path"], iter_resolved_titles(redirects))
+    logger.info(f"Title resolver snapshot saved on {args['title_resolver_path']}")
+
+logging.info("Done")
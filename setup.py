@@ -3,4 +3,11 @@ from setuptools import setup, find_packages
 setup(
     name="wbdsm",
     packages=find_packages(),
+    entry_points={
+        "console_scripts": [
+            "wbdsm-extract-links=wbdsm.links.local_engine:main",
+            "wbdsm-extract-links-async=wbdsm.links.async_engine:main",
+            "wbdsm-extract-links-offline=wbdsm.links.offline:main",
+        ],
+    },
 )
@@ -0,0 +1,60 @@
+"""
+Previous (regex per step) implementation of wbdsm.preprocessing, the reference of tests/test_preprocessing.py and of
+scripts/benchmark_preprocessing.py, and the golden corpus they run on.
+
+The corpus is generated with the characters that trigger each cleaning step.
+"""
+import random
+import re
+import unicodedata
+
+import unidecode
+
+
+def legacy_decode_id(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    text = (
+        text.replace("\\\\", "\\")
+        .replace("\\u0024", "$")
+        .replace("\\u002e", ".")
+        .replace("&quot;", '"')
+        .replace("&amp;", "&")
+    )
+    return text
+
+
+def legacy_clean_text(text: str) -> str:
+    text = legacy_decode_id(text)
+    text = re.sub(r"\n", " ", text)
+    text = re.sub(r" +", " ", text).strip()
+    text = re.sub(r"\\`", "`", text)
+    text = re.sub(r"\\'", "'", text)
+    text = re.sub(r"\(\s*\)", "", text)
+    text = re.sub(r"\[\s*\]", "", text)
+    text = re.sub(r"\{\s*\}", "", text)
+    text = re.sub(r",\s*,", ",", text)
+    text = re.sub(r"\.\s*\.", ".", text)
+    return text
+
+
+def legacy_normalize_punctuation(text: str):
+    text = "".join(
+        [
+            unidecode.unidecode(char)
+            if unicodedata.category(char)[0] in ["Po", "Cc", "Pi", "Pf", "Ps"]
+            else char
+            for char in text
+        ]
+    )
+    return text
+
+
+def generate_corpus(size: int, seed: int = 42):
+    tokens = [" ", "  ", "\n", "\t", "(", ")", "[", "]", "{", "}", ",", ".", "\\", "`"]
+    tokens += ["'", "\\\\", "\\u0024", "\\u002e", "&quot;", "&amp;", "&", "é", "ﬁ", "Å"]
+    tokens += ["«", "»", "“", "”", "…", "word", "Word", "mot", "palavra", " "]
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(tokens) for _ in range(rng.randint(0, 200)))
+        for _ in range(size)
+    ]
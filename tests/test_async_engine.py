@@ -0,0 +1,171 @@
+"""
+Stages of the async engine on a fake motor database (mongomock collections behind async methods) against the sync
+extraction.
+"""
+import asyncio
+import copy
+import random
+
+import mongomock
+import pytest
+
+pytest.importorskip("motor")
+
+from tests.test_extract_links import LANGUAGE, get_redirects_documents, page_document
+from tests.test_index_links import bulk_write
+from wbdsm.documents import Page
+from wbdsm.links import async_engine
+from wbdsm.links.chunk_ledger import FAILED, INDEXED, ChunkLedger
+from wbdsm.links.extract_links import extract_links
+from wbdsm.links.ranking import count_links_by_aggregation, iter_link_counts
+
+N_PAGES = 60
+CHUNK_SIZE = 20
+BOUNDARIES = [-1, 19, 39]
+ARGS = {
+    "use_resolved_titles": False,
+    "concurrency": 4,
+    "prefetch": 1,
+    "chunk_size": CHUNK_SIZE,
+    "language": LANGUAGE,
+    "min_query_size": 50,
+    "index_mode": "upsert",
+    "index_batch_size": 7,
+    "count_links": True,
+}
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        return AsyncCursor(self.cursor.sort(*args, **kwargs))
+
+    def limit(self, limit):
+        return AsyncCursor(self.cursor.limit(limit))
+
+    async def to_list(self, length):
+        await asyncio.sleep(0)
+        return list(self.cursor)
+
+
+class AsyncCollection:
+    def __init__(self, collection, database):
+        self.collection = collection
+        self.database = database
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(0)
+        return self.collection.insert_many(documents, ordered=ordered)
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(0)
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.database[name], self)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+    database = mongomock.MongoClient()[LANGUAGE + "wiki"]
+    rng = random.Random(0)
+    database.pages.insert_many(
+        [page_document(page_id, rng) for page_id in range(N_PAGES)]
+        + get_redirects_documents()
+    )
+    return database
+
+
+@pytest.fixture
+def ledger(database):
+    return ChunkLedger(database.chunk_ledger)
+
+
+def get_expected_links(database):
+    pages = [
+        Page.from_mongo(copy.deepcopy(document), LANGUAGE)
+        for document in database.pages.find({"isRedirect": False})
+    ]
+    return sorted(
+        extract_links(pages, database.pages, batch_resolve=True),
+        key=lambda link: link["_id"],
+    )
+
+
+def run_pipeline(database, ledger, boundaries=BOUNDARIES, **args):
+    boundaries = ledger.plan(boundaries, CHUNK_SIZE)
+    return asyncio.run(
+        asyncio.wait_for(
+            async_engine.run_pipeline(
+                AsyncDatabase(database), {**ARGS, **args}, boundaries, ledger
+            ),
+            timeout=30,
+        )
+    )
+
+
+def get_states(ledger):
+    return {chunk["_id"]: chunk["state"] for chunk in ledger.ledger_collection.find()}
+
+
+@pytest.mark.parametrize("index_mode", ["upsert", "insert"])
+def test_run_pipeline_matches_extract_links(database, ledger, index_mode):
+    assert run_pipeline(database, ledger, index_mode=index_mode) == N_PAGES
+    links = list(database.links.find().sort("_id", 1))
+    assert links == get_expected_links(database)
+    assert list(iter_link_counts(database.link_counts)) == list(
+        count_links_by_aggregation(database.links)
+    )
+    assert set(get_states(ledger).values()) == {INDEXED}
+    assert ledger.plan(BOUNDARIES, CHUNK_SIZE) == []
+
+
+def test_failed_chunk_is_resumed(database, ledger, monkeypatch):
+    write_links = async_engine.write_links
+
+    async def failing_write_links(links, *args):
+        if any(link["source_doc"] == "Page 25" for link in links):
+            raise RuntimeError("Write failed")
+        return await write_links(links, *args)
+
+    monkeypatch.setattr(async_engine, "write_links", failing_write_links)
+    assert run_pipeline(database, ledger) == N_PAGES - CHUNK_SIZE
+    assert get_states(ledger) == {"-1": INDEXED, "19": FAILED, "39": INDEXED}
+    assert ledger.plan(BOUNDARIES, CHUNK_SIZE) == [19]
+
+    monkeypatch.setattr(async_engine, "write_links", write_links)
+    assert run_pipeline(database, ledger) == CHUNK_SIZE
+    assert set(get_states(ledger).values()) == {INDEXED}
+    assert list(database.links.find().sort("_id", 1)) == get_expected_links(database)
+
+
+def test_next_chunk_is_parsed_while_resolving(database, ledger, monkeypatch):
+    parse_pages = async_engine.parse_pages
+    resolve_links_targets_async = async_engine.resolve_links_targets_async
+    parsed = []
+
+    def recording_parse_pages(pages, language):
+        parsed.append(pages[0]["pageID"])
+        return parse_pages(pages, language)
+
+    async def waiting_resolve(pages_obj, *args, **kwargs):
+        # The first chunk is resolved only once the second one is parsed: it never happens if the stages don't overlap
+        while len(parsed) < 2:
+            await asyncio.sleep(0.01)
+        return await resolve_links_targets_async(pages_obj, *args, **kwargs)
+
+    monkeypatch.setattr(async_engine, "parse_pages", recording_parse_pages)
+    monkeypatch.setattr(async_engine, "resolve_links_targets_async", waiting_resolve)
+    assert run_pipeline(database, ledger) == N_PAGES
+    assert parsed == [0, 20, 40]
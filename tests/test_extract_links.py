@@ -0,0 +1,172 @@
+"""
+Batched resolution of the links targets (extract_links with batch_resolve) against the per link resolution.
+"""
+import copy
+import random
+
+import mongomock
+import pytest
+
+from wbdsm.documents import Page
+from wbdsm.links.extract_links import (
+    extract_links,
+    iter_links_targets,
+    resolve_link,
+    resolve_links_targets,
+    translate_link,
+)
+from wbdsm.links.redirects import MAX_REDIRECT_HOPS
+from wbdsm.links.title_resolver import PagesTitleResolver
+from wbdsm.preprocessing import title_codec
+
+N_PAGES = 60
+LANGUAGE = "x"
+
+
+def redirect_document(title, target, section=None):
+    raw_target = target if section is None else f"{target}#{section}"
+    return {
+        "_id": title,
+        "title": title,
+        "isRedirect": True,
+        "redirectTo": {"page": target, "raw": f"#REDIRECT [[{raw_target}]]"},
+    }
+
+
+def get_redirects_documents():
+    documents = [
+        # Cycle
+        redirect_document("Cycle A", "Cycle B"),
+        redirect_document("Cycle B", "Cycle A"),
+        redirect_document("To cycle", "Cycle A", "History"),
+        redirect_document("Self", "Self"),
+        # Redirect to a missing page and to nothing
+        redirect_document("To missing", "Missing"),
+        {"_id": "Broken", "title": "Broken", "isRedirect": True, "redirectTo": {}},
+        # Redirect to a section, and a redirect to it (the section is on the second hop)
+        redirect_document("To section", "Page 1", "History"),
+        redirect_document("To to section", "To section"),
+    ]
+    # Chains of MAX_REDIRECT_HOPS (resolved) and MAX_REDIRECT_HOPS + 1 (too long) hops
+    for name, n_hops in (("Short", MAX_REDIRECT_HOPS), ("Long", MAX_REDIRECT_HOPS + 1)):
+        for hop in range(n_hops):
+            target = f"{name} {hop + 1}" if hop + 1 < n_hops else "Page 2"
+            documents.append(redirect_document(f"{name} {hop}", target))
+    return documents
+
+
+REDIRECTS = [document["title"] for document in get_redirects_documents()]
+TARGETS = [f"Page {i}" for i in range(N_PAGES)] + REDIRECTS + ["Missing", "Other"]
+
+
+def page_document(page_id, rng):
+    words = []
+    links = []
+    for _ in range(15):
+        target = rng.choice(TARGETS)
+        section = rng.choice([None, None, "Early life"])
+        words.append(f"some filler words about {target}")
+        link = {"text": target, "type": "internal", "page": target}
+        if section:
+            link["section"] = section
+        links.append(link)
+    title = f"Page {page_id}"
+    return {
+        "_id": title,
+        "title": title,
+        "isRedirect": False,
+        "pageID": page_id,
+        "sections": {"Abstract": {"text": " ".join(words), "index": 0, "links": links}},
+    }
+
+
+@pytest.fixture
+def pages_collection():
+    collection = mongomock.MongoClient()[LANGUAGE + "wiki"]["pages"]
+    rng = random.Random(0)
+    collection.insert_many(
+        [page_document(page_id, rng) for page_id in range(N_PAGES)]
+        + get_redirects_documents()
+    )
+    return collection
+
+
+def set_links_sections(page, document):
+    """
+    Link.from_mongo_section doesn't parse the section of the links, it's set from the fixture so the links_to_section
+    branches of the resolution are run.
+    """
+    for section, raw_section in zip(page.sections, document["sections"].values()):
+        for link, raw_link in zip(section.links, raw_section["links"]):
+            link.section = raw_link.get("section")
+    return page
+
+
+@pytest.fixture
+def pages(pages_collection):
+    return [
+        set_links_sections(Page.from_mongo(copy.deepcopy(document), LANGUAGE), document)
+        for document in pages_collection.find({"isRedirect": False})
+    ]
+
+
+def test_fixture_links_every_redirect(pages):
+    targets = set(iter_links_targets(pages))
+    for title in REDIRECTS:
+        assert title_codec.encode_id(title, encode_title=True) in targets
+
+
+@pytest.mark.parametrize("query_size", [1, 7, 1000])
+def test_resolve_links_targets_matches_per_link(pages, pages_collection, query_size):
+    pages_resolver = PagesTitleResolver(pages_collection)
+    resolver = resolve_links_targets(pages, pages_collection, query_size=query_size)
+    for title in dict.fromkeys(iter_links_targets(pages)):
+        assert resolver.lookup(title) == pages_resolver.lookup(title)
+
+
+def test_redirects_resolution(pages, pages_collection):
+    resolver = resolve_links_targets(pages, pages_collection)
+
+    def lookup(title):
+        return resolver.lookup(title_codec.encode_id(title, encode_title=True))
+
+    page_2 = title_codec.encode_id("Page 2", encode_title=True)
+    assert lookup("Short 0") == (page_2, None, MAX_REDIRECT_HOPS)
+    assert lookup("Long 0")[0] is None
+    assert lookup("Long 0")[2] == MAX_REDIRECT_HOPS + 1
+    for title in ("Cycle A", "Cycle B", "To cycle", "Self", "To missing", "Broken"):
+        assert lookup(title)[0] is None
+    assert lookup("Missing") is None
+    page_1 = title_codec.encode_id("Page 1", encode_title=True)
+    assert lookup("To section") == (page_1, "History", 1)
+    assert lookup("To to section") == (page_1, "History", 2)
+
+
+@pytest.mark.parametrize("links_to_section", [None, "Early life"])
+def test_resolve_link_matches_translate_link(pages, pages_collection, links_to_section):
+    resolver = resolve_links_targets(pages, pages_collection)
+    for title in dict.fromkeys(iter_links_targets(pages)):
+        assert resolve_link(title, resolver, links_to_section) == translate_link(
+            title, pages_collection, links_to_section
+        )
+
+
+def test_extract_links_batch_resolve_matches_per_link(pages, pages_collection):
+    links = extract_links(pages, pages_collection)
+    assert links
+    assert extract_links(pages, pages_collection, batch_resolve=True) == links
+
+
+def test_fixture_links_sections_through_redirects(pages, pages_collection):
+    links = extract_links(pages, pages_collection, batch_resolve=True)
+    # Links with a section to a redirect with redirectToSection take the redirect's section, the ones without a section
+    # stay on the abstract
+    redirected = {
+        (link["links_to"], link["links_to_section"])
+        for link in links
+        if link["links_to"] in ("To section", "To to section")
+    }
+    assert ("To section", "History") in redirected
+    assert ("To to section", "History") in redirected
+    assert {section for _, section in redirected} == {"History", "Abstract"}
+    assert any(link["links_to_section"] == "Early life" for link in links)
@@ -0,0 +1,100 @@
+"""
+Counts of the link_counts collection maintained by index_links.
+"""
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from wbdsm.links.index_links import (
+    LINK_COUNTS_COLLECTION,
+    LINK_PAIRS_COLLECTION,
+    index_links,
+    rebuild_link_counts,
+)
+from wbdsm.links.ranking import count_links_by_aggregation, iter_link_counts
+
+
+def get_link(links_to, source_doc, text, start):
+    return {
+        "_id": f"{source_doc}-{start}",
+        "start": start,
+        "end": start + len(text),
+        "text": text,
+        "links_to": links_to,
+        "source_doc": source_doc,
+    }
+
+
+CHUNK = [
+    get_link("Alpha", "Doc 1", "alpha", 0),
+    get_link("Alpha", "Doc 1", "alpha", 10),
+    get_link("Alpha", "Doc 1", "the alpha", 20),
+    get_link("Beta", "Doc 1", "beta", 30),
+    get_link("Alpha", "Doc 2", "alpha", 0),
+    get_link("Gamma", "Doc 2", "gamma", 10),
+]
+
+
+def bulk_write(collection, operations, ordered=True):
+    # mongomock's bulk_write doesn't take the UpdateOne of pymongo
+    results = [
+        collection.update_one(
+            operation._filter, operation._doc, upsert=operation._upsert
+        )
+        for operation in operations
+    ]
+    return SimpleNamespace(
+        upserted_count=sum(result.upserted_id is not None for result in results),
+        matched_count=sum(result.matched_count for result in results),
+    )
+
+
+class FailingLinkCounts(Exception):
+    pass
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+    return mongomock.MongoClient().enwiki
+
+
+def get_counts(database):
+    return list(iter_link_counts(database[LINK_COUNTS_COLLECTION]))
+
+
+@pytest.mark.parametrize("mode", ["upsert", "insert"])
+def test_index_links_again_keeps_counts(database, mode):
+    links_collection = database.links
+    assert index_links(CHUNK, links_collection, mode=mode)["new_pairs"] == 5
+    expected = list(count_links_by_aggregation(links_collection))
+    assert get_counts(database) == expected
+    assert index_links(CHUNK, links_collection, mode=mode)["new_pairs"] == 0
+    assert get_counts(database) == expected
+
+
+def test_rebuild_link_counts_after_failure(database, monkeypatch):
+    links_collection = database.links
+    index_links(CHUNK[:3], links_collection)
+
+    def failing_bulk_write(collection, operations, ordered=True):
+        if collection.name == LINK_COUNTS_COLLECTION:
+            raise FailingLinkCounts()
+        return bulk_write(collection, operations, ordered)
+
+    # The pairs of the chunk are written, not their counts
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", failing_bulk_write)
+    with pytest.raises(FailingLinkCounts):
+        index_links(CHUNK, links_collection)
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+    index_links(CHUNK, links_collection)
+    expected = list(count_links_by_aggregation(links_collection))
+    assert get_counts(database) != expected
+
+    assert rebuild_link_counts(
+        database[LINK_PAIRS_COLLECTION], database[LINK_COUNTS_COLLECTION]
+    ) == len(expected)
+    assert get_counts(database) == expected
+    index_links(CHUNK, links_collection)
+    assert get_counts(database) == expected
@@ -0,0 +1,36 @@
+"""
+wbdsm.preprocessing against the previous (regex per step) implementation, on the golden corpus.
+"""
+import pytest
+
+from tests.legacy_preprocessing import (
+    generate_corpus,
+    legacy_clean_text,
+    legacy_decode_id,
+    legacy_normalize_punctuation,
+)
+from wbdsm.preprocessing import clean_text, decode_id, normalize_punctuation
+
+CORPUS = generate_corpus(5000) + [
+    "",
+    " ",
+    "\n  \n",
+    "( ) [ ] { } , , . .",
+    "[()] {[ ]} ,, ..",
+    "\\\\u0024 \\u002e &amp;quot;",
+    "Café – «naïve» “quotes” …",
+]
+
+
+@pytest.mark.parametrize(
+    "legacy, new",
+    [
+        (legacy_decode_id, decode_id),
+        (legacy_clean_text, clean_text),
+        (legacy_normalize_punctuation, normalize_punctuation),
+    ],
+    ids=["decode_id", "clean_text", "normalize_punctuation"],
+)
+def test_same_output_as_legacy(legacy, new):
+    for text in CORPUS:
+        assert new(text) == legacy(text), text
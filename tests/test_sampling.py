@@ -0,0 +1,129 @@
+"""
+Index sampling of the candidates links against the aggregation of get_entity_linking_query.
+"""
+import itertools
+import random
+
+import mongomock
+import pytest
+
+from wbdsm.links.entity_linking.queries import get_entity_linking_query
+from wbdsm.links.entity_linking.sampling import (
+    LINK_PROJECTION,
+    iter_sampled_candidates,
+    sample_candidate_links,
+)
+
+CANDIDATES = [f"Candidate {i}" for i in range(8)]
+SURFACE_APPEARANCE = 3
+TEXT_SURFACES = 4
+
+
+def get_deterministic_query(query):
+    """
+    The query without $rand and the random $slice position, not supported by mongomock: the first links of each text
+    surface are kept.
+    """
+    if isinstance(query, dict):
+        return {
+            key: {"$literal": 0}
+            if value == {"$rand": {}}
+            else get_deterministic_query(value)
+            for key, value in query.items()
+        }
+    if isinstance(query, list):
+        return [
+            0 if value == "$randomposition" else get_deterministic_query(value)
+            for value in query
+        ]
+    return query
+
+
+@pytest.fixture
+def links_collection():
+    collection = mongomock.MongoClient()["xwiki"]["links"]
+    rng = random.Random(0)
+    links = []
+    for i in range(2000):
+        # Popular candidates with many text surfaces, and a candidate without links
+        candidate = CANDIDATES[min(int(rng.expovariate(0.5)), len(CANDIDATES) - 2)]
+        links.append(
+            {
+                "_id": str(i),
+                "links_to": candidate,
+                "links_to_section": rng.choice(["Abstract"] * 4 + ["History"]),
+                "source_doc": f"Doc {rng.randint(0, 40)}",
+                "source_doc_section": "Abstract",
+                "text": f"surface {rng.randint(0, 8)}",
+                "start": 0,
+                "end": 1,
+            }
+        )
+    collection.insert_many(links)
+    return collection
+
+
+def get_aggregation_candidates(links_collection):
+    query = get_deterministic_query(
+        get_entity_linking_query(
+            candidate_surface_appearance=SURFACE_APPEARANCE,
+            candidate_text_surfaces=TEXT_SURFACES,
+        )
+    )
+    return {
+        candidate["_id"]: candidate["links"]
+        for candidate in links_collection.aggregate(
+            [{"$match": {"links_to": {"$in": CANDIDATES}}}] + query
+        )
+    }
+
+
+def test_same_shape_and_limits_as_aggregation(links_collection):
+    aggregation = get_aggregation_candidates(links_collection)
+    sampled = {
+        candidate["_id"]: candidate["links"]
+        for candidate in iter_sampled_candidates(
+            links_collection,
+            CANDIDATES,
+            candidate_surface_appearance=SURFACE_APPEARANCE,
+            candidate_text_surfaces=TEXT_SURFACES,
+            seed=0,
+        )
+    }
+    # Candidates without links to their Abstract are skipped by both
+    assert set(sampled) == set(aggregation)
+    assert CANDIDATES[-1] not in sampled
+    for candidate, surfaces in sampled.items():
+        expected_surfaces = aggregation[candidate]
+        assert len(surfaces) == len(expected_surfaces) == TEXT_SURFACES
+        for surface, expected_surface in zip(surfaces, expected_surfaces):
+            assert set(surface) == set(expected_surface) == {"link", "count"}
+            assert len(surface["link"]) == len(expected_surface["link"])
+            assert len(surface["link"]) == SURFACE_APPEARANCE
+            texts = {link["text"] for link in surface["link"]}
+            assert len(texts) == 1
+            assert len({link["source_doc"] for link in surface["link"]}) == len(
+                surface["link"]
+            )
+            for link in surface["link"]:
+                assert set(link) == set(expected_surface["link"][0])
+                assert link["links_to"] == candidate
+                assert links_collection.find_one(
+                    {**link, "links_to_section": "Abstract"}
+                )
+
+
+def test_sample_candidate_links_stops_reading_when_full(links_collection):
+    links = links_collection.find(
+        {"links_to": CANDIDATES[0], "links_to_section": "Abstract"}, LINK_PROJECTION
+    )
+    links = list(links)
+    consumed = itertools.count()
+    candidate_links = sample_candidate_links(
+        (link for link in links if next(consumed) >= 0),
+        candidate_surface_appearance=2,
+        candidate_text_surfaces=1,
+    )
+    assert len(candidate_links) == 1
+    assert candidate_links[0]["count"] == 2
+    assert next(consumed) < len(links)
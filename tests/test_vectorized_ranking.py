@@ -0,0 +1,93 @@
+"""
+Vectorized ranking of a links parquet export against the aggregation of count_links_by_aggregation.
+"""
+import mongomock
+import pytest
+
+from wbdsm.links.links_parquet import write_links_parquet
+from wbdsm.links.ranking import count_links_by_aggregation
+from wbdsm.links.vectorized_ranking import (
+    count_links_vectorized,
+    iter_links_chunks,
+    rank_links_vectorized,
+)
+
+
+def get_link(links_to, source_doc, text, start=0):
+    return {
+        "_id": f"{source_doc}-{links_to}-{start}",
+        "start": start,
+        "end": start + len(text),
+        "text": text,
+        "links_to": links_to,
+        "source_doc": source_doc,
+        "links_to_section": "Abstract",
+        "source_doc_section": "Abstract",
+        "language": "en",
+        "type": "wiki_link",
+    }
+
+
+# Ties: Beta, Alpha and Delta have 2 distinct (source_doc, text), Gamma and Epsilon 1
+LINKS = [
+    get_link("Beta", "Doc 1", "beta"),
+    get_link("Beta", "Doc 1", "beta", start=10),
+    get_link("Beta", "Doc 2", "beta"),
+    get_link("Alpha", "Doc 1", "alpha"),
+    get_link("Alpha", "Doc 1", "the alpha", start=10),
+    get_link("Gamma", "Doc 3", "gamma"),
+    get_link("Gamma", "Doc 3", "gamma", start=10),
+    get_link("Delta", "Doc 2", "delta"),
+    get_link("Delta", "Doc 3", "delta"),
+    get_link("Epsilon", "Doc 1", "epsilon"),
+    get_link("Zeta", "Doc 1", "zeta"),
+    get_link("Zeta", "Doc 2", "zeta"),
+    get_link("Zeta", "Doc 2", "Zeta", start=10),
+]
+
+EXPECTED = [
+    {"_id": "Zeta", "count": 3},
+    {"_id": "Alpha", "count": 2},
+    {"_id": "Beta", "count": 2},
+    {"_id": "Delta", "count": 2},
+    {"_id": "Epsilon", "count": 1},
+    {"_id": "Gamma", "count": 1},
+]
+
+
+@pytest.fixture
+def links_path(tmp_path):
+    # 2 parts, the dictionaries of each part are different
+    write_links_parquet(LINKS[:6], str(tmp_path), part="0")
+    write_links_parquet(LINKS[6:], str(tmp_path), part="1")
+    return str(tmp_path)
+
+
+def rank(path, chunk_size=4):
+    return list(
+        rank_links_vectorized(
+            *count_links_vectorized(iter_links_chunks(path, chunk_size))
+        )
+    )
+
+
+def test_rank_links_vectorized_matches_aggregation(links_path):
+    links_collection = mongomock.MongoClient().db.links
+    links_collection.insert_many([dict(link) for link in LINKS])
+    assert list(count_links_by_aggregation(links_collection)) == EXPECTED
+    assert rank(links_path) == EXPECTED
+
+
+def test_rank_links_vectorized_parquet_file(tmp_path):
+    write_links_parquet(LINKS, str(tmp_path), part="0")
+    (path,) = tmp_path.glob("*.parquet")
+    assert rank(str(path)) == EXPECTED
+
+
+def test_iter_links_chunks_rejects_other_files(tmp_path):
+    path = tmp_path / "links.jsonl"
+    path.write_text("")
+    with pytest.raises(ValueError, match="links.jsonl"):
+        iter_links_chunks(str(path))
+    with pytest.raises(ValueError):
+        iter_links_chunks(str(tmp_path / "missing"))
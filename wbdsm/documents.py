@@ -1,12 +1,52 @@
-import re
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
 
-from wbdsm.preprocessing import clean_text, decode_id
+from wbdsm.preprocessing import clean_text, decode_id, title_codec
 
 NO_PAGE = "\]ds[];x;[s892jkmnsnoas8742981u9cunmsn1892][/x"
 
 
+def add_slots(cls):
+    """
+    Recreate a dataclass with __slots__, as @dataclass(slots=True) does from python 3.10.
+    Instances don't have a __dict__, reducing the memory of the (many) parsed documents.
+    """
+    field_names = tuple(field.name for field in fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = field_names
+    # Defaults are already on __init__, they can't be class attributes with __slots__
+    for field_name in field_names:
+        cls_dict.pop(field_name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
+
+
+def get_redirect_section(raw: str, page: str) -> Optional[str]:
+    r"""
+    Section of [[page#section]] on the redirect's raw text.
+    Same as re.findall(rf"\[\[{re.escape(page)}#(.*)\]\]", raw)[0] without compiling a regex for each redirect.
+    """
+    if not raw:
+        return None
+    prefix = "[[" + page + "#"
+    start = raw.find(prefix)
+    while start != -1:
+        section_start = start + len(prefix)
+        # ".*" is greedy and doesn't match new lines: the section ends on the last "]]" of the line
+        line_end = raw.find("\n", section_start)
+        if line_end == -1:
+            line_end = len(raw)
+        section_end = raw.rfind("]]", section_start, line_end)
+        if section_end != -1:
+            return raw[section_start:section_end]
+        start = raw.find(prefix, start + 1)
+    return None
+
+
+@add_slots
 @dataclass
 class Link:
     """Link to a document."""
@@ -19,7 +59,7 @@ class Link:
 
     def __post_init__(self):
         # Clean text and page - no lower case to match content
-        self.page = decode_id(self.page)
+        self.page = title_codec.decode_id(self.page)
         # If text=page we have from dumpster that link["page"]=None
         self.text = clean_text(self.text) if self.text else self.page
         # Links with space sometimes are with underscore to represent the space
@@ -56,6 +96,7 @@ class Link:
         )
 
 
+@add_slots
 @dataclass
 class Section:
     """Section of a document."""
@@ -66,7 +107,7 @@ class Section:
     index: str
 
     def __post_init__(self):
-        self.title = decode_id(self.title)
+        self.title = title_codec.decode_id(self.title)
         self.content = clean_text(self.content)
 
     @classmethod
@@ -81,6 +122,7 @@ class Section:
         )
 
 
+@add_slots
 @dataclass
 class Page:
     """Page of a document."""
@@ -91,6 +133,7 @@ class Page:
     language: str
 
     def __post_init__(self):
+        # Each page is parsed once, its id and title would only evict the hot links titles from the titles cache
         self.id = decode_id(self.id)
         self.title = decode_id(self.title)
 
@@ -115,6 +158,59 @@ class Page:
         return None
 
 
+class LazyPage:
+    """
+    Page of a document parsed on demand.
+
+    Keeps the raw mongo document and only decodes/cleans a section (and builds its links) when it's accessed.
+    Sections are found by title in O(1). Same interface as Page.
+    """
+
+    __slots__ = ("data", "language", "id", "title", "_sections", "_section_keys")
+
+    def __init__(self, data: dict, language: str):
+        self.data = data
+        self.language = language
+        # Not cached, as in Page
+        self.id = decode_id(data["_id"])
+        self.title = decode_id(data.get("title"))
+        # Parsed sections by their mongo key
+        self._sections = {}
+        self._section_keys = None
+
+    @classmethod
+    def from_mongo(cls, data, language):
+        return cls(data, language)
+
+    def _get_section_keys(self) -> Dict[str, str]:
+        # Section title -> mongo key, the first one is kept for repeated titles as in Page.get_section
+        if self._section_keys is None:
+            self._section_keys = {}
+            for key in self.data.get("sections", {}):
+                self._section_keys.setdefault(title_codec.decode_id(key), key)
+        return self._section_keys
+
+    def _get_parsed_section(self, key: str) -> Section:
+        section = self._sections.get(key)
+        if section is None:
+            section = Section.from_mongo_page(
+                key, self.data["sections"][key], self.language
+            )
+            self._sections[key] = section
+        return section
+
+    @property
+    def sections(self) -> List[Section]:
+        return [self._get_parsed_section(key) for key in self.data.get("sections", {})]
+
+    def get_section(self, section_title) -> Optional[Section]:
+        key = self._get_section_keys().get(section_title)
+        if key is None:
+            return None
+        return self._get_parsed_section(key)
+
+
+@add_slots
 @dataclass
 class RedirectPage:
     """Page of a redirect document."""
@@ -129,7 +225,7 @@ class RedirectPage:
         self.title = clean_text(self.title)
         # Some pages are redirect but don't have redirectToPage. We drop them. Ex case: when a page is a category (redirects to itself but as Category:)
         self.redirectToPage = (
-            decode_id(self.redirectToPage).replace("_", " ")
+            title_codec.decode_id(self.redirectToPage).replace("_", " ")
             if self.redirectToPage
             else None
         )
@@ -143,11 +239,8 @@ class RedirectPage:
         if redirect_to_dict and redirect_to_dict.get("page"):
             redirectToPage = redirect_to_dict["page"]
             raw = redirect_to_dict.get("raw")
-            redirectToSection = re.findall(
-                rf"\[\[{re.escape(redirectToPage)}#(.*)\]\]", raw
-            )
             # If to section or not
-            redirectToSection = redirectToSection[0] if redirectToSection else None
+            redirectToSection = get_redirect_section(raw, redirectToPage)
         else:
             # Broken redirect
             # As redirectToPage = None, mention will be dropped
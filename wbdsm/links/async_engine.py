@@ -0,0 +1,466 @@
+"""
+Async links extraction with motor, overlapping the mongo reads, the parsing, the links resolution and the writes.
+
+Five stages connected by bounded queues (of --prefetch chunks), each one working on its own chunk:
+1. Fetch: the pages of the next chunks are prefetched.
+2. Parse: the pages are parsed with wbdsm.documents on a thread.
+3. Resolve: the links targets of the chunk are resolved with concurrent "$in" queries (at most --concurrency at a
+   time), while the next chunk is parsed.
+4. Extract: the links are extracted with wbdsm.links.extract_links on a thread, as on the celery and local engines.
+5. Write: the links are written with unordered bulk writes while the next chunks are processed.
+
+The chunks are tracked on the chunk ledger as in the celery app and the local engine: a chunk that fails is marked as
+failed and the next ones keep going, and a restarted run only processes the chunks not indexed.
+
+Usage:
+    wbdsm-extract-links-async --mongo_uri mongodb://localhost:27017 --language en --concurrency 16
+"""
+import asyncio
+import logging
+from datetime import datetime
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from wbdsm.documents import Page
+from wbdsm.links.chunk_ledger import ChunkLedger, get_chunk_id
+from wbdsm.links.chunk_plan import PAGES_INDEX, get_plan
+from wbdsm.links.extract_links import (
+    extract_links,
+    get_next_hop_titles,
+    get_resolutions,
+    iter_links_targets,
+)
+from wbdsm.links.index_links import (
+    DEFAULT_BATCH_SIZE,
+    INDEX_MODES,
+    LINK_COUNTS_COLLECTION,
+    LINK_PAIRS_COLLECTION,
+    count_duplicates,
+    count_new_pairs,
+    create_links_indexes,
+    get_duplicate_positions,
+    get_link_counts_operations,
+    get_link_pairs,
+    get_link_pairs_documents,
+    get_upsert_operations,
+    iter_batches,
+)
+from wbdsm.links.redirects import (
+    MAX_REDIRECT_HOPS,
+    REDIRECT_PROJECTION,
+    get_redirect_target,
+)
+from wbdsm.links.title_resolver import MappingTitleResolver
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser, boolean_string
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+async def fetch_chunk_pages(
+    pages_collection: AsyncIOMotorCollection, skip, limit: int
+) -> List[dict]:
+    """Async chunk_plan.get_chunk_pages."""
+    return await (
+        pages_collection.find({"isRedirect": False, "pageID": {"$gt": skip}})
+        .sort("pageID", 1)
+        .limit(limit)
+        .to_list(length=None)
+    )
+
+
+async def fetch_redirects(
+    pages_collection: AsyncIOMotorCollection,
+    titles: List[str],
+    semaphore: asyncio.Semaphore,
+    redirects: dict,
+):
+    async with semaphore:
+        pages = await pages_collection.find(
+            {"title": {"$in": titles}}, REDIRECT_PROJECTION
+        ).to_list(length=None)
+    for page in pages:
+        # As find_one, keeps the first page found for the title
+        if page["title"] not in redirects:
+            redirects[page["title"]] = get_redirect_target(page)
+
+
+async def fetch_resolved_titles(
+    resolved_titles_collection: AsyncIOMotorCollection,
+    titles: List[str],
+    semaphore: asyncio.Semaphore,
+    resolutions: dict,
+):
+    async with semaphore:
+        resolved_titles = await resolved_titles_collection.find(
+            {"_id": {"$in": titles}}
+        ).to_list(length=None)
+    for resolved in resolved_titles:
+        resolutions[resolved["_id"]] = (
+            resolved["links_to"],
+            resolved["section"],
+            resolved["hops"],
+        )
+
+
+async def resolve_links_targets_async(
+    pages_obj: List[Page],
+    pages_collection: AsyncIOMotorCollection,
+    semaphore: asyncio.Semaphore,
+    min_query_size: int = 50,
+    query_size: int = 200,
+    resolved_titles_collection: Optional[AsyncIOMotorCollection] = None,
+) -> MappingTitleResolver:
+    """
+    Async extract_links.resolve_links_targets: the "$in" queries of each redirect hop are sent concurrently.
+    """
+    titles = list(dict.fromkeys(iter_links_targets(pages_obj, min_query_size)))
+    if resolved_titles_collection is not None:
+        resolutions = {}
+        await asyncio.gather(
+            *(
+                fetch_resolved_titles(
+                    resolved_titles_collection, batch, semaphore, resolutions
+                )
+                for batch in iter_batches(titles, query_size)
+            )
+        )
+        return MappingTitleResolver(resolutions)
+
+    redirects = {}
+    to_query = titles
+    queried = set()
+    for _ in range(MAX_REDIRECT_HOPS + 1):
+        if not to_query:
+            break
+        queried.update(to_query)
+        await asyncio.gather(
+            *(
+                fetch_redirects(pages_collection, batch, semaphore, redirects)
+                for batch in iter_batches(to_query, query_size)
+            )
+        )
+        to_query = get_next_hop_titles(redirects, queried)
+    return MappingTitleResolver(get_resolutions(titles, redirects))
+
+
+async def update_link_counts_async(
+    links: List[dict],
+    link_pairs_collection: AsyncIOMotorCollection,
+    link_counts_collection: AsyncIOMotorCollection,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Async index_links.update_link_counts."""
+    new_counts = Counter()
+    for batch in iter_batches(get_link_pairs(links), batch_size):
+        duplicates = set()
+        try:
+            await link_pairs_collection.insert_many(
+                get_link_pairs_documents(batch), ordered=False
+            )
+        except BulkWriteError as error:
+            duplicates = get_duplicate_positions(error)
+        count_new_pairs(batch, duplicates, new_counts)
+    if new_counts:
+        await link_counts_collection.bulk_write(
+            get_link_counts_operations(new_counts), ordered=False
+        )
+    return sum(new_counts.values())
+
+
+async def write_links(
+    links: List[dict],
+    links_collection: AsyncIOMotorCollection,
+    mode: str,
+    batch_size: int,
+    count_links: bool = True,
+) -> Dict[str, int]:
+    """Async index_links.index_links."""
+    if mode == "upsert":
+        counts = {"upserted": 0, "updated": 0}
+        if links:
+            result = await links_collection.bulk_write(
+                get_upsert_operations(links), ordered=False
+            )
+            counts = {
+                "upserted": result.upserted_count,
+                "updated": result.matched_count,
+            }
+    else:
+        n_inserted = 0
+        n_duplicates = 0
+        for batch in iter_batches(links, batch_size):
+            try:
+                result = await links_collection.insert_many(batch, ordered=False)
+                n_inserted += len(result.inserted_ids)
+            except BulkWriteError as error:
+                n_inserted += error.details["nInserted"]
+                n_duplicates += count_duplicates(error)
+        counts = {"inserted": n_inserted, "duplicates": n_duplicates}
+    if count_links:
+        database = links_collection.database
+        counts["new_pairs"] = await update_link_counts_async(
+            links,
+            database[LINK_PAIRS_COLLECTION],
+            database[LINK_COUNTS_COLLECTION],
+            batch_size,
+        )
+    return counts
+
+
+def parse_pages(pages: List[dict], language: str) -> List[Page]:
+    return [Page.from_mongo(page, language) for page in pages]
+
+
+async def update_ledger(method: Callable, *args):
+    """The ledger is written with the sync client, on a thread so the other stages keep going."""
+    await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+
+async def fail_chunk(ledger: ChunkLedger, chunk_id: str, error: Exception):
+    logger.exception(f"Chunk {chunk_id} failed")
+    await update_ledger(ledger.mark_failed, chunk_id, repr(error))
+
+
+async def run_stage(
+    process: Callable[[str, object], Awaitable],
+    in_queue: asyncio.Queue,
+    out_queue: asyncio.Queue,
+    ledger: ChunkLedger,
+):
+    """
+    Process the (chunk_id, n_pages, value) of in_queue and put the results on out_queue, until a None is received.
+    A chunk that fails is marked on the ledger and dropped, the next ones keep going.
+    """
+    item = await in_queue.get()
+    while item is not None:
+        chunk_id, n_pages, value = item
+        try:
+            value = await process(chunk_id, value)
+        except Exception as error:
+            await fail_chunk(ledger, chunk_id, error)
+        else:
+            await out_queue.put((chunk_id, n_pages, value))
+        item = await in_queue.get()
+    await out_queue.put(None)
+
+
+async def fetch_stage(
+    pages_collection: AsyncIOMotorCollection,
+    boundaries: List,
+    chunk_size: int,
+    pages_queue: asyncio.Queue,
+    ledger: ChunkLedger,
+):
+    for boundary in boundaries:
+        chunk_id = get_chunk_id(boundary)
+        await update_ledger(ledger.mark_dispatched, chunk_id)
+        try:
+            pages = await fetch_chunk_pages(pages_collection, boundary, chunk_size)
+        except Exception as error:
+            await fail_chunk(ledger, chunk_id, error)
+        else:
+            await pages_queue.put((chunk_id, len(pages), pages))
+    await pages_queue.put(None)
+
+
+async def parse_stage(
+    language: str,
+    pages_queue: asyncio.Queue,
+    parsed_queue: asyncio.Queue,
+    ledger: ChunkLedger,
+):
+    loop = asyncio.get_running_loop()
+
+    async def parse(chunk_id: str, pages: List[dict]) -> List[Page]:
+        # Parsing is CPU bound, on a thread the lookups and writes keep going
+        return await loop.run_in_executor(None, parse_pages, pages, language)
+
+    await run_stage(parse, pages_queue, parsed_queue, ledger)
+
+
+async def resolve_stage(
+    pages_collection: AsyncIOMotorCollection,
+    resolved_titles_collection: Optional[AsyncIOMotorCollection],
+    min_query_size: int,
+    semaphore: asyncio.Semaphore,
+    parsed_queue: asyncio.Queue,
+    resolved_queue: asyncio.Queue,
+    ledger: ChunkLedger,
+):
+    async def resolve(chunk_id: str, pages_obj: List[Page]):
+        title_resolver = await resolve_links_targets_async(
+            pages_obj,
+            pages_collection,
+            semaphore,
+            min_query_size=min_query_size,
+            resolved_titles_collection=resolved_titles_collection,
+        )
+        return pages_obj, title_resolver
+
+    await run_stage(resolve, parsed_queue, resolved_queue, ledger)
+
+
+async def extract_stage(
+    min_query_size: int,
+    resolved_queue: asyncio.Queue,
+    links_queue: asyncio.Queue,
+    ledger: ChunkLedger,
+):
+    loop = asyncio.get_running_loop()
+
+    async def extract(chunk_id: str, resolved) -> List[dict]:
+        pages_obj, title_resolver = resolved
+        links = await loop.run_in_executor(
+            None, extract_links, pages_obj, None, min_query_size, title_resolver
+        )
+        await update_ledger(ledger.mark_extracted, chunk_id, len(links))
+        return links
+
+    await run_stage(extract, resolved_queue, links_queue, ledger)
+
+
+async def write_stage(
+    links_collection: AsyncIOMotorCollection,
+    mode: str,
+    batch_size: int,
+    links_queue: asyncio.Queue,
+    n_chunks: int,
+    ledger: ChunkLedger,
+    count_links: bool = True,
+):
+    start = datetime.now()
+    n_pages = 0
+    n_chunk = 0
+    item = await links_queue.get()
+    while item is not None:
+        chunk_id, chunk_pages, links = item
+        n_chunk += 1
+        try:
+            counts = await write_links(
+                links, links_collection, mode, batch_size, count_links
+            )
+        except Exception as error:
+            await fail_chunk(ledger, chunk_id, error)
+        else:
+            await update_ledger(ledger.mark_indexed, chunk_id, counts)
+            n_pages += chunk_pages
+            elapsed = (datetime.now() - start).total_seconds()
+            logger.info(
+                f"Chunk {n_chunk}/{n_chunks} (pageID {chunk_id}): {counts}, {n_pages} pages, {n_pages / elapsed:.1f} pages/s"
+            )
+        item = await links_queue.get()
+    return n_pages
+
+
+async def run_pipeline(db, args: dict, boundaries: List, ledger: ChunkLedger) -> int:
+    """Run the stages over the chunks of boundaries on db (a motor database). Returns the number of indexed pages."""
+    resolved_titles_collection = (
+        db["resolved_titles"] if args["use_resolved_titles"] else None
+    )
+    semaphore = asyncio.Semaphore(args["concurrency"])
+    pages_queue = asyncio.Queue(maxsize=args["prefetch"])
+    parsed_queue = asyncio.Queue(maxsize=args["prefetch"])
+    resolved_queue = asyncio.Queue(maxsize=args["prefetch"])
+    links_queue = asyncio.Queue(maxsize=args["prefetch"])
+    *_, n_pages = await asyncio.gather(
+        fetch_stage(db["pages"], boundaries, args["chunk_size"], pages_queue, ledger),
+        parse_stage(args["language"], pages_queue, parsed_queue, ledger),
+        resolve_stage(
+            db["pages"],
+            resolved_titles_collection,
+            args["min_query_size"],
+            semaphore,
+            parsed_queue,
+            resolved_queue,
+            ledger,
+        ),
+        extract_stage(args["min_query_size"], resolved_queue, links_queue, ledger),
+        write_stage(
+            db["links"],
+            args["index_mode"],
+            args["index_batch_size"],
+            links_queue,
+            len(boundaries),
+            ledger,
+            args["count_links"],
+        ),
+    )
+    return n_pages
+
+
+async def run_async(args: dict, boundaries: List, ledger: ChunkLedger) -> int:
+    client = AsyncIOMotorClient(args["mongo_uri"])
+    return await run_pipeline(
+        client[args["language"] + "wiki"], args, boundaries, ledger
+    )
+
+
+def run(args: dict):
+    initial = datetime.now()
+    # Indexes and plan with the sync client, as on the celery app
+    db = MongoClient(args["mongo_uri"])[args["language"] + "wiki"]
+    db["pages"].create_index(PAGES_INDEX)
+    db["pages"].create_index("title")
+    boundaries = get_plan(
+        db["pages"],
+        args["chunk_size"],
+        plan_path=args["plan_path"],
+        last_page_id=args["last_pageID"],
+    )
+    ledger = ChunkLedger(db["chunk_ledger"])
+    if args["reset_ledger"]:
+        ledger.reset()
+    boundaries = ledger.plan(boundaries, args["chunk_size"])
+    if not args["bulk_load"]:
+        create_links_indexes(db["links"])
+
+    start = datetime.now()
+    n_pages = asyncio.run(run_async(args, boundaries, ledger))
+    elapsed = datetime.now() - start
+    logger.info(
+        f"Indexed {n_pages} pages in {elapsed}, {n_pages / elapsed.total_seconds():.1f} pages/s"
+    )
+    if args["bulk_load"]:
+        create_links_indexes(db["links"])
+    logger.info(f"Chunks by state: {ledger.summary()}")
+    logger.info(f"Finished in {datetime.now() - initial}")
+
+
+def main():
+    parser = WBDSMArgParser()
+    parser.add_argument(
+        "--concurrency",
+        default=16,
+        type=int,
+        help="Max number of concurrent links targets queries",
+    )
+    parser.add_argument(
+        "--prefetch",
+        default=2,
+        type=int,
+        help="Chunks waiting between each pair of stages (fetched, parsed, resolved and extracted ones)",
+    )
+    parser.add_argument("--chunk_size", default=CHUNK_SIZE, type=int)
+    parser.add_argument("--min_query_size", default=50, type=int)
+    parser.add_argument("--use_resolved_titles", default=False, type=boolean_string)
+    parser.add_argument("--index_mode", default="upsert", choices=INDEX_MODES)
+    parser.add_argument("--index_batch_size", default=DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument("--bulk_load", default=False, type=boolean_string)
+    parser.add_argument(
+        "--count_links",
+        default=True,
+        type=boolean_string,
+        help="Maintain the link_counts collection used by rank_by_links.py --rank_source link_counts",
+    )
+    args = parser.parse_known_args()[0].__dict__
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Durable ledger of the links extraction chunks, kept on the chunk_ledger collection.
+
+Each chunk of the plan (see wbdsm.links.chunk_plan) is a document
+{_id: chunk id, skip: pageID boundary, limit: chunk size, state, planned_at, dispatched_at, extracted_at, indexed_at, n_links}
+updated by the app (planned, dispatched) and by the workers (extracted, indexed, failed). On restart only the chunks not
+indexed are dispatched again.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+PLANNED = "planned"
+DISPATCHED = "dispatched"
+EXTRACTED = "extracted"
+INDEXED = "indexed"
+FAILED = "failed"
+
+
+def get_chunk_id(boundary) -> str:
+    # pageIDs may be numbers, ids are strings as the chunk ids sent to the tasks
+    return str(boundary)
+
+
+class ChunkLedger:
+    def __init__(self, ledger_collection: Collection):
+        self.ledger_collection = ledger_collection
+
+    def reset(self) -> None:
+        self.ledger_collection.drop()
+
+    def plan(self, boundaries: List, chunk_size: int) -> List:
+        """
+        Add the chunks of the plan to the ledger, keeping the state of the ones already there.
+
+        Returns the boundaries of the chunks not indexed yet, in the plan order.
+        """
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {"_id": get_chunk_id(boundary)},
+                {
+                    "$setOnInsert": {
+                        "skip": boundary,
+                        "limit": chunk_size,
+                        "state": PLANNED,
+                        "planned_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for boundary in boundaries
+        ]
+        if operations:
+            self.ledger_collection.bulk_write(operations, ordered=False)
+        self.ledger_collection.create_index([("state", ASCENDING)])
+        indexed = {
+            chunk["_id"]
+            for chunk in self.ledger_collection.find({"state": INDEXED}, {"_id": 1})
+        }
+        pending = [
+            boundary for boundary in boundaries if get_chunk_id(boundary) not in indexed
+        ]
+        logger.info(
+            f"Ledger: {len(boundaries) - len(pending)} chunks already indexed, {len(pending)} to dispatch"
+        )
+        return pending
+
+    def _set_state(self, chunk_id: str, state: str, **fields) -> None:
+        fields[f"{state}_at"] = datetime.now()
+        self.ledger_collection.update_one(
+            {"_id": chunk_id}, {"$set": {"state": state, **fields}}
+        )
+
+    def mark_dispatched(self, chunk_id: str) -> None:
+        self._set_state(chunk_id, DISPATCHED)
+
+    def mark_extracted(self, chunk_id: str, n_links: int) -> None:
+        self._set_state(chunk_id, EXTRACTED, n_links=n_links)
+
+    def mark_indexed(self, chunk_id: str, counts: Dict[str, int]) -> None:
+        self._set_state(chunk_id, INDEXED, counts=counts)
+
+    def mark_failed(self, chunk_id: str, error: str) -> None:
+        self._set_state(chunk_id, FAILED, error=error)
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Number of chunks by state, with the mean extraction (dispatched -> extracted) and indexing (extracted -> indexed)
+        times in milliseconds.
+        """
+        summary = {}
+        for state in self.ledger_collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": "$state",
+                        "chunks": {"$sum": 1},
+                        "links": {"$sum": "$n_links"},
+                        "extraction_ms": {
+                            "$avg": {"$subtract": ["$extracted_at", "$dispatched_at"]}
+                        },
+                        "indexing_ms": {
+                            "$avg": {"$subtract": ["$indexed_at", "$extracted_at"]}
+                        },
+                    }
+                }
+            ]
+        ):
+            summary[state.pop("_id")] = state
+        return summary
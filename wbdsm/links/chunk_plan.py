@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional
+
+import pymongo
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+PAGES_INDEX = [("isRedirect", pymongo.DESCENDING), ("pageID", pymongo.ASCENDING)]
+
+
+def plan_chunks(
+    pages_collection: Collection,
+    chunk_size: int,
+    last_page_id: Optional[int] = None,
+    batch_size: int = 100000,
+) -> List[int]:
+    """
+    Compute the chunks of articles (non redirect pages) for extract_links_task in a single pass over the
+    (isRedirect, pageID) index.
+
+    Returns the pageID boundaries: chunk i has the chunk_size articles with pageID > boundaries[i].
+    Same boundaries as querying each chunk with skip(chunk_size - 1), but it's a covered query (only the index is read)
+    streamed once instead of a query per chunk.
+    """
+    query = {"isRedirect": False}
+    if last_page_id is not None:
+        query["pageID"] = {"$gte": last_page_id}
+    pages = (
+        pages_collection.find(query, {"_id": 0, "pageID": 1})
+        .sort("pageID", pymongo.ASCENDING)
+        .hint(PAGES_INDEX)
+        .batch_size(batch_size)
+    )
+    boundaries = []
+    for n_page, page in enumerate(pages):
+        if n_page % chunk_size == 0:
+            boundaries.append(page["pageID"])
+    return boundaries
+
+
+def get_chunk_pages(pages_collection: Collection, skip, limit: int) -> List[dict]:
+    """
+    Articles of the chunk: the limit articles with pageID > skip.
+    """
+    return list(
+        pages_collection.find({"isRedirect": False, "pageID": {"$gt": skip}})
+        .sort("pageID", 1)
+        .limit(limit)
+    )
+
+
+def save_plan(path: str, boundaries: List[int], chunk_size: int):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"chunk_size": chunk_size, "boundaries": boundaries}, f)
+
+
+def load_plan(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def get_plan(
+    pages_collection: Collection,
+    chunk_size: int,
+    plan_path: Optional[str] = None,
+    last_page_id: Optional[int] = None,
+) -> List[int]:
+    """
+    Load the plan from plan_path if it exists (and has the same chunk_size), otherwise compute it and save it on plan_path.
+    The plan is always computed if last_page_id is given.
+    """
+    if plan_path and os.path.exists(plan_path) and last_page_id is None:
+        plan = load_plan(plan_path)
+        if plan["chunk_size"] == chunk_size:
+            logger.info(f"Loaded plan with {len(plan['boundaries'])} chunks")
+            return plan["boundaries"]
+        logger.info(f"Plan on {plan_path} has another chunk size, recomputing it")
+
+    time_now = datetime.now()
+    boundaries = plan_chunks(pages_collection, chunk_size, last_page_id=last_page_id)
+    logger.info(f"Planned {len(boundaries)} chunks in {datetime.now() - time_now}")
+    if plan_path:
+        save_plan(plan_path, boundaries, chunk_size)
+    return boundaries
@@ -0,0 +1,102 @@
+"""
+Registry of the candidates of a dataset: title -> (candidate_index, reference_rank), saved next to candidates.jsonl.
+
+It's a StringTable (wbdsm.string_table), mmap'd with O(1) lookups, so the dataset builder and the later tools don't need
+to rebuild and scan the candidates list.
+"""
+import json
+import os
+from typing import Iterable, Iterator, Optional
+
+from wbdsm.string_table import StringTable, write_string_table
+
+CANDIDATES_FILE = "candidates.jsonl"
+REGISTRY_FILE = "candidates_registry.bin"
+
+
+def get_registry_path(output_path: str) -> str:
+    return os.path.join(output_path, REGISTRY_FILE)
+
+
+class CandidateRegistry:
+    def __init__(self, path: str):
+        self.table = StringTable(path)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __contains__(self, title: str) -> bool:
+        return title in self.table
+
+    @staticmethod
+    def write(path: str, candidates: Iterable[dict]) -> int:
+        """
+        Write the registry of the candidates (as returned by get_abstracts). For a repeated title the first candidate is
+        kept, as list.index does.
+        """
+        return write_string_table(
+            path,
+            (
+                (
+                    candidate["candidate"],
+                    (
+                        str(candidate["candidate_index"]),
+                        str(candidate["reference_rank"]),
+                    ),
+                )
+                for candidate in candidates
+            ),
+        )
+
+    @classmethod
+    def from_candidates_file(cls, output_path: str, rebuild: bool = False):
+        """
+        Load the registry of the dataset on output_path, building it from its candidates.jsonl if it doesn't exist.
+        """
+        path = get_registry_path(output_path)
+        if rebuild or not os.path.exists(path):
+            with open(os.path.join(output_path, CANDIDATES_FILE), "r") as f:
+                cls.write(path, (json.loads(line) for line in f))
+        return cls(path)
+
+    def get_index(self, title: str) -> Optional[int]:
+        """candidate_index of the title, None if it's not a candidate."""
+        values = self.table.get(title)
+        if values is None:
+            return None
+        return int(values[0])
+
+    def get_rank(self, title: str) -> Optional[int]:
+        """reference_rank of the title, None if it's not a candidate."""
+        values = self.table.get(title)
+        if values is None or values[1] == "None":
+            return None
+        return int(values[1])
+
+    def close(self):
+        self.table.close()
+
+
+def iter_candidates_titles(
+    output_path: str,
+    candidate_registry: Optional[CandidateRegistry] = None,
+    shard: int = 0,
+    n_shards: int = 1,
+) -> Iterator[str]:
+    """
+    Titles of the candidates of candidates.jsonl on output_path, streamed. With the registry a repeated title is only
+    given once, for the candidate kept by the registry. With n_shards only the titles of the shard are given, the
+    candidate i of the file goes to the shard i % n_shards.
+    """
+    with open(os.path.join(output_path, CANDIDATES_FILE), "r") as f:
+        for position, line in enumerate(f):
+            if position % n_shards != shard:
+                continue
+            candidate = json.loads(line)
+            if (
+                candidate_registry is not None
+                and candidate_registry.get_index(candidate["candidate"])
+                != candidate["candidate_index"]
+            ):
+                continue
+            yield candidate["candidate"]
@@ -1,18 +1,25 @@
 import json
 import logging
 import os
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 from pymongo.collection import Collection
-from wbdsm.documents import Page
+from wbdsm.links.entity_linking.candidate_registry import CandidateRegistry
 from wbdsm.links.entity_linking.parse import get_dataset_item
+from wbdsm.links.entity_linking.sampling import iter_sampled_candidates
+from wbdsm.links.entity_linking.section_cache import (
+    SECTION_CACHE_SIZE,
+    SectionCache,
+)
 from wbdsm.links.entity_linking.queries import get_entity_linking_query
 from wbdsm.preprocessing import clean_text
 
 logger = logging.getLogger(__name__)
 
+LINKS_FILE = "links.jsonl"
+
 
 def create_links_dataset_by_agg(
-    abstract_titles: List[str],
+    abstract_titles: Iterable[str],
     links_collection: Collection,
     pages_collection: Collection,
     language: str,
@@ -21,31 +28,80 @@ def create_links_dataset_by_agg(
     query_max_chars: int,
     sample_size: int,
     output_path: str,
+    candidate_registry: Optional[CandidateRegistry] = None,
+    section_cache_size: int = SECTION_CACHE_SIZE,
+    project_sections: bool = True,
+    sampling: str = "aggregation",
+    sampling_seed: Optional[int] = None,
+    links_file_name: str = LINKS_FILE,
     **kwargs,
 ):
-    links_query = {"$match": {"links_to": {"$in": abstract_titles}}}
-    sample = {
-        "$sample": {
-            "size": sample_size,
-        },
-    }
-    # Shuffle the result
-    sample_shuffle = {"$sample": {"size": len(abstract_titles)}}
-    agg_query = get_entity_linking_query(
-        candidate_surface_appearance=candidate_surface_appearance,
-        candidate_text_surfaces=candidate_text_surfaces,
+    """
+    abstract_titles may be streamed (i.g. iter_candidates_titles) when candidate_registry is given: it gives the
+    candidate_index of the links targets and, with the aggregation, the candidates are filtered with it instead of a $in
+    with all the titles (that can exceed the size of a mongo command). Without registry the candidate_index is the
+    position on abstract_titles.
+    The sections of the source docs are fetched with a projection on the links sections (if project_sections) and
+    kept on a LRU cache of section_cache_size sections between the batches. The mongo bytes fetched are only counted
+    with debug logs.
+    sampling is "aggregation" to sample sample_size links of the links collection with get_entity_linking_query, or
+    "index" to sample the links of each candidate with iter_sampled_candidates.
+    The items are written by candidate to links_file_name on output_path.
+    """
+    section_cache = SectionCache(
+        section_cache_size,
+        project_sections,
+        collect_bytes=logger.isEnabledFor(logging.DEBUG),
     )
-    # Allow disk use - we are using a lot of memory
-    agg_links = links_collection.aggregate(
-        [sample, links_query] + agg_query + [sample_shuffle], allowDiskUse=True
-    ).batch_size(10000)
+    if candidate_registry is not None:
+        get_candidate_index = candidate_registry.get_index
+        is_candidate = candidate_registry.__contains__
+    else:
+        abstract_titles = list(abstract_titles)
+        # First position of each title, as list.index
+        candidate_indexes = {}
+        for index, title in enumerate(abstract_titles):
+            candidate_indexes.setdefault(title, index)
+        get_candidate_index = candidate_indexes.get
+        is_candidate = candidate_indexes.__contains__
+    if sampling == "index":
+        # Links of each candidate fetched with the links_to index and sampled in python
+        agg_links = iter_sampled_candidates(
+            links_collection,
+            abstract_titles,
+            candidate_surface_appearance=candidate_surface_appearance,
+            candidate_text_surfaces=candidate_text_surfaces,
+            seed=sampling_seed,
+        )
+    else:
+        sample = {
+            "$sample": {
+                "size": sample_size,
+            },
+        }
+        pipeline = [sample]
+        if candidate_registry is None:
+            pipeline.append({"$match": {"links_to": {"$in": abstract_titles}}})
+        # Shuffle the result, there are at most sample_size candidates
+        sample_shuffle = {"$sample": {"size": sample_size}}
+        agg_query = get_entity_linking_query(
+            candidate_surface_appearance=candidate_surface_appearance,
+            candidate_text_surfaces=candidate_text_surfaces,
+        )
+        # Allow disk use - we are using a lot of memory
+        agg_candidates = links_collection.aggregate(
+            pipeline + agg_query + [sample_shuffle], allowDiskUse=True
+        ).batch_size(10000)
+        agg_links = (
+            candidate for candidate in agg_candidates if is_candidate(candidate["_id"])
+        )
     logger.info("Stop")
     index_link = 0
     BATCH_SIZE = 100
     batch_n = 0
     # We will have approx BATCH SIZE * n_text_surfaces * n_querys_per_surface items in memory at the same time per batch
     # Open the links json lines file
-    links_file = open(os.path.join(output_path, "links.jsonl"), "w")
+    links_file = open(os.path.join(output_path, links_file_name), "w")
     cursor_alive = True
     while cursor_alive:
         # Batch of links
@@ -56,34 +112,40 @@ def create_links_dataset_by_agg(
             except StopIteration:
                 cursor_alive = False
                 break
+        if not batch:
+            break
         # Flatten the links
         links_per_title = [link for link_dict in batch for link in link_dict["links"]]
         links_per_doc = [
             link for link_dict in links_per_title for link in link_dict["link"]
         ]
-        source_doc_ids = [doc["source_doc"] for doc in links_per_doc]
         # Add the candidate index
         for link_doc in links_per_doc:
-            link_doc["candidate_index"] = abstract_titles.index(link_doc["links_to"])
-        # Get the docs with the sections
-        docs = list(pages_collection.find({"title": {"$in": source_doc_ids}}))
-        docs = {doc["title"]: doc for doc in docs}
+            link_doc["candidate_index"] = get_candidate_index(link_doc["links_to"])
+        # Get the sections of the links, from the cache or from the source docs
+        sections, found_docs = section_cache.get_sections(
+            [
+                (link_doc["source_doc"], link_doc["source_doc_section"])
+                for link_doc in links_per_doc
+            ],
+            pages_collection,
+            language,
+        )
         # Extract the links for each candidate/section
         candidate_data = []
         last_candidate = links_per_doc[0]["links_to"]
         for link_doc in links_per_doc:
-            doc = docs.get(link_doc["source_doc"])
-            if doc:
-                # Save by candidate to make it easier to create an one-shot dataset and to split train/dev/test
-                if last_candidate != link_doc["links_to"] and candidate_data:
-                    candidate_links = {link_doc["links_to"]: candidate_data}
+            # Save by candidate to make it easier to create an one-shot dataset and to split train/dev/test
+            if last_candidate != link_doc["links_to"]:
+                if candidate_data:
+                    candidate_links = {last_candidate: candidate_data}
                     links_file.write(json.dumps(candidate_links) + "\n")
-                    last_candidate = link_doc["links_to"]
-                    candidate_data = []
-
-                # To parse correctly everything
-                page = Page.from_mongo(doc, language=language)
-                section = page.get_section(clean_text(link_doc["source_doc_section"]))
+                last_candidate = link_doc["links_to"]
+                candidate_data = []
+            if link_doc["source_doc"] in found_docs:
+                section = sections[
+                    (link_doc["source_doc"], link_doc["source_doc_section"])
+                ]
                 # Get the query docs for these links
                 # should not fail, but we can have alpha as "A" in link info when linking to a section with alpha in the name (really rare)...
                 if section:
@@ -101,21 +163,26 @@ def create_links_dataset_by_agg(
             else:
                 logger.info(f"Doc not found {link_doc['source_doc']}")
 
+        # Last candidate of the batch
+        if candidate_data:
+            links_file.write(json.dumps({last_candidate: candidate_data}) + "\n")
         batch_n = batch_n + 1
         logger.info(f"Finished processing {batch_n * BATCH_SIZE} candidates")
+        logger.info(f"Sections cache: {section_cache.stats(index_link)}")
     links_file.close()
     return True
 
 
-def get_abstracts(
+def iter_abstracts(
     min_rank: int,
     max_rank: int,
     pages_collection: Collection,
     init_index: int = 0,
     max_chars: int = 1000,
-):
+    batch_size: int = 10000,
+) -> Iterator[dict]:
     """
-    Get abstracts from min_rank to max_rank.
+    Stream the abstracts from min_rank to max_rank, fetched batch_size at a time.
     If max_rank is None, get all the abstracts from min_rank.
     If min_rank is None, get all the abstracts from 0 to max_rank.
     If both are None, get all the abstracts - even without reference rank.
@@ -132,25 +199,54 @@ def get_abstracts(
     pages_query = pages_collection.find(
         query, projection=project, no_cursor_timeout=True
     )
-    abstracts = pages_query.batch_size(10000)
+    abstracts = pages_query.batch_size(batch_size)
     logger.info("Starting to iterate over the abstracts")
-    abstract_total = []
-    index = 0
+    index = init_index
     for row in abstracts:
         # Gets the abstract
         abstract = row["sections"].get("Abstract", None)
         # Years and some list pages doesn't have abstract - skip
         if abstract and len(abstract["text"]) > 64:
             abstract = clean_text(abstract["text"])
-            abstract_total.append(
-                {
-                    "candidate": row["title"],
-                    "abstract": abstract[:max_chars],
-                    "reference_rank": row["reference_rank"],
-                    "candidate_index": index + init_index,
-                }
-            )
+            yield {
+                "candidate": row["title"],
+                "abstract": abstract[:max_chars],
+                "reference_rank": row["reference_rank"],
+                "candidate_index": index,
+            }
             index += 1
     logger.info("Finished iterating over the abstracts")
 
-    return abstract_total
+
+def get_abstracts(
+    min_rank: int,
+    max_rank: int,
+    pages_collection: Collection,
+    init_index: int = 0,
+    max_chars: int = 1000,
+) -> List[dict]:
+    """
+    All the abstracts from min_rank to max_rank on a list, see iter_abstracts.
+    """
+    return list(
+        iter_abstracts(
+            min_rank,
+            max_rank,
+            pages_collection,
+            init_index=init_index,
+            max_chars=max_chars,
+        )
+    )
+
+
+def write_candidates(candidates: Iterable[dict], path: str, mode: str = "w") -> int:
+    """
+    Write the candidates (as returned by iter_abstracts) to a jsonl file as they come. Returns the number written.
+    """
+    n_candidates = 0
+    with open(path, mode) as f:
+        for candidate in candidates:
+            json.dump(candidate, f)
+            f.write("\n")
+            n_candidates += 1
+    return n_candidates
@@ -0,0 +1,117 @@
+"""
+Index driven sampling of the links of the candidates, an alternative to the aggregation of get_entity_linking_query.
+
+The links of each candidate are fetched with the links_to index and sampled in python, so the cost depends on the number
+of links of the candidates instead of on the size of the links collection. The reading of the links of a candidate stops
+once its sample is full, so at most candidate_text_surfaces * candidate_surface_appearance links are kept on memory,
+whatever the number of links of the candidate. The output has the same shape and limits as the aggregation:
+{"_id": candidate, "links": [{"link": [link, ...], "count": number of links of the text surface}, ...]}
+"""
+import itertools
+import logging
+import random
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+LINK_PROJECTION = {
+    "_id": 0,
+    "source_doc": 1,
+    "source_doc_section": 1,
+    "start": 1,
+    "end": 1,
+    "links_to": 1,
+    "text": 1,
+}
+# Links fetched per round trip, a few samples
+LINKS_BATCH_SIZE = 1000
+# Candidates between the progress logs
+LOG_EVERY = 1000
+# Candidates titles shuffled together
+SHUFFLE_SIZE = 10000
+
+
+def sample_candidate_links(
+    links: Iterable[dict],
+    candidate_surface_appearance: int,
+    candidate_text_surfaces: int,
+) -> List[dict]:
+    """
+    Sample the links (of the Abstract) of a candidate with the limits of get_entity_linking_query:
+    1. Keep one link per (source_doc, text), the first one.
+    2. Keep the first candidate_text_surfaces text surfaces found, with their first candidate_surface_appearance links.
+    Stops reading the links once all the text surfaces are full. The surfaces are sorted by their number of links.
+    """
+    surfaces: Dict[str, List[dict]] = {}
+    seen = set()
+    n_full = 0
+    for link in links:
+        surface = surfaces.get(link["text"])
+        if surface is None:
+            if len(surfaces) == candidate_text_surfaces:
+                continue
+            surface = surfaces[link["text"]] = []
+        key = (link["source_doc"], link["text"])
+        if len(surface) == candidate_surface_appearance or key in seen:
+            continue
+        seen.add(key)
+        surface.append(
+            {
+                "source_doc": link["source_doc"],
+                "source_doc_section": link["source_doc_section"],
+                "start": link["start"],
+                "end": link["end"],
+                "links_to": link["links_to"],
+                "text": link["text"],
+            }
+        )
+        if len(surface) == candidate_surface_appearance:
+            n_full += 1
+            if n_full == candidate_text_surfaces:
+                break
+    return [
+        {"link": surface, "count": len(surface)}
+        for surface in sorted(surfaces.values(), key=len, reverse=True)
+    ]
+
+
+def iter_sampled_candidates(
+    links_collection: Collection,
+    candidate_titles: Iterable[str],
+    candidate_surface_appearance: int,
+    candidate_text_surfaces: int,
+    seed: Optional[int] = None,
+    shuffle_size: int = SHUFFLE_SIZE,
+) -> Iterator[dict]:
+    """
+    Sampled links of the candidates, fetched one candidate at a time with the links_to index. The titles are streamed
+    and shuffled shuffle_size at a time, so only a window of titles is kept on memory.
+    Candidates without links to their Abstract are skipped, as on the aggregation.
+    """
+    rng = random.Random(seed)
+    titles = iter(candidate_titles)
+    n_candidates = 0
+    n_links = 0
+    window = list(dict.fromkeys(itertools.islice(titles, shuffle_size)))
+    while window:
+        rng.shuffle(window)
+        for candidate in window:
+            links = links_collection.find(
+                {"links_to": candidate, "links_to_section": "Abstract"},
+                LINK_PROJECTION,
+            ).batch_size(LINKS_BATCH_SIZE)
+            candidate_links = sample_candidate_links(
+                links, candidate_surface_appearance, candidate_text_surfaces
+            )
+            # The links not read are not fetched
+            links.close()
+            n_candidates += 1
+            if candidate_links:
+                n_links += sum(len(surface["link"]) for surface in candidate_links)
+                yield {"_id": candidate, "links": candidate_links}
+            if n_candidates % LOG_EVERY == 0:
+                logger.info(f"Sampled {n_candidates} candidates, {n_links} links")
+        window = list(dict.fromkeys(itertools.islice(titles, shuffle_size)))
+    logger.info(f"Sampled {n_candidates} candidates, {n_links} links")
@@ -0,0 +1,165 @@
+"""
+Fetch of the source docs sections of the links, for create_links_dataset_by_agg.
+
+Only the sections of the links are fetched (projection on sections.<name>) and the parsed sections are kept on a bounded
+LRU cache shared by all the batches, as popular source docs are linked by many candidates. A parsed section holds the
+whole text of the section and its links, so the cache is kept small.
+"""
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bson
+from pymongo.collection import Collection
+
+from wbdsm.documents import LazyPage, Section
+from wbdsm.preprocessing import clean_text
+
+logger = logging.getLogger(__name__)
+
+# (source_doc, source_doc_section) as in the links collection
+SectionKey = Tuple[str, str]
+# Parsed sections kept in cache
+SECTION_CACHE_SIZE = 10000
+
+
+def get_section_key_variants(section_name: str) -> List[str]:
+    """
+    Keys of the section on the pages collection. source_doc_section is encoded with encode_id, that also encodes & and "
+    (&amp;, &quot;), which may not be encoded on the pages sections keys.
+    """
+    variants = [section_name]
+    if "&" in section_name:
+        variants.append(section_name.replace("&quot;", '"').replace("&amp;", "&"))
+    return variants
+
+
+def get_sections_projection(section_names: Iterable[str]) -> dict:
+    projection = {"title": 1}
+    for section_name in section_names:
+        for variant in get_section_key_variants(section_name):
+            projection[f"sections.{variant}"] = 1
+    return projection
+
+
+class SectionCache:
+    """
+    Bounded LRU cache of parsed sections by (source_doc, source_doc_section).
+    With collect_bytes, the size of the docs fetched from mongo is added to the stats (it encodes each doc again, only
+    for debugging).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = SECTION_CACHE_SIZE,
+        project_sections: bool = True,
+        collect_bytes: bool = False,
+    ):
+        self.maxsize = maxsize
+        self.project_sections = project_sections
+        self.collect_bytes = collect_bytes
+        self.sections: "OrderedDict[SectionKey, Section]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.bytes_fetched = 0
+
+    def _get(self, key: SectionKey) -> Optional[Section]:
+        section = self.sections.get(key)
+        if section is not None:
+            self.sections.move_to_end(key)
+        return section
+
+    def _put(self, key: SectionKey, section: Section):
+        if self.maxsize <= 0:
+            return
+        self.sections[key] = section
+        self.sections.move_to_end(key)
+        if len(self.sections) > self.maxsize:
+            self.sections.popitem(last=False)
+
+    def _fetch_pages(
+        self,
+        pages_collection: Collection,
+        source_docs: List[str],
+        projection: Optional[dict],
+        language: str,
+    ) -> Dict[str, LazyPage]:
+        docs = list(pages_collection.find({"title": {"$in": source_docs}}, projection))
+        if self.collect_bytes:
+            self.bytes_fetched += sum(len(bson.encode(doc)) for doc in docs)
+        # Sections are only parsed when needed, and once per doc
+        return {doc["title"]: LazyPage.from_mongo(doc, language) for doc in docs}
+
+    def get_sections(
+        self, keys: List[SectionKey], pages_collection: Collection, language: str
+    ) -> Tuple[Dict[SectionKey, Optional[Section]], set]:
+        """
+        Sections of the keys (None if the section is not found) and the source docs found on the pages collection.
+        """
+        sections = {}
+        for key in dict.fromkeys(keys):
+            section = self._get(key)
+            if section is not None:
+                self.hits += 1
+                sections[key] = section
+        missing = [key for key in dict.fromkeys(keys) if key not in sections]
+        self.misses += len(missing)
+        if not missing:
+            return sections, {source_doc for source_doc, _ in sections}
+
+        source_docs = list(dict.fromkeys(source_doc for source_doc, _ in missing))
+        projection = None
+        if self.project_sections:
+            projection = get_sections_projection(
+                {section_name for _, section_name in missing}
+            )
+        pages = self._fetch_pages(pages_collection, source_docs, projection, language)
+        not_found = []
+        for key in missing:
+            source_doc, section_name = key
+            page = pages.get(source_doc)
+            section = page.get_section(clean_text(section_name)) if page else None
+            if page and section is None and self.project_sections:
+                # The key on mongo doesn't match the projection (i.g. not normalized), the full doc is needed
+                not_found.append(key)
+            sections[key] = section
+        if not_found:
+            self.fallbacks += len(not_found)
+            full_pages = self._fetch_pages(
+                pages_collection,
+                list(dict.fromkeys(source_doc for source_doc, _ in not_found)),
+                None,
+                language,
+            )
+            pages.update(full_pages)
+            for key in not_found:
+                source_doc, section_name = key
+                page = full_pages.get(source_doc)
+                sections[key] = (
+                    page.get_section(clean_text(section_name)) if page else None
+                )
+        for key in missing:
+            if sections[key] is not None:
+                self._put(key, sections[key])
+        found = set(pages) | {
+            source_doc
+            for (source_doc, _), section in sections.items()
+            if section is not None
+        }
+        return sections, found
+
+    def stats(self, n_examples: int) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+        if self.collect_bytes:
+            stats["bytes_fetched"] = self.bytes_fetched
+            stats["bytes_per_example"] = (
+                self.bytes_fetched / n_examples if n_examples else 0.0
+            )
+        return stats
@@ -0,0 +1,135 @@
+"""
+Sharded generation of the links of the entity linking dataset.
+
+The candidates of candidates.jsonl are split in n_shards shards (candidate i goes to shard i % n_shards), each one
+streamed from the file and processed by
+create_links_dataset_by_agg on its own process, with its own mongoDB client, and written to its own links file. The
+shards files are then merged on links.jsonl in shard order, renumbering the query_index, so the result only depends on
+the content of the shards. The candidate_index is global, it's taken from the candidates registry. The sections cache
+size is split among the processes, so the memory doesn't grow with the number of shards.
+Only the index sampling can be sharded: with the aggregation each shard would run its own $sample and $group over the
+whole links collection, n_shards times the work of a single process on the server.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from pymongo import MongoClient
+
+from wbdsm.links.entity_linking.candidate_registry import (
+    CandidateRegistry,
+    iter_candidates_titles,
+)
+from wbdsm.links.entity_linking.process_mongodb import (
+    LINKS_FILE,
+    create_links_dataset_by_agg,
+)
+from wbdsm.links.entity_linking.section_cache import SECTION_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard_file_name(shard: int) -> str:
+    return f"links-{shard:05d}.jsonl"
+
+
+def create_links_dataset_shard(
+    shard: int,
+    n_shards: int,
+    mongo_uri: str,
+    db_name: str,
+    registry_path: str,
+    output_path: str,
+    sampling_seed: Optional[int] = None,
+    **kwargs,
+) -> str:
+    """
+    Links of the candidates of a shard (streamed from candidates.jsonl on output_path), written to the shard file.
+    Returns the name of the file.
+    """
+    client = MongoClient(mongo_uri)
+    candidate_registry = CandidateRegistry(registry_path)
+    links_file_name = get_shard_file_name(shard)
+    logger.info(f"Shard {shard}/{n_shards}")
+    create_links_dataset_by_agg(
+        abstract_titles=iter_candidates_titles(
+            output_path, candidate_registry, shard, n_shards
+        ),
+        output_path=output_path,
+        links_collection=client[db_name]["links"],
+        pages_collection=client[db_name]["pages"],
+        candidate_registry=candidate_registry,
+        # Each shard with its own seed, the same on every run
+        sampling_seed=None if sampling_seed is None else sampling_seed + shard,
+        links_file_name=links_file_name,
+        **kwargs,
+    )
+    candidate_registry.close()
+    client.close()
+    return links_file_name
+
+
+def merge_links_shards(output_path: str, links_files_names: List[str]) -> int:
+    """
+    Merge the shards files on links.jsonl, in the given order, renumbering the query_index. The shards files are
+    removed. Returns the number of items.
+    """
+    n_items = 0
+    with open(os.path.join(output_path, LINKS_FILE), "w") as links_file:
+        for links_file_name in links_files_names:
+            shard_path = os.path.join(output_path, links_file_name)
+            with open(shard_path, "r") as f:
+                for line in f:
+                    candidate_links = json.loads(line)
+                    for items in candidate_links.values():
+                        for item in items:
+                            item["query_index"] = n_items
+                            n_items += 1
+                    links_file.write(json.dumps(candidate_links) + "\n")
+            os.remove(shard_path)
+    return n_items
+
+
+def create_links_dataset_sharded(
+    n_shards: int,
+    mongo_uri: str,
+    db_name: str,
+    registry_path: str,
+    output_path: str,
+    n_processes: Optional[int] = None,
+    section_cache_size: int = SECTION_CACHE_SIZE,
+    sampling: str = "index",
+    **kwargs,
+) -> int:
+    """
+    Sharded version of create_links_dataset_by_agg with the index sampling, for the candidates of candidates.jsonl on
+    output_path, with n_processes processes (n_shards by default). Each process keeps section_cache_size / n_processes sections in cache. Returns the number of items of
+    links.jsonl.
+    """
+    if sampling != "index":
+        raise ValueError(
+            f"Only the index sampling can be sharded, got {sampling} with {n_shards} shards"
+        )
+    n_processes = n_processes or n_shards
+    with ProcessPoolExecutor(n_processes) as executor:
+        futures = [
+            executor.submit(
+                create_links_dataset_shard,
+                shard,
+                n_shards,
+                mongo_uri,
+                db_name,
+                registry_path,
+                output_path,
+                section_cache_size=section_cache_size // n_processes,
+                sampling=sampling,
+                **kwargs,
+            )
+            for shard in range(n_shards)
+        ]
+        links_files_names = [future.result() for future in futures]
+    n_items = merge_links_shards(output_path, links_files_names)
+    logger.info(f"Merged {n_shards} shards, {n_items} items")
+    return n_items
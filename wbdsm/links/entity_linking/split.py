@@ -0,0 +1,140 @@
+"""
+Split of the links file (one line per candidate) on the train, validation and test files of the entity linking dataset.
+
+- split_links_file: the last candidates of the file go to validation and test (one-shot by candidate).
+- hash_split_links_file: each candidate (or candidate text surface) goes to the split given by a seeded hash of its
+  title (and surface), so the same entity always lands on the same split, whatever the order of the file, the shards or
+  the candidates added by a rebuild.
+"""
+import hashlib
+import json
+import os
+from collections import deque
+from typing import Dict, Optional, TextIO
+
+from wbdsm.links.entity_linking.process_mongodb import LINKS_FILE
+
+SPLITS = ("train", "validation", "test")
+SPLIT_BY = ("candidate", "surface")
+
+
+def write_candidate_items(line: str, f: TextIO) -> int:
+    """Write the items of a candidate line of links.jsonl, one per line. Returns the number of items."""
+    candidate_links = json.loads(line)
+    n_items = 0
+    for items in candidate_links.values():
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+            n_items += 1
+    return n_items
+
+
+def split_links_file(
+    output_path: str, validation_size: int, test_size: int
+) -> Dict[str, Dict[str, int]]:
+    """
+    One-shot split by candidate in a single pass: the last validation_size + test_size candidates of links.jsonl go to
+    validation and test, the others to train. Only the candidates of validation and test are kept on memory, the number
+    of candidates doesn't need to be known in advance.
+    Returns the number of candidates and items of each split.
+    """
+    counts = {split: {"candidates": 0, "items": 0} for split in SPLITS}
+    files = {
+        split: open(os.path.join(output_path, f"{split}.jsonl"), "w")
+        for split in SPLITS
+    }
+
+    def write(split: str, line: str):
+        counts[split]["candidates"] += 1
+        counts[split]["items"] += write_candidate_items(line, files[split])
+
+    held_out = deque(maxlen=validation_size + test_size)
+    with open(os.path.join(output_path, LINKS_FILE), "r") as f:
+        for line in f:
+            if held_out.maxlen and len(held_out) == held_out.maxlen:
+                write("train", held_out.popleft())
+            if held_out.maxlen:
+                held_out.append(line)
+            else:
+                write("train", line)
+    for position, line in enumerate(held_out):
+        write("validation" if position < validation_size else "test", line)
+    for split_file in files.values():
+        split_file.close()
+    return counts
+
+
+def get_split_key(candidate: str, surface: Optional[str] = None) -> str:
+    if surface is None:
+        return candidate
+    return candidate + "\x00" + surface
+
+
+def assign_split(
+    key: str, validation_ratio: float, test_ratio: float, seed: int = 0
+) -> str:
+    """
+    Split of the key: a seeded hash of the key mapped to [0, 1) and compared with the target proportions.
+    """
+    digest = hashlib.blake2b(f"{seed}\x00{key}".encode(), digest_size=8).digest()
+    position = int.from_bytes(digest, "big") / 2**64
+    if position < validation_ratio:
+        return "validation"
+    if position < validation_ratio + test_ratio:
+        return "test"
+    return "train"
+
+
+def hash_split_links_file(
+    output_path: str,
+    validation_ratio: float,
+    test_ratio: float,
+    seed: int = 0,
+    split_by: str = "candidate",
+    links_file_name: str = LINKS_FILE,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Split the items of links_file_name with assign_split, in a single pass.
+    split_by "candidate" keeps all the items of a candidate on the same split (one-shot by candidate), "surface" keeps
+    the items of each text surface (link) of a candidate on the same split (one-shot by surface).
+    Each line is assigned on its own, so shards files can be split in parallel (with different output paths) and give
+    the same assignment. Returns the number of candidates (with items on the split) and items of each split.
+    """
+    if split_by not in SPLIT_BY:
+        raise ValueError(f"split_by must be one of {SPLIT_BY}, got {split_by}")
+    if validation_ratio < 0 or test_ratio < 0 or validation_ratio + test_ratio > 1:
+        raise ValueError(
+            f"Invalid split ratios: validation {validation_ratio}, test {test_ratio}"
+        )
+    counts = {split: {"candidates": 0, "items": 0} for split in SPLITS}
+    files = {
+        split: open(os.path.join(output_path, f"{split}.jsonl"), "w")
+        for split in SPLITS
+    }
+    with open(os.path.join(output_path, links_file_name), "r") as f:
+        for line in f:
+            candidate_links = json.loads(line)
+            for candidate, items in candidate_links.items():
+                candidate_splits = set()
+                if split_by == "candidate":
+                    candidate_split = assign_split(
+                        candidate, validation_ratio, test_ratio, seed
+                    )
+                for item in items:
+                    if split_by == "candidate":
+                        split = candidate_split
+                    else:
+                        split = assign_split(
+                            get_split_key(candidate, item["link"]),
+                            validation_ratio,
+                            test_ratio,
+                            seed,
+                        )
+                    files[split].write(json.dumps(item) + "\n")
+                    counts[split]["items"] += 1
+                    candidate_splits.add(split)
+                for split in candidate_splits:
+                    counts[split]["candidates"] += 1
+    for split_file in files.values():
+        split_file.close()
+    return counts
@@ -1,10 +1,24 @@
 import logging
 import re
 from datetime import datetime
-from typing import List
+from typing import Dict, Iterator, List, Optional, Set
 
-from wbdsm.documents import Page, RedirectPage, Section, Link
-from wbdsm.preprocessing import encode_id
+from wbdsm.documents import Page, Section, Link
+from wbdsm.preprocessing import title_codec
+from wbdsm.links.redirects import (
+    MAX_REDIRECT_HOPS,
+    MISSING_PAGE,
+    REDIRECT_PROJECTION,
+    RedirectTarget,
+    Resolution,
+    follow_redirects,
+    get_redirect_target,
+)
+from wbdsm.links.title_resolver import (
+    MappingTitleResolver,
+    PagesTitleResolver,
+    TitleResolver,
+)
 from pymongo.collection import Collection
 
 logger = logging.getLogger(__name__)
@@ -15,7 +29,12 @@ legends = re.compile(r"\w+\|[\w']+ {0,1}\[\[[^\\]*\]\]")
 
 
 def extract_links(
-    pages_obj: List[Page], pages_collection: Collection, min_query_size: int = 50
+    pages_obj: List[Page],
+    pages_collection: Collection,
+    min_query_size: int = 50,
+    title_resolver: Optional[TitleResolver] = None,
+    batch_resolve: bool = False,
+    resolved_titles_collection: Optional[Collection] = None,
 ):
     """
     Retrieve links information from a wikipedia page parsed by wtf_wikipedia.
@@ -32,29 +51,148 @@ def extract_links(
         skip (str): Skip articles with id lower than this
         limit (int): Number of articles to parse
         min_query_size (int, optional): Min size of the query (in chars) to be considered. Defaults to 50. Values lower than this will be ignored.
+        title_resolver (TitleResolver, optional): Resolves the links targets without querying the pages collection.
+        batch_resolve (bool, optional): If no title_resolver is given, resolve all the links targets of the pages with a few queries before extracting them, instead of one query per link. Defaults to False.
+        resolved_titles_collection (Collection, optional): Collection written by wbdsm.links.redirects.write_resolved_titles, used by batch_resolve instead of following the redirects on the pages collection.
     """
     logger.info("Processing articles")
     time_now = datetime.now()
+    if title_resolver is None and batch_resolve:
+        title_resolver = resolve_links_targets(
+            pages_obj,
+            pages_collection,
+            min_query_size=min_query_size,
+            resolved_titles_collection=resolved_titles_collection,
+        )
     links = []
     for page_obj in pages_obj:
         for section in page_obj.sections:
             #  If it's not a legend (for images, tables....)
-            if (
-                not legends.match(section.content)
-                and len(section.content) > min_query_size
-            ):
+            if is_section_parsable(section, min_query_size):
                 extracted_links = extract_section_links(
-                    section, pages_collection=pages_collection, source_page=page_obj
+                    section,
+                    pages_collection=pages_collection,
+                    source_page=page_obj,
+                    title_resolver=title_resolver,
                 )
                 links.extend(extracted_links)
 
     logger.info(f"Finished in {datetime.now() - time_now}")
+    logger.info(f"Title codec cache: {title_codec.cache_info()}")
     logger.info("Done")
     return links
 
 
+def is_section_parsable(section: Section, min_query_size: int) -> bool:
+    return not legends.match(section.content) and len(section.content) > min_query_size
+
+
+def iter_links_targets(
+    pages_obj: List[Page], min_query_size: int = 50
+) -> Iterator[str]:
+    """
+    Iterate over the encoded titles that translate_link would query for the internal links of the pages.
+    """
+    for page_obj in pages_obj:
+        for section in page_obj.sections:
+            if is_section_parsable(section, min_query_size):
+                for link in section.links:
+                    if link.type == "internal" and link.page != "":
+                        links_to_encoded = title_codec.encode_id(
+                            link.page, encode_title=True
+                        )
+                        yield title_codec.encode_id(links_to_encoded, encode_title=True)
+
+
+def get_next_hop_titles(
+    redirects: Dict[str, Optional[RedirectTarget]], queried: Set[str]
+) -> List[str]:
+    """Redirects targets not queried yet."""
+    return list(
+        dict.fromkeys(
+            target[0]
+            for target in redirects.values()
+            if target and target[0] and target[0] not in queried
+        )
+    )
+
+
+def get_resolutions(
+    titles: List[str], redirects: Dict[str, Optional[RedirectTarget]]
+) -> Dict[str, Resolution]:
+    """Follow the redirects of the titles found on the fetched pages."""
+
+    def get_target(title):
+        return redirects.get(title, MISSING_PAGE)
+
+    resolutions = {}
+    for title in titles:
+        resolution = follow_redirects(title, get_target)
+        if resolution is not None:
+            resolutions[title] = resolution
+    return resolutions
+
+
+def resolve_links_targets(
+    pages_obj: List[Page],
+    pages_collection: Collection,
+    min_query_size: int = 50,
+    query_size: int = 1000,
+    resolved_titles_collection: Optional[Collection] = None,
+) -> MappingTitleResolver:
+    """
+    Resolve all the links targets of the pages at once, with one "$in" query per query_size distinct titles.
+
+    With resolved_titles_collection it's a single "$in" per query_size titles on it. Otherwise the pages are queried
+    and one more "$in" is done per redirect hop for the redirects targets not already fetched.
+    """
+    titles = list(dict.fromkeys(iter_links_targets(pages_obj, min_query_size)))
+    resolutions = {}
+    n_queries = 0
+    if resolved_titles_collection is not None:
+        for i in range(0, len(titles), query_size):
+            resolved_titles = resolved_titles_collection.find(
+                {"_id": {"$in": titles[i : i + query_size]}}
+            )
+            n_queries += 1
+            for resolved in resolved_titles:
+                resolutions[resolved["_id"]] = (
+                    resolved["links_to"],
+                    resolved["section"],
+                    resolved["hops"],
+                )
+    else:
+        redirects = {}
+        to_query = titles
+        queried = set()
+        for _ in range(MAX_REDIRECT_HOPS + 1):
+            if not to_query:
+                break
+            queried.update(to_query)
+            for i in range(0, len(to_query), query_size):
+                pages = pages_collection.find(
+                    {"title": {"$in": to_query[i : i + query_size]}},
+                    REDIRECT_PROJECTION,
+                )
+                n_queries += 1
+                for page in pages:
+                    # As find_one, keeps the first page found for the title
+                    if page["title"] not in redirects:
+                        redirects[page["title"]] = get_redirect_target(page)
+            to_query = get_next_hop_titles(redirects, queried)
+        resolutions = get_resolutions(titles, redirects)
+
+    logger.info(
+        f"Resolved {len(resolutions)}/{len(titles)} links targets with {n_queries} queries"
+    )
+    return MappingTitleResolver(resolutions)
+
+
 def extract_section_links(
-    section: Section, pages_collection: Collection, source_page: Page
+    section: Section,
+    pages_collection: Collection,
+    source_page: Page,
+    title_resolver: Optional[TitleResolver] = None,
 ):
     """
     For each link in the section, parse the link and retrieve the source page of the link.
@@ -69,7 +207,12 @@ def extract_section_links(
             # Normally this condition/error happens when the macro is generated "at the moment", i.g. {{LASTYEAR}} = ""
             if links_to != "":
                 link, last_link_position = parse_page_link(
-                    section, link, last_link_position, source_page, pages_collection
+                    section,
+                    link,
+                    last_link_position,
+                    source_page,
+                    pages_collection,
+                    title_resolver=title_resolver,
                 )
                 if link:
                     extracted_links.append(link)
@@ -83,9 +226,11 @@ def parse_page_link(
     last_link_position: int,
     source_page: Page,
     pages_collection: Collection,
+    title_resolver: Optional[TitleResolver] = None,
 ):
     """
     Parse a link to a wikipedia page. It do links scanning progressively, as we don't have the link position from dumpster-dive but we have an ordered list of links.
+    If title_resolver is given, the link's target is resolved with it instead of querying the pages collection.
     """
     section_text_to_scan = section.content[last_link_position:]
     link_text = link.text
@@ -103,10 +248,15 @@ def parse_page_link(
 
         # If page exists
         # Translate redirects to the source page
-        links_to_encoded = encode_id(link.page, encode_title=True)
-        links_to, redirect_section = translate_link(
-            links_to_encoded, pages_collection, links_to_section=links_to_section
-        )
+        links_to_encoded = title_codec.encode_id(link.page, encode_title=True)
+        if title_resolver is not None:
+            links_to, redirect_section = resolve_link(
+                links_to_encoded, title_resolver, links_to_section=links_to_section
+            )
+        else:
+            links_to, redirect_section = translate_link(
+                links_to_encoded, pages_collection, links_to_section=links_to_section
+            )
         if redirect_section:
             links_to_section = redirect_section
         # Sometimes redirectToPage is broken
@@ -117,14 +267,16 @@ def parse_page_link(
                 "end": end,
                 "text": link_text,
                 "links_to": links_to_encoded,  # To mach documents when searching
-                "source_doc": encode_id(source_page.title, encode_title=True),
-                "links_to_section": encode_id(
+                "source_doc": title_codec.encode_id(
+                    source_page.title, encode_title=True
+                ),
+                "links_to_section": title_codec.encode_id(
                     links_to_section,
                     upper_case_first_letter=False,
                 )
                 if links_to_section
                 else "Abstract",
-                "source_doc_section": encode_id(
+                "source_doc_section": title_codec.encode_id(
                     section.title,
                     upper_case_first_letter=False,
                 ),
@@ -147,48 +299,33 @@ def parse_page_link(
 def translate_link(links_to: str, pages_collection: Collection, links_to_section: str):
     """
     Translate the link's information to the source page of the link.
-    It handles the redirects and the links to sections.
+    It handles the redirects (following the redirect chain up to the final page) and the links to sections.
 
     If links_to_sections is None and links to a redirect, and the redirect has a redirectToSection it will use it.
             # ! TODO(GM): verify if this is correct:
         If it has redirectToSection and the links has a section, it will use the section of the link.
 
     """
-
-    projections = {"sections": 0}
-    links_to_encoded_title = encode_id(links_to, encode_title=True)
-    links_to_article_page = pages_collection.find_one(
-        {"title": links_to_encoded_title},
-        projections,
+    return resolve_link(
+        links_to, PagesTitleResolver(pages_collection), links_to_section
     )
-    if links_to_article_page:
-        # If it's a redirect, map to the source page
-        if links_to_article_page["isRedirect"]:
-            links_to_article_page_obj = RedirectPage.from_mongo(links_to_article_page)
-            links_to = links_to_article_page_obj.redirectToPage
-            # Check if redirect page exists - if redirect page has a redirect link (rarely it doesn't exist)
-            if links_to:
-                links_to_article_page = pages_collection.find_one(
-                    {"title": links_to_encoded_title},
-                    projections,
-                )
-                # Redirect to an invalid page (broken redirect)
-                if links_to_article_page is None:
-                    links_to = None
-
-                # If the correct is from the redirect page, we should enable it here without the "if"
-                elif links_to_section:
-                    links_to_section = links_to_article_page_obj.redirectToSection
-            else:
-                # Redirect to nothing (broken redirect)
-                links_to = None
 
-        else:
-            # Not a redirect, all good
-            links_to = links_to_encoded_title
 
-    else:
+def resolve_link(links_to: str, title_resolver: TitleResolver, links_to_section: str):
+    """
+    Same as translate_link, but using a title resolver - no queries to the pages collection.
+    """
+    resolution = title_resolver.lookup(
+        title_codec.encode_id(links_to, encode_title=True)
+    )
+    if resolution is None:
         # No reference
-        links_to = None
+        return None, links_to_section
+
+    links_to, redirect_section, hops = resolution
+    # Broken redirects are resolved to None
+    # If the correct is from the redirect page, we should enable it here without the "if"
+    if links_to and hops and links_to_section:
+        links_to_section = redirect_section
 
     return links_to, links_to_section
@@ -1,25 +1,229 @@
 import logging
+from collections import Counter
+from datetime import datetime
 
-from typing import List
+from typing import Dict, Iterator, List
 
+import pymongo
 from pymongo import UpdateOne
 from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
 
 
 logger = logging.getLogger(__name__)
 
+# Index modes: "upsert" can be re-run over already indexed links, "insert" is faster for first-time loads
+INDEX_MODES = ("upsert", "insert")
+DUPLICATE_KEY_ERROR = 11000
+# Links per insert_many, an unordered batch is sent to the server and its errors collected at once
+DEFAULT_BATCH_SIZE = 5000
+# Secondary indexes of the links collection, used to aggregate the links by page, source and text
+LINKS_INDEXES = [
+    [("links_to", pymongo.HASHED)],
+    [("source_doc", pymongo.HASHED)],
+    [("text", pymongo.HASHED)],
+]
+# Distinct (links_to, source_doc, text) of the indexed links, and its number per links_to (the count of rank_by_links)
+LINK_PAIRS_COLLECTION = "link_pairs"
+LINK_COUNTS_COLLECTION = "link_counts"
 
-def index_links(links: List[dict], links_collection: Collection) -> None:
+
+def create_links_indexes(links_collection: Collection) -> None:
     """
-    Indexes links in MongoDB. Uses _id as unique identifier to avoid duplicates.
+    Create the secondary indexes of the links collection, nothing is done for the existing ones.
+    On bulk loads it's called once all the links are indexed, building each index in a single pass instead of updating
+    it on every insert.
     """
-    operations = []
+    for index in LINKS_INDEXES:
+        time_now = datetime.now()
+        name = links_collection.create_index(index)
+        logger.info(f"Created index {name} in {datetime.now() - time_now}")
+
+
+def iter_batches(links: List[dict], batch_size: int) -> Iterator[List[dict]]:
+    for start in range(0, len(links), batch_size):
+        yield links[start : start + batch_size]
+
+
+def get_upsert_operations(links: List[dict]) -> List[UpdateOne]:
     # Bulk upsert
     # https://stackoverflow.com/questions/5292370/fast-or-bulk-upsert-in-pymongo
-    for link in links:
-        operations.append(UpdateOne({"_id": link["_id"]}, {"$set": link}, upsert=True))
+    return [
+        UpdateOne({"_id": link["_id"]}, {"$set": link}, upsert=True) for link in links
+    ]
+
+
+def upsert_links(links: List[dict], links_collection: Collection) -> Dict[str, int]:
+    """
+    Upsert links in MongoDB, using _id as unique identifier to avoid duplicates.
+    """
+    operations = get_upsert_operations(links)
     n_links = len(operations)
     logger.info(f"Inserting {n_links}")
-    if operations:
-        links_collection.bulk_write(operations)
-        logger.info(f"Inserted {n_links}")
+    if not operations:
+        return {"upserted": 0, "updated": 0}
+    result = links_collection.bulk_write(operations)
+    logger.info(f"Inserted {n_links}")
+    return {"upserted": result.upserted_count, "updated": result.matched_count}
+
+
+def count_duplicates(error: BulkWriteError) -> int:
+    """
+    Number of duplicate key errors of an unordered insert, the error is raised again if there are other errors.
+    """
+    write_errors = error.details["writeErrors"]
+    if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in write_errors):
+        raise error
+    return len(write_errors)
+
+
+def insert_links(
+    links: List[dict],
+    links_collection: Collection,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """
+    Append-only insert of links in MongoDB with unordered insert_many, for first-time loads into the links collection.
+
+    A link whose _id already exists (duplicate key error) is counted as already indexed and skipped, any other write error is raised.
+    The links already indexed are not updated, use upsert_links to re-index.
+    """
+    n_inserted = 0
+    n_duplicates = 0
+    for batch in iter_batches(links, batch_size):
+        try:
+            n_inserted += len(
+                links_collection.insert_many(batch, ordered=False).inserted_ids
+            )
+        except BulkWriteError as error:
+            n_inserted += error.details["nInserted"]
+            n_duplicates += count_duplicates(error)
+    logger.info(f"Inserted {n_inserted}, already indexed {n_duplicates}")
+    return {"inserted": n_inserted, "duplicates": n_duplicates}
+
+
+def get_link_pairs(links: List[dict]) -> List[tuple]:
+    """Distinct (links_to, source_doc, text) of the links."""
+    return list(
+        dict.fromkeys(
+            (link["links_to"], link["source_doc"], link["text"]) for link in links
+        )
+    )
+
+
+def get_link_pairs_documents(pairs: List[tuple]) -> List[dict]:
+    return [
+        {"_id": {"links_to": links_to, "source_doc": source_doc, "text": text}}
+        for links_to, source_doc, text in pairs
+    ]
+
+
+def get_duplicate_positions(error: BulkWriteError) -> set:
+    """Positions of the duplicate documents of an unordered insert, the error is raised again if there are others."""
+    count_duplicates(error)
+    return {write_error["index"] for write_error in error.details["writeErrors"]}
+
+
+def count_new_pairs(pairs: List[tuple], duplicates: set, new_counts: Counter):
+    for position, (links_to, _, _) in enumerate(pairs):
+        if position not in duplicates:
+            new_counts[links_to] += 1
+
+
+def get_link_counts_operations(new_counts: Counter) -> List[UpdateOne]:
+    return [
+        UpdateOne({"_id": links_to}, {"$inc": {"count": count}}, upsert=True)
+        for links_to, count in new_counts.items()
+    ]
+
+
+def update_link_counts(
+    links: List[dict],
+    link_pairs_collection: Collection,
+    link_counts_collection: Collection,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Add the (source_doc, text) pairs of the links not counted yet to the count of their links_to, with $inc upserts.
+
+    A pair is counted only by the insert of its _id on link_pairs that succeeds, so links indexed again (or by
+    concurrent workers) are not counted twice. Returns the number of new pairs.
+
+    The link_pairs insert and the link_counts $inc are separate writes: if a chunk fails between them, its pairs are
+    already on link_pairs when it is indexed again and their counts are lost. link_pairs stays complete, run
+    rebuild_link_counts after such failures.
+    """
+    new_counts = Counter()
+    for batch in iter_batches(get_link_pairs(links), batch_size):
+        duplicates = set()
+        try:
+            link_pairs_collection.insert_many(
+                get_link_pairs_documents(batch), ordered=False
+            )
+        except BulkWriteError as error:
+            duplicates = get_duplicate_positions(error)
+        count_new_pairs(batch, duplicates, new_counts)
+    if new_counts:
+        link_counts_collection.bulk_write(
+            get_link_counts_operations(new_counts), ordered=False
+        )
+    return sum(new_counts.values())
+
+
+def rebuild_link_counts(
+    link_pairs_collection: Collection, link_counts_collection: Collection
+) -> int:
+    """
+    Replace link_counts by the number of pairs per links_to of link_pairs, recovering the counts lost by chunks that
+    failed between the writes of update_link_counts. No links must be indexed meanwhile, their $inc would be
+    overwritten. Returns the number of counted titles.
+    """
+    time_now = datetime.now()
+    link_pairs_collection.aggregate(
+        [
+            {"$group": {"_id": "$_id.links_to", "count": {"$sum": 1}}},
+            {"$out": link_counts_collection.name},
+        ],
+        allowDiskUse=True,
+    )
+    n_titles = link_counts_collection.estimated_document_count()
+    logger.info(
+        f"Rebuilt the counts of {n_titles} titles in {datetime.now() - time_now}"
+    )
+    return n_titles
+
+
+def index_links(
+    links: List[dict],
+    links_collection: Collection,
+    mode: str = "upsert",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    count_links: bool = True,
+) -> Dict[str, int]:
+    """
+    Indexes links in MongoDB. Uses _id as unique identifier to avoid duplicates.
+
+    Args:
+        links (List[dict]): Links as returned by extract_links.
+        links_collection (Collection): Links collection.
+        mode (str, optional): "upsert" (default) to insert or update the links, "insert" for append-only unordered inserts.
+        batch_size (int, optional): Links per insert_many on "insert" mode.
+        count_links (bool, optional): Update the link_counts collection of the database (see update_link_counts).
+
+    Returns the counts of the written links.
+    """
+    if mode == "upsert":
+        counts = upsert_links(links, links_collection)
+    elif mode == "insert":
+        counts = insert_links(links, links_collection, batch_size)
+    else:
+        raise ValueError(f"Unknown index mode {mode}, expected one of {INDEX_MODES}")
+    if count_links:
+        database = links_collection.database
+        counts["new_pairs"] = update_link_counts(
+            links,
+            database[LINK_PAIRS_COLLECTION],
+            database[LINK_COUNTS_COLLECTION],
+            batch_size,
+        )
+    return counts
@@ -0,0 +1,146 @@
+"""
+Compact format for the links sent between the extract and the index celery tasks.
+
+Links are encoded by columns: integer columns as arrays and the other ones dictionary-encoded (unique values + codes),
+the result is packed with msgpack and compressed with zlib. The same keys and the same strings (source_doc, language,
+links_to...) repeated on every link are sent once per chunk.
+"""
+import zlib
+from array import array
+from typing import Iterator, List
+
+import msgpack
+from kombu.serialization import register
+
+SERIALIZER_NAME = "wbdsm_links"
+CONTENT_TYPE = "application/x-wbdsm-links"
+LINKS_EXT_TYPE = 1
+FORMAT_VERSION = 1
+
+
+def dictionary_encode(values: list):
+    dictionary = {}
+    codes = array(
+        "I", [dictionary.setdefault(value, len(dictionary)) for value in values]
+    )
+    return list(dictionary), codes.tobytes()
+
+
+def encode_links(links: List[dict], level: int = 6) -> bytes:
+    """
+    Encode the links (list of dicts as returned by extract_links) as a compressed columnar blob.
+    Links are expected to have the same keys, a missing key is decoded as None.
+    """
+    keys = list(dict.fromkeys(key for link in links for key in link))
+    columns = []
+    for key in keys:
+        values = [link.get(key) for link in links]
+        if key == "_id" and "start" in keys:
+            # _id is the start position + the source page id, only the page id is stored when possible
+            starts = [str(link.get("start")) for link in links]
+            if all(
+                isinstance(value, str) and value.startswith(start)
+                for value, start in zip(values, starts)
+            ):
+                suffixes = [value[len(start) :] for value, start in zip(values, starts)]
+                columns.append((key, "start_prefixed", dictionary_encode(suffixes)))
+                continue
+        if all(type(value) is int for value in values):
+            columns.append((key, "int", array("q", values).tobytes()))
+        else:
+            columns.append((key, "dictionary", dictionary_encode(values)))
+
+    packed = msgpack.packb(
+        {"version": FORMAT_VERSION, "size": len(links), "columns": columns},
+        use_bin_type=True,
+    )
+    return zlib.compress(packed, level)
+
+
+def iter_links(blob: bytes) -> Iterator[dict]:
+    """
+    Decode a blob created by encode_links, link by link.
+    """
+    data = msgpack.unpackb(zlib.decompress(blob), raw=False)
+    keys = []
+    columns = []
+    for key, kind, payload in data["columns"]:
+        if kind == "int":
+            column = array("q")
+            column.frombytes(payload)
+        else:
+            dictionary, codes_bytes = payload
+            codes = array("I")
+            codes.frombytes(codes_bytes)
+            column = [dictionary[code] for code in codes]
+        keys.append(key)
+        columns.append((kind, column))
+
+    start_column = None
+    if "start" in keys:
+        start_column = columns[keys.index("start")][1]
+    for row in range(data["size"]):
+        link = {}
+        for key, (kind, column) in zip(keys, columns):
+            if kind == "start_prefixed":
+                link[key] = str(start_column[row]) + column[row]
+            else:
+                link[key] = column[row]
+        yield link
+
+
+def decode_links(blob: bytes) -> List[dict]:
+    return list(iter_links(blob))
+
+
+def is_links(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and isinstance(value[0], dict)
+        and "links_to" in value[0]
+    )
+
+
+def pack_links(value):
+    if is_links(value):
+        return msgpack.ExtType(LINKS_EXT_TYPE, encode_links(value))
+    return value
+
+
+def ext_hook(code: int, data: bytes):
+    if code == LINKS_EXT_TYPE:
+        return decode_links(data)
+    return msgpack.ExtType(code, data)
+
+
+def dumps(body) -> bytes:
+    """
+    msgpack with the lists of links of the task arguments encoded by encode_links.
+    The body of the celery task messages (protocol 2) is (args, kwargs, embed).
+    """
+    if isinstance(body, (list, tuple)) and len(body) == 3:
+        args, kwargs, embed = body
+        body = (
+            [pack_links(arg) for arg in args],
+            {key: pack_links(value) for key, value in kwargs.items()},
+            embed,
+        )
+    return msgpack.packb(body, use_bin_type=True)
+
+
+def loads(data: bytes):
+    return msgpack.unpackb(data, raw=False, ext_hook=ext_hook)
+
+
+def register_links_serializer():
+    """
+    Register the wbdsm_links serializer on kombu. Must be called by the app and by the workers before using it.
+    """
+    register(
+        SERIALIZER_NAME,
+        dumps,
+        loads,
+        content_type=CONTENT_TYPE,
+        content_encoding="binary",
+    )
@@ -0,0 +1,123 @@
+"""
+Parquet sink and readers for the links, an alternative to the links collection.
+
+Each chunk of links is written to its own file (part) of a directory, with the repeated string columns (links_to,
+source_doc, text...) dictionary encoded. The readers load the whole directory as a dataset, reading only the requested
+columns, so the aggregations over the links (i.g. rank_by_links) are local scans instead of mongoDB $group stages.
+"""
+import hashlib
+import os
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+LINKS_SCHEMA = pa.schema(
+    [
+        ("_id", pa.string()),
+        ("start", pa.int64()),
+        ("end", pa.int64()),
+        ("text", DICTIONARY),
+        ("links_to", DICTIONARY),
+        ("source_doc", DICTIONARY),
+        ("links_to_section", DICTIONARY),
+        ("source_doc_section", DICTIONARY),
+        ("language", DICTIONARY),
+        ("type", DICTIONARY),
+    ]
+)
+
+
+def get_part_path(output_dir: str, part: Optional[str] = None) -> str:
+    """
+    Path of the part file. Parts are named by a hash of the chunk id, so a chunk processed again overwrites its file.
+    """
+    if part is None:
+        name = uuid.uuid4().hex
+    else:
+        name = hashlib.blake2b(str(part).encode(), digest_size=16).hexdigest()
+    return os.path.join(output_dir, f"part-{name}.parquet")
+
+
+def links_to_table(links: List[dict]) -> pa.Table:
+    columns = {
+        field.name: pa.array([link[field.name] for link in links]).cast(field.type)
+        if pa.types.is_dictionary(field.type)
+        else pa.array([link[field.name] for link in links], type=field.type)
+        for field in LINKS_SCHEMA
+    }
+    return pa.table(columns, schema=LINKS_SCHEMA)
+
+
+def write_links_parquet(
+    links: List[dict], output_dir: str, part: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Write the links (as returned by extract_links) to a part file of output_dir. Returns the counts as index_links.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = get_part_path(output_dir, part)
+    # Written to a temporary file and renamed, readers never see a partial part
+    tmp_path = path + ".tmp"
+    pq.write_table(links_to_table(links), tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    return {"written": len(links)}
+
+
+def get_links_dataset(path: str) -> ds.Dataset:
+    return ds.dataset(path, format="parquet", schema=LINKS_SCHEMA)
+
+
+def read_links(
+    path: str,
+    columns: Optional[List[str]] = None,
+    filter: Optional[pc.Expression] = None,
+) -> pa.Table:
+    """
+    Read the links of a parquet directory (or file). Only the columns given are read.
+
+    Example:
+        read_links("data/enwiki_links", columns=["links_to", "text"], filter=pc.field("links_to_section") == "Abstract")
+    """
+    return get_links_dataset(path).to_table(columns=columns, filter=filter)
+
+
+def iter_links_batches(
+    path: str,
+    columns: Optional[List[str]] = None,
+    filter: Optional[pc.Expression] = None,
+    batch_size: int = 2**17,
+) -> Iterator[pa.RecordBatch]:
+    """Streaming version of read_links."""
+    yield from get_links_dataset(path).to_batches(
+        columns=columns, filter=filter, batch_size=batch_size
+    )
+
+
+def count_text_surfaces(path: str) -> pa.Table:
+    """
+    Number of distinct (source_doc, text) per links_to, sorted by count (descending) and title. Same as the
+    aggregation of scripts/rank_by_links.py.
+    """
+    # Each part has its own dictionaries, the group by needs the same ones for all the rows
+    links = (
+        read_links(path, columns=["links_to", "source_doc", "text"])
+        .unify_dictionaries()
+        .combine_chunks()
+    )
+    distinct = links.group_by(["links_to", "source_doc", "text"]).aggregate([])
+    counts = distinct.group_by("links_to").aggregate([("source_doc", "count")])
+    counts = counts.rename_columns(
+        ["_id" if name == "links_to" else "count" for name in counts.column_names]
+    )
+    # Dictionary columns can't be sorted, ties are sorted by the title itself
+    counts = counts.set_column(
+        counts.column_names.index("_id"),
+        "_id",
+        counts.column("_id").cast(pa.string()),
+    )
+    return counts.sort_by([("count", "descending"), ("_id", "ascending")])
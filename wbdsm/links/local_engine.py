@@ -0,0 +1,333 @@
+"""
+Links extraction on a single machine without redis/celery.
+
+Same pipeline as the celery app (celery/links): the chunks of the plan are extracted by a pool of processes, each one with
+its own mongo client, and sent through a bounded queue to the index processes. The queue gives the backpressure: the
+extract processes block when the index ones are behind. If an index process dies, the run is aborted (the extract
+processes stop waiting on the full queue). The chunks are tracked on the chunk ledger as in the celery app, so an
+interrupted run can be restarted.
+
+Usage:
+    wbdsm-extract-links --mongo_uri mongodb://localhost:27017 --language en --n_extract_processes 16 --n_index_processes 4
+"""
+import logging
+import multiprocessing as mp
+import queue
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from pymongo import MongoClient
+
+from wbdsm.documents import Page
+from wbdsm.links.chunk_ledger import ChunkLedger, get_chunk_id
+from wbdsm.links.chunk_plan import PAGES_INDEX, get_chunk_pages, get_plan
+from wbdsm.links.extract_links import extract_links
+from wbdsm.links.index_links import (
+    DEFAULT_BATCH_SIZE,
+    INDEX_MODES,
+    create_links_indexes,
+    index_links,
+)
+from wbdsm.links.links_parquet import write_links_parquet
+from wbdsm.links.title_resolver import TitleResolver
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser, boolean_string
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+# Seconds between the checks of the index processes while waiting on the queue
+QUEUE_TIMEOUT = 10
+
+# State of each extract process, set by init_extract_process
+_extract_state = {}
+
+
+def init_extract_process(
+    mongo_uri: str,
+    db_name: str,
+    language: str,
+    title_resolver_path: Optional[str],
+    links_queue: mp.Queue,
+    abort_event,
+):
+    # Clients can't be shared between forked processes
+    client = MongoClient(mongo_uri)
+    _extract_state["pages_collection"] = client[db_name]["pages"]
+    _extract_state["ledger"] = ChunkLedger(client[db_name]["chunk_ledger"])
+    _extract_state["language"] = language
+    _extract_state["title_resolver"] = (
+        TitleResolver(title_resolver_path) if title_resolver_path else None
+    )
+    _extract_state["links_queue"] = links_queue
+    _extract_state["abort_event"] = abort_event
+
+
+def put_links(
+    links_queue: mp.Queue,
+    item,
+    is_aborted: Callable[[], bool],
+    timeout: float = QUEUE_TIMEOUT,
+):
+    """
+    Put the item on the queue, blocking while it's full. Raises a RuntimeError if is_aborted once the queue is full for
+    timeout seconds, i.g. the index processes died and nobody reads the queue.
+    """
+    while True:
+        try:
+            links_queue.put(item, timeout=timeout)
+            return
+        except queue.Full:
+            if is_aborted():
+                raise RuntimeError(
+                    "Index processes aborted, the links queue is not read"
+                )
+
+
+def abort_if_index_processes_died(
+    index_processes: List[mp.Process], abort_event, futures: Iterable[Future]
+):
+    """
+    Abort the run if an index process exited: the chunks not started are cancelled, the extract processes signaled with
+    abort_event and the remaining index processes terminated.
+    """
+    dead = [process for process in index_processes if not process.is_alive()]
+    if dead:
+        for future in futures:
+            future.cancel()
+        abort_event.set()
+        for process in index_processes:
+            if process.is_alive():
+                process.terminate()
+        raise RuntimeError(
+            f"{len(dead)} index processes exited with codes {[process.exitcode for process in dead]}, aborting"
+        )
+
+
+def extract_chunk(
+    chunk_id: str, skip, limit: int, min_query_size: int
+) -> Tuple[str, int]:
+    """
+    Extract the links of the chunk and send them to the index processes. Returns the chunk id and its number of pages.
+    """
+    pages_collection = _extract_state["pages_collection"]
+    pages = get_chunk_pages(pages_collection, skip, limit)
+    pages_obj = [Page.from_mongo(page, _extract_state["language"]) for page in pages]
+    links = extract_links(
+        pages_obj,
+        pages_collection=pages_collection,
+        min_query_size=min_query_size,
+        title_resolver=_extract_state["title_resolver"],
+        batch_resolve=True,
+    )
+    _extract_state["ledger"].mark_extracted(chunk_id, len(links))
+    # Blocks while the queue is full
+    put_links(
+        _extract_state["links_queue"],
+        (chunk_id, links),
+        _extract_state["abort_event"].is_set,
+    )
+    return chunk_id, len(pages)
+
+
+def index_process(
+    mongo_uri: str,
+    db_name: str,
+    links_queue: mp.Queue,
+    mode: str,
+    batch_size: int,
+    links_sink: str = "mongo",
+    links_parquet_dir: Optional[str] = None,
+    count_links: bool = True,
+):
+    """
+    Index the links of the queue until a None is received, on the links collection or on parquet files.
+    """
+    client = MongoClient(mongo_uri)
+    links_collection = client[db_name]["links"]
+    ledger = ChunkLedger(client[db_name]["chunk_ledger"])
+    item = links_queue.get()
+    while item is not None:
+        chunk_id, links = item
+        # A failed chunk must not stop the process, the extract processes would block on the full queue
+        try:
+            if links_sink == "parquet":
+                counts = write_links_parquet(links, links_parquet_dir, part=chunk_id)
+            else:
+                counts = index_links(
+                    links,
+                    links_collection,
+                    mode=mode,
+                    batch_size=batch_size,
+                    count_links=count_links,
+                )
+            ledger.mark_indexed(chunk_id, counts)
+        except Exception as error:
+            logger.exception(f"Chunk {chunk_id} failed")
+            ledger.mark_failed(chunk_id, repr(error))
+        item = links_queue.get()
+
+
+def run(args: dict):
+    mongo_uri = args["mongo_uri"]
+    db_name = args["language"] + "wiki"
+    client = MongoClient(mongo_uri)
+    pages = client[db_name]["pages"]
+    initial = datetime.now()
+
+    pages.create_index(PAGES_INDEX)
+    pages.create_index("title")
+    if args["title_resolver_path"]:
+        TitleResolver.from_collection(pages, args["title_resolver_path"]).close()
+    boundaries = get_plan(
+        pages,
+        args["chunk_size"],
+        plan_path=args["plan_path"],
+        last_page_id=args["last_pageID"],
+    )
+    ledger = ChunkLedger(client[db_name]["chunk_ledger"])
+    if args["reset_ledger"]:
+        ledger.reset()
+    boundaries = ledger.plan(boundaries, args["chunk_size"])
+    links_collection = client[db_name]["links"]
+    if not args["bulk_load"]:
+        create_links_indexes(links_collection)
+
+    links_queue = mp.Queue(maxsize=args["queue_size"])
+    # Set when an index process dies, to stop the extract processes blocked on the full queue
+    abort_event = mp.Event()
+    index_processes = [
+        mp.Process(
+            target=index_process,
+            args=(
+                mongo_uri,
+                db_name,
+                links_queue,
+                args["index_mode"],
+                args["index_batch_size"],
+                args["links_sink"],
+                args["links_parquet_dir"],
+                args["count_links"],
+            ),
+        )
+        for _ in range(args["n_index_processes"])
+    ]
+    for process in index_processes:
+        process.start()
+
+    n_pages = 0
+    n_failed = 0
+    # pages/s without the indexes, snapshot and plan
+    dispatch_start = datetime.now()
+    with ProcessPoolExecutor(
+        args["n_extract_processes"],
+        initializer=init_extract_process,
+        initargs=(
+            mongo_uri,
+            db_name,
+            args["language"],
+            args["title_resolver_path"],
+            links_queue,
+            abort_event,
+        ),
+    ) as executor:
+        in_flight = {}
+        boundaries = iter(boundaries)
+        boundary = next(boundaries, None)
+        while boundary is not None or in_flight:
+            # Keep max_in_flight chunks submitted, they are cheap (only the pageID boundary is sent)
+            while boundary is not None and len(in_flight) < args["max_in_flight"]:
+                chunk_id = get_chunk_id(boundary)
+                ledger.mark_dispatched(chunk_id)
+                future = executor.submit(
+                    extract_chunk,
+                    chunk_id,
+                    boundary,
+                    args["chunk_size"],
+                    args["min_query_size"],
+                )
+                in_flight[future] = chunk_id
+                boundary = next(boundaries, None)
+            done, _ = wait(
+                in_flight, timeout=QUEUE_TIMEOUT, return_when=FIRST_COMPLETED
+            )
+            abort_if_index_processes_died(index_processes, abort_event, in_flight)
+            for future in done:
+                chunk_id = in_flight.pop(future)
+                try:
+                    n_pages += future.result()[1]
+                except Exception as error:
+                    logger.exception(f"Chunk {chunk_id} failed")
+                    ledger.mark_failed(chunk_id, repr(error))
+                    n_failed += 1
+            if done:
+                elapsed = (datetime.now() - dispatch_start).total_seconds()
+                logger.info(
+                    f"Extracted {n_pages} pages, {n_pages / elapsed:.1f} pages/s, {len(in_flight)} chunks in flight"
+                )
+
+    for _ in index_processes:
+        put_links(
+            links_queue,
+            None,
+            lambda: not any(process.is_alive() for process in index_processes),
+        )
+    for process in index_processes:
+        process.join()
+    exit_codes = [process.exitcode for process in index_processes if process.exitcode]
+    if exit_codes:
+        raise RuntimeError(f"Index processes exited with codes {exit_codes}")
+    elapsed = datetime.now() - dispatch_start
+    logger.info(
+        f"Indexed {n_pages} pages in {elapsed}, {n_pages / elapsed.total_seconds():.1f} pages/s, {n_failed} chunks failed"
+    )
+
+    if args["bulk_load"]:
+        index_time = datetime.now()
+        create_links_indexes(links_collection)
+        logger.info(f"Links indexes built in {datetime.now() - index_time}")
+    logger.info(f"Chunks by state: {ledger.summary()}")
+    logger.info(f"Finished in {datetime.now() - initial}")
+
+
+def main():
+    parser = WBDSMArgParser()
+    parser.add_argument("--n_extract_processes", default=mp.cpu_count(), type=int)
+    parser.add_argument("--n_index_processes", default=4, type=int)
+    parser.add_argument("--chunk_size", default=CHUNK_SIZE, type=int)
+    parser.add_argument(
+        "--queue_size",
+        default=20,
+        type=int,
+        help="Max number of extracted chunks waiting to be indexed",
+    )
+    parser.add_argument("--min_query_size", default=50, type=int)
+    parser.add_argument("--index_mode", default="upsert", choices=INDEX_MODES)
+    parser.add_argument("--index_batch_size", default=DEFAULT_BATCH_SIZE, type=int)
+    parser.add_argument("--links_sink", default="mongo", choices=["mongo", "parquet"])
+    parser.add_argument(
+        "--links_parquet_dir",
+        default=None,
+        type=str,
+        help="Directory of the links parquet files, for --links_sink parquet",
+    )
+    parser.add_argument(
+        "--bulk_load",
+        default=False,
+        type=boolean_string,
+        help="Build the links indexes after the load",
+    )
+    parser.add_argument(
+        "--count_links",
+        default=True,
+        type=boolean_string,
+        help="Maintain the link_counts collection used by rank_by_links.py --rank_source link_counts",
+    )
+    args = parser.parse_known_args()[0].__dict__
+    if args["links_sink"] == "parquet" and not args["links_parquet_dir"]:
+        parser.error("--links_parquet_dir is required with --links_sink parquet")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
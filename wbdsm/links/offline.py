@@ -0,0 +1,293 @@
+"""
+Links extraction from a pages export (mongoexport JSONL or mongodump BSON of the pages collection) to links files,
+without mongoDB.
+
+The export is streamed (constant memory, besides the titles/redirects snapshot) and split in shards: whole compressed
+files and byte ranges of the uncompressed ones, so each file is read and decompressed once. Each process reads the
+ranges of its shard and writes the links to its own JSONL file. The links targets are
+resolved with a TitleResolver snapshot, built from the export if it doesn't exist.
+
+Usage:
+    wbdsm-extract-links-offline --language en --pages_path data/enwiki_pages.jsonl.gz --output_dir data/enwiki_links \
+        --title_resolver_path data/enwiki_titles.bin --n_shards 16
+"""
+import gzip
+import json
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import IO, Iterator, List, Optional, Tuple
+
+import bson
+from bson import json_util
+
+from wbdsm.documents import Page
+from wbdsm.links.extract_links import extract_links
+from wbdsm.links.redirects import iter_resolved_titles, load_redirects_from_pages
+from wbdsm.links.title_resolver import TitleResolver
+from wbdsm.wbdsm_arg_parser import WBDSMArgParser, boolean_string
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def open_file(path: str, mode: str = "rb") -> IO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def is_bson(path: str) -> bool:
+    return path.endswith(".bson") or path.endswith(".bson.gz")
+
+
+# A part of an export file read by a shard: (path, start, end), end None for the end of the file
+FileRange = Tuple[str, int, Optional[int]]
+
+
+def iter_raw_documents(
+    path: str, start: int = 0, end: Optional[int] = None
+) -> Iterator[bytes]:
+    """
+    Raw documents of the export: a line of a JSONL file or a document of a BSON file, not decoded.
+    Only the documents starting on [start, end) are read, start must be a document boundary on BSON files.
+    """
+    with open_file(path) as f:
+        if start:
+            f.seek(start)
+        position = start
+        if is_bson(path):
+            # Each BSON document starts with its size (int32, size included)
+            size_bytes = f.read(4)
+            while size_bytes and (end is None or position < end):
+                size = struct.unpack("<i", size_bytes)[0]
+                yield size_bytes + f.read(size - 4)
+                position += size
+                size_bytes = f.read(4)
+        else:
+            if start:
+                # The line in progress belongs to the previous range
+                f.seek(start - 1)
+                position = start - 1 + len(f.readline())
+            while end is None or position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                if line.strip():
+                    yield line
+
+
+def decode_document(raw: bytes, bson_format: bool) -> dict:
+    if bson_format:
+        return bson.decode(raw)
+    # mongoexport writes extended JSON
+    return json_util.loads(raw)
+
+
+def get_bson_boundaries(path: str, offsets: List[int]) -> List[int]:
+    """
+    First document boundary at or after each offset of an uncompressed BSON file. Only the documents sizes are read.
+    """
+    boundaries = []
+    with open(path, "rb") as f:
+        position = 0
+        for offset in offsets:
+            while position < offset:
+                f.seek(position)
+                size_bytes = f.read(4)
+                if len(size_bytes) < 4:
+                    break
+                position += struct.unpack("<i", size_bytes)[0]
+            boundaries.append(position)
+    return boundaries
+
+
+def split_file(path: str, n_parts: int) -> List[Tuple[FileRange, int]]:
+    """
+    Ranges of the file and their sizes: compressed files can't be split (they are read whole), uncompressed ones are
+    split in n_parts ranges of about the same size.
+    """
+    size = os.path.getsize(path)
+    if path.endswith(".gz") or n_parts <= 1:
+        return [((path, 0, None), size)]
+    offsets = [size * part // n_parts for part in range(1, n_parts)]
+    if is_bson(path):
+        offsets = get_bson_boundaries(path, offsets)
+    bounds = [0] + offsets + [size]
+    return [
+        ((path, start, end), end - start)
+        for start, end in zip(bounds, bounds[1:])
+        if end > start
+    ]
+
+
+def get_shards(paths: List[str], n_shards: int) -> List[List[FileRange]]:
+    """
+    Ranges of the export files read by each shard, so each file is read (and decompressed) only once overall. The
+    ranges are assigned from the largest one to the shard with less bytes.
+    """
+    ranges = [file_range for path in paths for file_range in split_file(path, n_shards)]
+    ranges.sort(key=lambda file_range: file_range[1], reverse=True)
+    shards = [[] for _ in range(n_shards)]
+    shards_sizes = [0] * n_shards
+    for file_range, size in ranges:
+        shard = shards_sizes.index(min(shards_sizes))
+        shards[shard].append(file_range)
+        shards_sizes[shard] += size
+    return shards
+
+
+def iter_pages(paths: List[str]) -> Iterator[dict]:
+    """Stream the pages of the export files."""
+    return iter_shard_pages([(path, 0, None) for path in paths])
+
+
+def iter_shard_pages(ranges: List[FileRange]) -> Iterator[dict]:
+    """Stream the pages of the ranges of the export files of a shard."""
+    for path, start, end in ranges:
+        bson_format = is_bson(path)
+        for raw in iter_raw_documents(path, start, end):
+            yield decode_document(raw, bson_format)
+
+
+def build_title_resolver(paths: List[str], title_resolver_path: str) -> int:
+    """
+    Write the TitleResolver snapshot of the pages of the export files, as TitleResolver.from_collection does.
+    """
+    logger.info(f"Building title resolver snapshot on {title_resolver_path}")
+    time_now = datetime.now()
+    redirects = load_redirects_from_pages(iter_pages(paths))
+    n_titles = TitleResolver.write(title_resolver_path, iter_resolved_titles(redirects))
+    logger.info(f"Wrote {n_titles} titles in {datetime.now() - time_now}")
+    return n_titles
+
+
+def get_shard_path(output_dir: str, shard: int) -> str:
+    return os.path.join(output_dir, f"links-{shard:05d}.jsonl")
+
+
+def extract_shard(
+    ranges: List[FileRange],
+    shard: int,
+    output_dir: str,
+    title_resolver_path: str,
+    language: str,
+    chunk_size: int = CHUNK_SIZE,
+    min_query_size: int = 50,
+) -> dict:
+    """
+    Extract the links of the articles of the shard to its links file, chunk_size articles at a time.
+    """
+    title_resolver = TitleResolver(title_resolver_path)
+    n_pages = 0
+    n_links = 0
+
+    def write_chunk(pages: List[dict], f):
+        links = extract_links(
+            [Page.from_mongo(page, language) for page in pages],
+            pages_collection=None,
+            min_query_size=min_query_size,
+            title_resolver=title_resolver,
+        )
+        for link in links:
+            f.write(json.dumps(link, ensure_ascii=False) + "\n")
+        return len(links)
+
+    with open(get_shard_path(output_dir, shard), "w") as f:
+        pages = []
+        for page in iter_shard_pages(ranges):
+            if page["isRedirect"]:
+                continue
+            pages.append(page)
+            if len(pages) == chunk_size:
+                n_links += write_chunk(pages, f)
+                n_pages += len(pages)
+                pages = []
+        if pages:
+            n_links += write_chunk(pages, f)
+            n_pages += len(pages)
+    title_resolver.close()
+    logger.info(f"Shard {shard}: {n_pages} pages, {n_links} links")
+    return {"shard": shard, "pages": n_pages, "links": n_links}
+
+
+def iter_links_files(output_dir: str) -> Iterator[dict]:
+    """Read back the links of all the shards."""
+    for file_name in sorted(os.listdir(output_dir)):
+        if file_name.startswith("links-") and file_name.endswith(".jsonl"):
+            with open(os.path.join(output_dir, file_name), "r") as f:
+                for line in f:
+                    yield json.loads(line)
+
+
+def run(args: dict):
+    initial = datetime.now()
+    paths = args["pages_path"]
+    if args["rebuild_title_resolver"] or not os.path.exists(
+        args["title_resolver_path"]
+    ):
+        build_title_resolver(paths, args["title_resolver_path"])
+    os.makedirs(args["output_dir"], exist_ok=True)
+    # Shards of a previous run, possibly with more shards
+    for file_name in os.listdir(args["output_dir"]):
+        if file_name.startswith("links-") and file_name.endswith(".jsonl"):
+            os.remove(os.path.join(args["output_dir"], file_name))
+
+    shards = get_shards(paths, args["n_shards"])
+    time_now = datetime.now()
+    with ProcessPoolExecutor(args["n_processes"] or len(shards)) as executor:
+        futures = [
+            executor.submit(
+                extract_shard,
+                ranges,
+                shard,
+                args["output_dir"],
+                args["title_resolver_path"],
+                args["language"],
+                args["chunk_size"],
+                args["min_query_size"],
+            )
+            for shard, ranges in enumerate(shards)
+            if ranges
+        ]
+        results = [future.result() for future in futures]
+    elapsed = datetime.now() - time_now
+    n_pages = sum(result["pages"] for result in results)
+    n_links = sum(result["links"] for result in results)
+    logger.info(
+        f"Extracted {n_links} links from {n_pages} pages in {elapsed}, {n_pages / elapsed.total_seconds():.1f} pages/s"
+    )
+    logger.info(f"Finished in {datetime.now() - initial}")
+
+
+def main():
+    parser = WBDSMArgParser()
+    parser.add_argument(
+        "--pages_path",
+        nargs="+",
+        required=True,
+        help="Pages export files: mongoexport JSONL (.jsonl/.json) or mongodump BSON (.bson), optionally gzipped",
+    )
+    parser.add_argument("--output_dir", required=True, type=str)
+    parser.add_argument("--n_shards", default=os.cpu_count(), type=int)
+    parser.add_argument(
+        "--n_processes",
+        default=None,
+        type=int,
+        help="Defaults to the number of shards",
+    )
+    parser.add_argument("--rebuild_title_resolver", default=False, type=boolean_string)
+    parser.add_argument("--chunk_size", default=CHUNK_SIZE, type=int)
+    parser.add_argument("--min_query_size", default=50, type=int)
+    args = parser.parse_known_args()[0].__dict__
+    if not args["title_resolver_path"]:
+        parser.error("--title_resolver_path is required")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
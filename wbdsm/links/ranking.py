@@ -0,0 +1,92 @@
+"""
+reference_rank of the pages: pages sorted by the number of distinct (source_doc, text) of their links.
+
+The counts are maintained by index_links on the link_counts collection, so ranking is a sort over it instead of a
+$group over the whole links collection. count_links_by_aggregation counts them from the links collection, for the links
+indexed without counting. Ties are sorted by title, so the ranks are the same on every run.
+"""
+import logging
+from typing import Iterable, Iterator, List, Tuple
+
+import pymongo
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+# Ranked titles per (unordered) bulk_write on the pages collection
+RANK_BATCH_SIZE = 10000
+# Count (descending), ties by title
+RANK_SORT = [("count", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)]
+
+
+def create_link_counts_index(link_counts_collection: Collection) -> None:
+    link_counts_collection.create_index(RANK_SORT)
+
+
+def iter_link_counts(link_counts_collection: Collection) -> Iterator[dict]:
+    """{"_id": links_to, "count": count} of the link_counts collection, in rank order."""
+    create_link_counts_index(link_counts_collection)
+    yield from link_counts_collection.find().sort(RANK_SORT).batch_size(RANK_BATCH_SIZE)
+
+
+def count_links_by_aggregation(links_collection: Collection) -> Iterator[dict]:
+    """
+    {"_id": links_to, "count": count} from the links collection, in rank order.
+    """
+    rank = [
+        # Group by links_to, source doc and text to recover 1 mention per doc per text
+        {
+            "$group": {
+                "_id": {
+                    "links_to": "$links_to",
+                    "source_doc": "$source_doc",
+                    "text": "$text",
+                }
+            }
+        },
+        # Group by links_to and sums the count
+        {
+            "$group": {
+                "_id": "$_id.links_to",
+                "count": {"$sum": 1},
+            },
+        },
+        {"$sort": dict(RANK_SORT)},
+    ]
+    yield from links_collection.aggregate(rank, allowDiskUse=True).batch_size(
+        RANK_BATCH_SIZE
+    )
+
+
+def get_rank_operations(ranked_titles: List[Tuple[int, str]]) -> List[UpdateOne]:
+    return [
+        UpdateOne({"title": title}, {"$set": {"reference_rank": rank}}, upsert=True)
+        for rank, title in ranked_titles
+    ]
+
+
+def write_reference_ranks(
+    pages_collection: Collection,
+    ranked_titles: Iterable[str],
+    batch_size: int = RANK_BATCH_SIZE,
+) -> int:
+    """
+    Set the reference_rank of the pages (the position of its title on ranked_titles) with unordered bulk writes of
+    batch_size titles, so only a batch of operations is kept on memory. Returns the number of ranked titles.
+    """
+    n_ranked = 0
+    batch = []
+    for rank, title in enumerate(ranked_titles):
+        batch.append((rank, title))
+        if len(batch) == batch_size:
+            pages_collection.bulk_write(get_rank_operations(batch), ordered=False)
+            n_ranked += len(batch)
+            batch = []
+            logger.info(f"Ranked {n_ranked} pages")
+    if batch:
+        pages_collection.bulk_write(get_rank_operations(batch), ordered=False)
+        n_ranked += len(batch)
+    logger.info(f"Ranked {n_ranked} pages, indexing the page collection ranking")
+    pages_collection.create_index([("reference_rank", pymongo.ASCENDING)])
+    return n_ranked
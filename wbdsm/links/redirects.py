@@ -0,0 +1,151 @@
+"""
+Redirects resolution: follow the redirect chains of the pages collection up to the final (non redirect) page.
+
+The offline pass (scripts/resolve_redirects.py) materializes the resolution of every title on the resolved_titles collection
+and/or on a TitleResolver snapshot, so extract_links resolves any link with a single lookup.
+"""
+import logging
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from pymongo.collection import Collection
+
+from wbdsm.documents import RedirectPage
+from wbdsm.preprocessing import title_codec
+
+logger = logging.getLogger(__name__)
+
+# Wikipedia bots fix double redirects, longer chains are considered broken
+MAX_REDIRECT_HOPS = 10
+# Returned by the redirect getters when there is no page with the title
+MISSING_PAGE = object()
+REDIRECT_PROJECTION = {"title": 1, "isRedirect": 1, "redirectTo": 1}
+
+# (encoded title, section) the redirect points to, title is None for broken redirects
+RedirectTarget = Tuple[Optional[str], Optional[str]]
+# (links_to, redirect_section, hops). links_to is None for broken redirects.
+Resolution = Tuple[Optional[str], Optional[str], int]
+
+
+def get_redirect_target(page: dict) -> Optional[RedirectTarget]:
+    """
+    None if the page is not a redirect, the encoded title and section it redirects to otherwise.
+    """
+    if not page["isRedirect"]:
+        return None
+    redirect_page = RedirectPage.from_mongo(page)
+    if not redirect_page.redirectToPage:
+        # Redirect to nothing (broken redirect)
+        return None, None
+    return (
+        title_codec.encode_id(redirect_page.redirectToPage, encode_title=True),
+        redirect_page.redirectToSection,
+    )
+
+
+def follow_redirects(
+    title: str, get_target: Callable[[str], Optional[RedirectTarget]]
+) -> Optional[Resolution]:
+    """
+    Follow the redirects chain from title.
+
+    Args:
+        title (str): Encoded title of the page.
+        get_target (Callable): Returns MISSING_PAGE if there is no page with the title, else get_redirect_target of the page.
+
+    Returns None if there is no page with the title, else (links_to, redirect_section, hops).
+    links_to is the title of the final page or None if the chain is broken (redirect to nothing/to a missing page, cycle or too many hops).
+    redirect_section is the first section found on the chain.
+    """
+    target = get_target(title)
+    if target is MISSING_PAGE:
+        return None
+    hops = 0
+    section = None
+    visited = {title}
+    while target is not None:
+        target_title, target_section = target
+        hops += 1
+        if section is None:
+            section = target_section
+        if target_title is None or target_title in visited or hops > MAX_REDIRECT_HOPS:
+            return None, section, hops
+        target = get_target(target_title)
+        if target is MISSING_PAGE:
+            return None, section, hops
+        visited.add(target_title)
+        title = target_title
+
+    return title, section, hops
+
+
+def load_redirects(
+    pages_collection: Collection, batch_size: int = 10000
+) -> Dict[str, Optional[RedirectTarget]]:
+    """
+    Stream all the pages (without sections) and map each title to its redirect target (None if it's not a redirect).
+    As find_one, the first page of a repeated title is kept.
+    """
+    pages = pages_collection.find({}, REDIRECT_PROJECTION).batch_size(batch_size)
+    return load_redirects_from_pages(pages)
+
+
+def load_redirects_from_pages(
+    pages: Iterable[dict],
+) -> Dict[str, Optional[RedirectTarget]]:
+    """
+    load_redirects from any iterable of pages, i.g. a pages export file.
+    """
+    redirects = {}
+    for page in pages:
+        title = page.get("title")
+        if title is not None and title not in redirects:
+            redirects[title] = get_redirect_target(page)
+    return redirects
+
+
+def iter_resolved_titles(
+    redirects: Dict[str, Optional[RedirectTarget]]
+) -> Iterator[Tuple[str, Resolution]]:
+    def get_target(title):
+        return redirects.get(title, MISSING_PAGE)
+
+    for title in redirects:
+        yield title, follow_redirects(title, get_target)
+
+
+def write_resolved_titles(
+    redirects: Dict[str, Optional[RedirectTarget]],
+    resolved_titles_collection: Collection,
+    batch_size: int = 10000,
+) -> int:
+    """
+    Write the resolution of all the titles to resolved_titles_collection as
+    {_id: title, links_to: final title, section: redirect section, hops: number of redirects, broken: bool}
+
+    Returns the number of broken titles.
+    """
+    resolved_titles_collection.drop()
+    n_broken = 0
+    n_multi_hop = 0
+    batch = []
+    for title, (links_to, section, hops) in iter_resolved_titles(redirects):
+        n_broken += links_to is None
+        n_multi_hop += hops > 1
+        batch.append(
+            {
+                "_id": title,
+                "links_to": links_to,
+                "section": section,
+                "hops": hops,
+                "broken": links_to is None,
+            }
+        )
+        if len(batch) == batch_size:
+            resolved_titles_collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        resolved_titles_collection.insert_many(batch, ordered=False)
+    logger.info(
+        f"Resolved titles: {len(redirects)}, broken: {n_broken}, multi-hop redirects: {n_multi_hop}"
+    )
+    return n_broken
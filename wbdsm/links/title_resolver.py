@@ -0,0 +1,118 @@
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo.collection import Collection
+
+from wbdsm.links.redirects import (
+    MISSING_PAGE,
+    REDIRECT_PROJECTION,
+    Resolution,
+    follow_redirects,
+    get_redirect_target,
+    iter_resolved_titles,
+    load_redirects,
+)
+from wbdsm.string_table import StringTable, write_string_table
+
+logger = logging.getLogger(__name__)
+
+
+class PagesTitleResolver:
+    """
+    Title resolver querying the pages collection, one find_one per redirect hop.
+    """
+
+    def __init__(self, pages_collection: Collection):
+        self.pages_collection = pages_collection
+
+    def _get_target(self, title: str):
+        page = self.pages_collection.find_one({"title": title}, REDIRECT_PROJECTION)
+        if page is None:
+            return MISSING_PAGE
+        return get_redirect_target(page)
+
+    def lookup(self, title: str) -> Optional[Resolution]:
+        return follow_redirects(title, self._get_target)
+
+
+class MappingTitleResolver:
+    """
+    Title resolver backed by a dict of already resolved titles, i.e. the ones of a chunk of pages.
+    """
+
+    def __init__(self, resolutions: Dict[str, Resolution] = None):
+        self.resolutions = resolutions or {}
+
+    def __len__(self) -> int:
+        return len(self.resolutions)
+
+    def lookup(self, title: str) -> Optional[Resolution]:
+        return self.resolutions.get(title)
+
+
+class CollectionTitleResolver:
+    """
+    Title resolver backed by the resolved_titles collection (see wbdsm.links.redirects), one indexed lookup per title.
+    """
+
+    def __init__(self, resolved_titles_collection: Collection):
+        self.resolved_titles_collection = resolved_titles_collection
+
+    def lookup(self, title: str) -> Optional[Resolution]:
+        resolved = self.resolved_titles_collection.find_one({"_id": title})
+        if resolved is None:
+            return None
+        return resolved["links_to"], resolved["section"], resolved["hops"]
+
+
+class TitleResolver:
+    """
+    In memory (mmap'd) map from encoded title to its resolution (links_to, redirect_section, hops).
+
+    It replaces the find_one queries of translate_link. Built once from the pages collection (or loaded from a snapshot
+    file) and shared by all the forked worker processes, as the table lives on the page cache and not on each process heap.
+    """
+
+    def __init__(self, path: str):
+        self.table = StringTable(path)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    @staticmethod
+    def write(path: str, resolutions: Iterable[Tuple[str, Resolution]]) -> int:
+        return write_string_table(
+            path,
+            (
+                (title, (links_to or "", section or "", str(hops)))
+                for title, (links_to, section, hops) in resolutions
+            ),
+        )
+
+    @classmethod
+    def from_collection(
+        cls, pages_collection: Collection, path: str, rebuild: bool = False
+    ):
+        """
+        Load the resolver snapshot from path, building it from the pages collection if it doesn't exist.
+        """
+        if rebuild or not os.path.exists(path):
+            logger.info(f"Building title resolver snapshot on {path}")
+            time_now = datetime.now()
+            redirects = load_redirects(pages_collection)
+            n_titles = cls.write(path, iter_resolved_titles(redirects))
+            logger.info(f"Wrote {n_titles} titles in {datetime.now() - time_now}")
+        return cls(path)
+
+    def lookup(self, title: str) -> Optional[Resolution]:
+        """Resolution of the encoded title, None if there is no page with this title."""
+        values = self.table.get(title)
+        if values is None:
+            return None
+        links_to, section, hops = values
+        return links_to or None, section or None, int(hops)
+
+    def close(self):
+        self.table.close()
@@ -0,0 +1,156 @@
+"""
+Offline version of the ranking of wbdsm.links.ranking, without the mongoDB aggregation engine.
+
+The links_to, source_doc and text of the links are streamed in chunks (from the links collection, the JSONL files of
+wbdsm-extract-links-offline or a links parquet directory) and factorized to integer codes with arrow's dictionary
+encoding. Each (links_to, source_doc, text) is packed in 16 bytes, so the distinct links are a np.unique and the counts
+per links_to a np.bincount. The memory is the distinct links (16 bytes each) and the factorization tables, the links
+are never loaded at once.
+
+The result is the same as count_links_by_aggregation: count descending, ties by title.
+"""
+import logging
+import os
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+from pymongo.collection import Collection
+
+from wbdsm.links.links_parquet import iter_links_batches
+from wbdsm.links.offline import iter_links_files
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("links_to", "source_doc", "text")
+# Links per chunk
+CHUNK_SIZE = 10**6
+# Distinct links of the chunks merged with the ones already found when they reach this size
+MERGE_SIZE = 10**7
+# (links_to << 32 | source_doc, text)
+KEY_DTYPE = np.dtype("V16")
+
+# A chunk of links: the values of each of COLUMNS
+LinksChunk = Tuple[Sequence, Sequence, Sequence]
+
+
+def iter_collection_chunks(
+    links_collection: Collection, chunk_size: int = CHUNK_SIZE
+) -> Iterator[LinksChunk]:
+    projection = {"_id": 0, "links_to": 1, "source_doc": 1, "text": 1}
+    chunk = ([], [], [])
+    for link in links_collection.find({}, projection).batch_size(10000):
+        for values, column in zip(chunk, COLUMNS):
+            values.append(link[column])
+        if len(chunk[0]) == chunk_size:
+            yield chunk
+            chunk = ([], [], [])
+    if chunk[0]:
+        yield chunk
+
+
+def iter_jsonl_chunks(
+    output_dir: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[LinksChunk]:
+    """Chunks of the links files of wbdsm-extract-links-offline."""
+    chunk = ([], [], [])
+    for link in iter_links_files(output_dir):
+        for values, column in zip(chunk, COLUMNS):
+            values.append(link[column])
+        if len(chunk[0]) == chunk_size:
+            yield chunk
+            chunk = ([], [], [])
+    if chunk[0]:
+        yield chunk
+
+
+def iter_parquet_chunks(
+    path: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[LinksChunk]:
+    """Chunks of a links parquet directory, as dictionary arrays (already factorized by batch)."""
+    for batch in iter_links_batches(path, columns=list(COLUMNS), batch_size=chunk_size):
+        yield tuple(batch.column(column) for column in COLUMNS)
+
+
+def iter_links_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[LinksChunk]:
+    """Chunks of an export: a links parquet directory (or file) or a directory of JSONL links files."""
+    if os.path.isdir(path):
+        if any(file_name.endswith(".parquet") for file_name in os.listdir(path)):
+            return iter_parquet_chunks(path, chunk_size)
+        return iter_jsonl_chunks(path, chunk_size)
+    if os.path.isfile(path) and path.endswith(".parquet"):
+        return iter_parquet_chunks(path, chunk_size)
+    raise ValueError(
+        f"{path} is not a links parquet file or a directory of links parquet or JSONL files"
+    )
+
+
+def encode(values: Sequence, table: Dict[str, int]) -> np.ndarray:
+    """
+    Codes of the values on table, the new values are added to it. Only the distinct values of the chunk go through
+    python.
+    """
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if not isinstance(values, pa.DictionaryArray):
+        # Factorized by arrow's hash table
+        values = pa.array(values, type=pa.string()).dictionary_encode()
+    codes = values.indices.to_numpy(zero_copy_only=False)
+    uniques = values.dictionary.to_pylist()
+    table_codes = np.fromiter(
+        (table.setdefault(value, len(table)) for value in uniques),
+        dtype=np.uint64,
+        count=len(uniques),
+    )
+    return table_codes[codes]
+
+
+def pack_links(links_to: np.ndarray, source_doc: np.ndarray, text: np.ndarray):
+    keys = np.empty((len(links_to), 2), dtype=np.uint64)
+    keys[:, 0] = (links_to << np.uint64(32)) | source_doc
+    keys[:, 1] = text
+    return keys.view(KEY_DTYPE).ravel()
+
+
+def count_links_vectorized(
+    chunks: Iterator[LinksChunk], merge_size: int = MERGE_SIZE
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Titles (links_to) and the number of distinct (source_doc, text) of each one, in the order of the titles.
+    """
+    tables = [{}, {}, {}]
+    distinct = np.empty(0, dtype=KEY_DTYPE)
+    pending = []
+    n_pending = 0
+    n_links = 0
+    for chunk in chunks:
+        codes = [encode(values, table) for values, table in zip(chunk, tables)]
+        if len(tables[0]) > 2**32 or len(tables[1]) > 2**32:
+            raise ValueError("Too many titles or source docs to pack the links")
+        keys = np.unique(pack_links(*codes))
+        n_links += len(codes[0])
+        pending.append(keys)
+        n_pending += len(keys)
+        if n_pending >= merge_size:
+            distinct = np.unique(np.concatenate([distinct] + pending))
+            pending = []
+            n_pending = 0
+            logger.info(f"{n_links} links, {len(distinct)} distinct")
+    distinct = np.unique(np.concatenate([distinct] + pending))
+    logger.info(f"{n_links} links, {len(distinct)} distinct")
+    links_to = distinct.view(np.uint64).reshape(-1, 2)[:, 0] >> np.uint64(32)
+    titles = list(tables[0])
+    counts = np.bincount(links_to.astype(np.int64), minlength=len(titles))
+    return titles, counts
+
+
+def rank_links_vectorized(titles: List[str], counts: np.ndarray) -> Iterator[dict]:
+    """
+    {"_id": links_to, "count": count} in rank order: count descending, ties by title as the aggregation sort.
+    """
+    title_order = np.empty(len(titles), dtype=np.int64)
+    title_order[np.array(titles, dtype=object).argsort(kind="stable")] = np.arange(
+        len(titles)
+    )
+    for code in np.lexsort((title_order, -counts)):
+        yield {"_id": titles[code], "count": int(counts[code])}
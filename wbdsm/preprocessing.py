@@ -1,8 +1,11 @@
-import unicodedata
+import os
 import re
-import unidecode
+import unicodedata
+from functools import lru_cache
 from urllib.parse import quote
 
+import unidecode
+
 
 def decode_id(text: str) -> str:
     """
@@ -10,18 +13,19 @@ def decode_id(text: str) -> str:
     - normalize data to have unique types of characters for each language
     """
     # Normalize data (doing it before indexing with wtf_wikipedia)
-
-    text = unicodedata.normalize("NFKD", text)
+    # ASCII text is already normalized
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
 
     # Threat mongodb conversions
     # https://stackoverflow.com/questions/12397118/mongodb-dot-in-key-name/30254815#30254815
-    text = (
-        text.replace("\\\\", "\\")
-        .replace("\\u0024", "$")
-        .replace("\\u002e", ".")
-        .replace("&quot;", '"')
-        .replace("&amp;", "&")
-    )
+    # Replaces are kept in order, one replacement can create the next pattern (i.g. "\\\\u0024" -> "\\u0024" -> "$")
+    if "\\" in text:
+        text = (
+            text.replace("\\\\", "\\").replace("\\u0024", "$").replace("\\u002e", ".")
+        )
+    if "&" in text:
+        text = text.replace("&quot;", '"').replace("&amp;", "&")
 
     return text
 
@@ -54,6 +58,16 @@ def encode_id(text: str, upper_case_first_letter: bool = True, encode_title=Fals
     return text
 
 
+# clean_text patterns, precompiled once
+# Runs of 2+ spaces, single spaces are left as they are
+SPACES = re.compile(r"  +")
+EMPTY_PARENTHESIS = re.compile(r"\(\s*\)")
+EMPTY_BRACKETS = re.compile(r"\[\s*\]")
+EMPTY_BRACES = re.compile(r"\{\s*\}")
+DOUBLE_COMMA = re.compile(r",\s*,")
+DOUBLE_DOT = re.compile(r"\.\s*\.")
+
+
 def clean_text(text: str) -> str:
     """
     Clean text output from wtf_wikipedia.
@@ -65,51 +79,87 @@ def clean_text(text: str) -> str:
     - fix \` and \' (mongo db or wikipedia?)
     - Fix bad parsing resulting in empty parenthesis, brackets, etc.
     - Fix bad parsings resulting in double , and . with spaces in between.
+
+    Steps that can't match the text are skipped. They are not merged in a single pattern as one step
+    can create a match for the next one (i.g. "[()]" -> "[]" -> "").
     """
     # Decode text # ?
     text = decode_id(text)
     # Replace new lines with spaces
-    text = re.sub(r"\n", " ", text)
+    text = text.replace("\n", " ")
     # wtf_wikipedia generates extra spaces when a link is in a new line and when fails to parse a link
-    text = re.sub(r" +", " ", text).strip()
+    if "  " in text:
+        text = SPACES.sub(" ", text)
+    text = text.strip()
     # Remove bold and italics
     # text = re.sub(r"'''|''", "", text)
     # Fix \` and \'
-    text = re.sub(r"\\`", "`", text)
-    text = re.sub(r"\\'", "'", text)
+    if "\\" in text:
+        text = text.replace("\\`", "`").replace("\\'", "'")
     # From bad parsing
     # Remove empty parenthesis
-    text = re.sub(r"\(\s*\)", "", text)
+    if "(" in text:
+        text = EMPTY_PARENTHESIS.sub("", text)
     # Remove empty brackets
-    text = re.sub(r"\[\s*\]", "", text)
+    if "[" in text:
+        text = EMPTY_BRACKETS.sub("", text)
     # Remove empty braces
-    text = re.sub(r"\{\s*\}", "", text)
+    if "{" in text:
+        text = EMPTY_BRACES.sub("", text)
     # Remove double , and .
-    text = re.sub(r",\s*,", ",", text)
-    text = re.sub(r"\.\s*\.", ".", text)
+    if "," in text:
+        text = DOUBLE_COMMA.sub(",", text)
+    if "." in text:
+        text = DOUBLE_DOT.sub(".", text)
     return text
 
 
-def normalize_punctuation(text: str):
-    # Decode only punctuation and quotes. https://www.compart.com/en/unicode/category
-    text = "".join(
-        [
-            unidecode.unidecode(char)
-            if unicodedata.category(char)[0]
-            in [
-                "Po",
-                "Cc",
-                "Pi",
-                "Pf",
-                "Ps",
-            ]
-            else char
-            for char in text
-        ]
-    )
+# Decode only punctuation and quotes. https://www.compart.com/en/unicode/category
+PUNCTUATION_CATEGORIES = ["Po", "Cc", "Pi", "Pf", "Ps"]
+# Distinct characters kept by normalize_punctuation_char, the ones of a language fit and the rare ones are evicted
+PUNCTUATION_CACHE_SIZE = 2**13
 
-    return text
+
+@lru_cache(maxsize=PUNCTUATION_CACHE_SIZE)
+def normalize_punctuation_char(char: str) -> str:
+    # ! category(char)[0] is just the major class (i.g. "P") and never matches the categories above.
+    # Kept to not change the output.
+    if unicodedata.category(char)[0] in PUNCTUATION_CATEGORIES:
+        return unidecode.unidecode(char)
+    return char
+
+
+def normalize_punctuation(text: str):
+    return "".join(map(normalize_punctuation_char, text))
 
 
 def encode_to_url(text: str):
     return quote(text, safe="")
+
+
+class TitleCodec:
+    """
+    encode_id/decode_id with a bounded LRU cache.
+
+    Titles repeat a lot (popular pages receive millions of links), so the hot ones are encoded/decoded once per process.
+    The cache size is set by WBDSM_TITLE_CACHE_SIZE (entries per function) or by configure.
+    """
+
+    def __init__(self, maxsize: int = 2**16):
+        self.configure(maxsize)
+
+    def configure(self, maxsize: int):
+        """Set the cache size, clearing the caches."""
+        self.maxsize = maxsize
+        self.encode_id = lru_cache(maxsize=maxsize)(encode_id)
+        self.decode_id = lru_cache(maxsize=maxsize)(decode_id)
+
+    def cache_info(self) -> dict:
+        """Hits, misses and size of each cache."""
+        return {
+            "encode_id": self.encode_id.cache_info()._asdict(),
+            "decode_id": self.decode_id.cache_info()._asdict(),
+        }
+
+
+title_codec = TitleCodec(int(os.environ.get("WBDSM_TITLE_CACHE_SIZE", 2**16)))
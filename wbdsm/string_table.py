@@ -0,0 +1,156 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+from typing import Iterable, Iterator, Optional, Tuple
+
+MAGIC = b"WBDSMST1"
+# Magic, number of records and number of buckets
+HEADER = struct.Struct("<8sQQ")
+# Bucket: record offset (0 = empty, offsets are shifted by 1) and crc32 of the key
+BUCKET = struct.Struct("<QI")
+SEPARATOR = b"\x00"
+
+
+def write_string_table(path: str, items: Iterable[Tuple[str, Tuple[str, ...]]]) -> int:
+    """
+    Write a read only key -> values table to disk as an open addressing hash table.
+
+    Layout: header | buckets | records. Each record is the key and its values encoded in utf-8 and separated by NUL.
+    The file is meant to be mmap'd by StringTable, so forked processes share the same pages on memory
+    instead of having a python dict each.
+    If a key is repeated, the first one is kept.
+
+    Returns the number of keys written.
+    """
+    offsets = array("Q")
+    hashes = array("I")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Records are streamed to a temporary file as we only know the buckets size at the end
+    with tempfile.TemporaryFile(dir=directory) as records:
+        position = 0
+        for key, values in items:
+            key = key.encode("utf-8")
+            record = SEPARATOR.join([key] + [value.encode("utf-8") for value in values])
+            offsets.append(position)
+            hashes.append(zlib.crc32(key))
+            record = struct.pack("<I", len(record)) + record
+            records.write(record)
+            position += len(record)
+
+        n_records = len(offsets)
+        # Load factor <= 0.5 to keep the probing short
+        n_buckets = 1
+        while n_buckets < 2 * n_records:
+            n_buckets *= 2
+        buckets = array("Q", bytes(8 * n_buckets))
+        bucket_hashes = array("I", bytes(4 * n_buckets))
+        mask = n_buckets - 1
+        records.seek(0)
+        n_keys = 0
+        for offset, key_hash in zip(offsets, hashes):
+            bucket = key_hash & mask
+            while buckets[bucket]:
+                # Same key already stored, keeps the first one
+                if bucket_hashes[bucket] == key_hash and _same_key(
+                    records, buckets[bucket] - 1, offset
+                ):
+                    break
+                bucket = (bucket + 1) & mask
+            else:
+                buckets[bucket] = offset + 1
+                bucket_hashes[bucket] = key_hash
+                n_keys += 1
+        del offsets, hashes
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, n_keys, n_buckets))
+            for offset, key_hash in zip(buckets, bucket_hashes):
+                f.write(BUCKET.pack(offset, key_hash))
+            records.seek(0)
+            while True:
+                chunk = records.read(2**20)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+    return n_keys
+
+
+def _read_record(f, offset: int) -> bytes:
+    f.seek(offset)
+    (size,) = struct.unpack("<I", f.read(4))
+    return f.read(size)
+
+
+def _same_key(f, offset: int, other_offset: int) -> bool:
+    position = f.tell()
+    key = _read_record(f, offset).split(SEPARATOR, 1)[0]
+    other_key = _read_record(f, other_offset).split(SEPARATOR, 1)[0]
+    f.seek(position)
+    return key == other_key
+
+
+class StringTable:
+    """
+    Read only view of a table written by write_string_table.
+
+    The file is mmap'd, lookups are O(1) and don't copy the table to the process memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_keys, self.n_buckets = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a string table")
+        self._mask = self.n_buckets - 1
+        self._records_start = HEADER.size + BUCKET.size * self.n_buckets
+
+    def __len__(self) -> int:
+        return self.n_keys
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def _record(self, offset: int) -> bytes:
+        start = self._records_start + offset
+        (size,) = struct.unpack_from("<I", self._mmap, start)
+        return self._mmap[start + 4 : start + 4 + size]
+
+    def get(self, key: str) -> Optional[Tuple[str, ...]]:
+        """Values of the key or None if not found."""
+        key = key.encode("utf-8")
+        key_hash = zlib.crc32(key)
+        bucket = key_hash & self._mask
+        while True:
+            offset, bucket_hash = BUCKET.unpack_from(
+                self._mmap, HEADER.size + BUCKET.size * bucket
+            )
+            if not offset:
+                return None
+            if bucket_hash == key_hash:
+                record = self._record(offset - 1).split(SEPARATOR)
+                if record[0] == key:
+                    return tuple(value.decode("utf-8") for value in record[1:])
+            bucket = (bucket + 1) & self._mask
+
+    def items(self) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """Iterate over the records in insertion order (repeated keys included)."""
+        position = 0
+        end = len(self._mmap) - self._records_start
+        while position < end:
+            record = self._record(position)
+            position += 4 + len(record)
+            key, *values = record.decode("utf-8").split("\x00")
+            yield key, tuple(values)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
@@ -29,6 +29,36 @@ class WBDSMArgParser(argparse.ArgumentParser):
             default=None,
             help="Last pageID to parse - in case of interruption",
         )
+        self.add_argument(
+            "--plan_path",
+            type=str,
+            default=None,
+            help="Path to save/load the plan of the chunks (pageID boundaries) dispatched by the links extraction app",
+        )
+        self.add_argument(
+            "--reset_ledger",
+            type=boolean_string,
+            default=False,
+            help="Drop the chunk ledger of the links extraction, dispatching all the chunks again instead of only the ones not indexed",
+        )
+        self.add_argument(
+            "--max_in_flight",
+            type=int,
+            default=100,
+            help="Max number of chunks dispatched by the links extraction app and not indexed yet",
+        )
+        self.add_argument(
+            "--ack_timeout",
+            type=float,
+            default=3600,
+            help="Seconds after its dispatch to give up a chunk not indexed (i.g. its worker died), it's marked as failed on the chunk ledger and dispatched again on the next run. 0 to wait forever",
+        )
+        self.add_argument(
+            "--title_resolver_path",
+            type=str,
+            default=None,
+            help="Path to the titles/redirects snapshot used by the workers to resolve links, built if it doesn't exist. Must be the same as TITLE_RESOLVER_PATH on the workers",
+        )
         #
         self.add_argument(
             "--max_chars",
@@ -66,6 +96,42 @@ class WBDSMArgParser(argparse.ArgumentParser):
             metavar="\b",
         )
 
+        self.add_argument(
+            "--split_strategy",
+            default="tail",
+            choices=["tail", "hash"],
+            help="tail: the last validation_size + test_size candidates of the links go to validation and test. hash: a seeded hash of the candidate (or surface) assigns its split with validation_ratio and test_ratio, the same on every rebuild",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--split_by",
+            default="candidate",
+            choices=["candidate", "surface"],
+            help="Unit of the hash split: candidate for one-shot by candidate, surface for one-shot by candidate text surface",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--split_seed",
+            default=0,
+            type=int,
+            help="Seed of the hash split",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--validation_ratio",
+            default=0.05,
+            type=float,
+            help="Proportion of the validation split of the hash split",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--test_ratio",
+            default=0.05,
+            type=float,
+            help="Proportion of the test split of the hash split",
+            metavar="\b",
+        )
+
         self.add_argument(
             "--output_path",
             default="data/bef_format",
@@ -93,6 +159,41 @@ class WBDSMArgParser(argparse.ArgumentParser):
             help="Max rank of the entity, 0 for using all",
             metavar="\b",
         )
+        self.add_argument(
+            "--sampling",
+            default="aggregation",
+            choices=["aggregation", "index"],
+            help="aggregation: $sample of sample_size links and aggregation over them. index: links of each candidate fetched with the links_to index and sampled in python",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--sampling_seed",
+            default=None,
+            type=int,
+            help="Seed of the index sampling",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--n_shards",
+            default=1,
+            type=int,
+            help="Number of shards of the candidates, each one processed on its own process, of the entity linking dataset generation. More than 1 needs --sampling index",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--section_cache_size",
+            default=10000,
+            type=int,
+            help="Number of parsed source docs sections kept in cache between the batches of the dataset generation, split among the shards processes, 0 to disable",
+            metavar="\b",
+        )
+        self.add_argument(
+            "--project_sections",
+            default=True,
+            type=boolean_string,
+            help="Fetch only the sections of the links from the source docs instead of the full documents",
+            metavar="\b",
+        )
         self.add_argument(
             "--sample_size",
             default=1e7,